@@ -1,12 +1,43 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from pydantic import BaseModel
-from cassandra.cluster import Cluster
+from cassandra.cluster import EXEC_PROFILE_DEFAULT
 from cassandra.query import dict_factory
 from datetime import datetime, timezone
-from typing import List
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from collections import OrderedDict, defaultdict
+from itertools import islice, zip_longest
+import asyncio
+import base64
+import binascii
+import bisect
+import functools
+import hashlib
+import heapq
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+import unicodedata
 import logging
 
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conexion_cassandra import CONFIG, PERFIL_ESCANEO, conectar, preparar_lectura
+import metricas
+from consultas_lentas import RegistroLentas, resumir_traza
+from compresion import CompresionMiddleware, etag_coincide
+from modelos import (
+    ContratoResponse, ClusterResponse, ContratoDetalleResponse, ContratoBusquedaResponse,
+    SerieResponse, BatchResponse,
+    contrato_publico, medidor_publico, detalle_publico, busqueda_publica, dumps_json
+)
+
 # --------------------------------------------
 # Configuración básica
 # --------------------------------------------
@@ -21,72 +52,129 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# --------------------------------------------
-# Modelos Pydantic
-# --------------------------------------------
-class MedidorResponse(BaseModel):
-    CodigoMedidor: str
-    Modelo: str
-    Estado: str
-    FechaHora: str
-    Lectura: int
-    ConsumoPeriodo: int
-    TarifaUSD: str
-
-class ContratoResponse(BaseModel):
-    ContratoID: str
-    Nombre: str
-    CI_NIT: int
-    Email: str
-    Telefono: str
-    Latitud: float
-    Longitud: float
-    Distrito: str
-    Zona: str
-    Medidores: List[str]
-
-class ContratoDetalleResponse(BaseModel):
-    ContratoID: str
-    Nombre: str
-    CI_NIT: int
-    Email: str
-    Telefono: str
-    Latitud: float
-    Longitud: float
-    Distrito: str
-    Zona: str
-    Medidores: List[MedidorResponse]
+@app.middleware("http")
+async def medir_latencia(request: Request, call_next):
+    """Latencia por ruta (plantilla, no la URL concreta) y código de estado."""
+    t0 = time.perf_counter()
+    estado = 500
+    try:
+        response = await call_next(request)
+        estado = response.status_code
+        return response
+    finally:
+        ruta = request.scope.get("route")
+        metricas.http_latencia.observar(
+            (request.method, getattr(ruta, "path", "sin_ruta"), str(estado)),
+            time.perf_counter() - t0
+        )
+
+# Caché de respuestas (LRU + TTL) para horas ya cargadas
+CACHE_MAX_ENTRADAS = 4096
+CACHE_TTL_SEGUNDOS = 3600
+
+# Tiles z/x/y de puntos de contratos (memoria + disco)
+TILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiles_cache")
+TILES_MAX_MEMORIA = 8192
+TILE_ZOOM_MIN = 13          # por debajo se usan /lecturas/clusters
+TILE_ZOOM_MAX = 20
+TILE_MAX_AGE = 3600         # segundos de Cache-Control para navegadores y proxies
+
+# Paginación por cursor (cabecera X-Next-Cursor)
+IDENTIFICAR_FETCH_SIZE = 50
+MAX_FETCH_SIZE = 1000
+
+# Lote de contratos/medidores (/lecturas/batch)
+BATCH_MAX_IDS = 1000
+BATCH_CONCURRENCIA = 128    # lecturas de una partición en vuelo por petición
+
+# Consumo diario (rollup resumen_dia, partición única ordenada por fecha DESC)
+SERIE_TOTAL = "total"       # debe coincidir con SERIE_TOTAL en Insercion_validacion_lecturas.py
+DIAS_CONSUMO_DIARIO = 15
+
+# Caché HTTP condicional para horas anteriores a la marca de agua de la ingesta
+MARCA_CLAVE = "lecturas"        # debe coincidir con CLAVE_ESTADO en Insercion_validacion_lecturas.py
+MARCA_TTL_SEGUNDOS = 300        # relectura periódica de estado_carga
+HISTORICO_MAX_AGE = 86400       # Cache-Control de respuestas de horas históricas
+
+# Compresión negociada br/gzip (br requiere `pip install brotli`)
+COMPRESION_MINIMO = 1024        # bytes; por debajo no compensa
+COMPRESION_NIVEL_GZIP = 6
+COMPRESION_CALIDAD_BR = 4       # 4-5: casi el tamaño de br 11 a una fracción del CPU
+
+# Registro de consultas lentas (/debug/slow_queries)
+LENTAS_UMBRAL_SEGUNDOS = float(os.environ.get("SEMAPA_SLOW_QUERY_MS", "500")) / 1000
+LENTAS_MUESTREO = float(os.environ.get("SEMAPA_SLOW_QUERY_SAMPLE", "0.001"))   # fracción trazada siempre
+LENTAS_MAX_ENTRADAS = 200
+LENTAS_INTERVALO_RETRAZA = 60   # segundos mínimos entre re-trazas de la misma consulta
+LENTAS_ESPERA_TRAZA = 2.0       # segundos de espera por página al leer system_traces
+
+# Heatmap de consumo (/dashboard/heatmap): rejilla lat/lon de `resolution` metros
+HEATMAP_RESOLUCION = 250
+HEATMAP_RES_MIN = 50
+HEATMAP_RES_MAX = 5000
+HEATMAP_MAX_CELDAS = 250_000
+METROS_POR_GRADO = 111_320
+
+# Anomalías por día (/dashboard/anomalias), escritas por Detectar_anomalias.py
+ANOMALIA_TIPOS = ("pico", "flujo_nocturno")   # debe coincidir con TIPO_* en Detectar_anomalias.py
+ANOMALIAS_LIMITE = 100
+ANOMALIAS_MAX_LIMITE = 1000
+
+# Top de consumidores (/dashboard/top_consumidores)
+TOP_N_GUARDADO = 100        # debe coincidir con TOP_N en Insercion_validacion_lecturas.py
+TOP_GRUPO_TOTAL = "total"   # debe coincidir con GRUPO_TOTAL en Insercion_validacion_lecturas.py
+TOP_LIMITE = 50
+TOP_AMBITOS = ("medidor", "contrato")
+TOP_RANGO_MAX_DIAS = 31     # rangos ad hoc: escaneo de lecturas_medidor por rangos de tokens
+TOP_RANGOS_TOKENS = 64
+TOP_RANGOS_CONCURRENCIA = 8   # rangos escaneándose a la vez por petición
+TOP_RANGOS_FETCH_SIZE = 5000
+
+# Serie temporal de un medidor (/medidores/{codigo}/serie)
+SERIE_MAX_PUNTOS = 500      # tope de buckets por respuesta, sin importar el rango
+SERIE_UNIDADES = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
 
 # --------------------------------------------
 # Conexión Cassandra y consultas preparadas
 # --------------------------------------------
-cluster = Cluster(['127.0.0.1'], protocol_version=4)
-session = cluster.connect('semapa_v9')
-session.row_factory = dict_factory
+# Token-aware, timeouts y ejecución especulativa desde conexion_cassandra.py.
+# Las lecturas de una partición se preparan como idempotentes (especulables);
+# los recorridos completos no, para no duplicar un scan lento.
+session = conectar(row_factory=dict_factory)
+logger.info(f"Cassandra {CONFIG['contact_points']} keyspace {CONFIG['keyspace']}")
+
+# Shards por hora de lecturas_por_hora (debe coincidir con Insercion_validacion_lecturas.py)
+BUCKETS_HORA = 16
 
-stmt_infra_limit = session.prepare("""
+# Precisión geohash de infraestructura_geo (debe coincidir con Insercion_estructuras.py)
+GEOHASH_PRECISION = 6
+
+stmt_infra_geo = preparar_lectura(session, """
     SELECT contrato_id, nombre, ci_nit, email, telefono,
            latitud, longitud, distrito, zona, medidores
-      FROM infraestructura
-     WHERE latitud  >= ?
-       AND latitud  <= ?
-       AND longitud >= ?
-       AND longitud <= ?
-     LIMIT ?
-     ALLOW FILTERING
+      FROM infraestructura_geo
+     WHERE geohash = ?
 """)
 
-stmt_lect_by_codes = session.prepare("""
+stmt_lect_rango = preparar_lectura(session, """
+    SELECT fecha_hora, lectura, consumo_periodo
+      FROM lecturas_medidor
+     WHERE codigo_medidor = ?
+       AND fecha_hora >= ?
+       AND fecha_hora <= ?
+""")
+
+stmt_lect_medidor = preparar_lectura(session, """
     SELECT codigo_medidor, modelo, estado, lectura, consumo_periodo, tarifa_usd, fecha_hora
       FROM lecturas_medidor
-     WHERE fecha_hora = ?
-       AND codigo_medidor IN ?
-     ALLOW FILTERING
+     WHERE codigo_medidor = ?
+       AND fecha_hora = ?
 """)
 
-stmt_infra_by_id = session.prepare("""
+stmt_infra_by_id = preparar_lectura(session, """
     SELECT contrato_id, nombre, ci_nit, email, telefono,
            latitud, longitud, distrito, zona, medidores
       FROM infraestructura
@@ -101,8 +189,74 @@ stmt_infra_by_name = session.prepare("""
      ALLOW FILTERING
 """)
 
+stmt_lect_hora = preparar_lectura(session, """
+    SELECT codigo_medidor, modelo, estado, lectura, consumo_periodo, tarifa_usd
+      FROM lecturas_por_hora
+     WHERE fecha_hora = ?
+       AND bucket = ?
+""")
+
+stmt_resumen_hora = preparar_lectura(session, """
+    SELECT consumo_total, lecturas, medidores, medidores_con_errores
+      FROM resumen_hora
+     WHERE fecha_hora = ?
+""")
+
+stmt_resumen_dim = preparar_lectura(session, """
+    SELECT clave, cantidad, consumo
+      FROM resumen_hora_dimension
+     WHERE fecha_hora = ?
+       AND dimension = ?
+""")
+
+stmt_resumen_dims = preparar_lectura(session, """
+    SELECT dimension, clave, cantidad, consumo
+      FROM resumen_hora_dimension
+     WHERE fecha_hora = ?
+""")
+
+stmt_resumen_dia = preparar_lectura(session, """
+    SELECT fecha, consumo_total
+      FROM resumen_dia
+     WHERE serie = ?
+     LIMIT ?
+""")
+
+stmt_anomalias = preparar_lectura(session, """
+    SELECT puntaje, codigo_medidor, tipo, consumo, esperado, fecha_hora
+      FROM anomalias_dia
+     WHERE fecha = ?
+""")
+
+stmt_top = preparar_lectura(session, """
+    SELECT consumo, id
+      FROM top_consumo
+     WHERE periodo = ? AND ambito = ? AND grupo = ?
+     LIMIT ?
+""")
+
+stmt_estado_carga = preparar_lectura(session, """
+    SELECT fecha_hora, version
+      FROM estado_carga
+     WHERE clave = ?
+""")
+
+stmt_contrato_by_medidor = preparar_lectura(session, """
+    SELECT contrato_id
+      FROM medidor_contrato
+     WHERE codigo_medidor = ?
+""")
+
+stmt_consumo_rango = session.prepare("""
+    SELECT codigo_medidor, consumo_periodo
+      FROM lecturas_medidor
+     WHERE token(codigo_medidor) > ? AND token(codigo_medidor) <= ?
+       AND fecha_hora >= ? AND fecha_hora < ?
+     ALLOW FILTERING
+""")
+
 stmt_infra_all = session.prepare("""
-    SELECT contrato_id, nombre, ci_nit, email, telefono,
+    SELECT contrato_id, nombre, razon_social, ci_nit, email, telefono,
            latitud, longitud, distrito, zona, medidores
       FROM infraestructura
      ALLOW FILTERING
@@ -111,62 +265,1103 @@ stmt_infra_all = session.prepare("""
 # --------------------------------------------
 # Utilidad
 # --------------------------------------------
-def format_tarifa(v: float) -> str:
-    return f"${v:.2f}"
+def respuesta_json(datos, headers: Optional[dict] = None) -> Response:
+    """
+    Camino rápido de serialización: los dicts ya tienen la forma del
+    response_model, así que se codifican directo a bytes sin construir ni
+    revalidar modelos Pydantic (el esquema OpenAPI no cambia).
+    """
+    cuerpo = datos if isinstance(datos, bytes) else dumps_json(datos)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+async def ejecutar(stmt, params=None) -> list:
+    """
+    Ejecuta una consulta con session.execute_async y espera todas sus páginas
+    como un future de asyncio, sin bloquear el event loop ni el threadpool.
+    """
+    loop = asyncio.get_running_loop()
+    resultado = loop.create_future()
+    filas = []
+    trazar = registro_lentas.muestrear()
+    t0 = time.perf_counter()
+    rf = session.execute_async(stmt, params, trace=trazar)
+
+    def terminar(valor=None, error=None):
+        if resultado.done():
+            return
+        if error is not None:
+            resultado.set_exception(error)
+        else:
+            resultado.set_result(valor)
+
+    def on_pagina(rows):
+        filas.extend(rows)
+        if rf.has_more_pages:
+            rf.start_fetching_next_page()
+        else:
+            loop.call_soon_threadsafe(terminar, filas)
+
+    def on_error(exc):
+        loop.call_soon_threadsafe(terminar, None, exc)
+
+    rf.add_callbacks(on_pagina, on_error)
+    return await medir_consulta(stmt, params, t0, resultado, rf if trazar else None)
+
+def puede_retrazar(stmt, perfil=EXEC_PROFILE_DEFAULT) -> bool:
+    """
+    Solo se repite con trace=True una lectura idempotente (preparar_lectura)
+    que no sea un escaneo: repetir un escaneo lento duplicaría su costo.
+    """
+    if perfil == PERFIL_ESCANEO or not getattr(stmt, "is_idempotent", False):
+        return False
+    return "ALLOW FILTERING" not in " ".join(metricas.cql_de(stmt).upper().split())
+
+async def medir_consulta(stmt, params, t0: float, resultado, rf_trazado=None,
+                         paging_state: Optional[bytes] = None, perfil=EXEC_PROFILE_DEFAULT):
+    """
+    Espera el future de una consulta registrando su latencia, filas y errores.
+    Si salió en el muestreo, o fue lenta y se puede repetir, su traza se guarda
+    en segundo plano.
+    """
+    consulta = metricas.etiqueta_consulta(stmt)
+    try:
+        valor = await resultado
+    except Exception:
+        metricas.cassandra_errores.incrementar((consulta,))
+        raise
+    finally:
+        duracion = time.perf_counter() - t0
+        metricas.cassandra_latencia.observar((consulta,), duracion)
+    filas = valor[0] if isinstance(valor, tuple) else valor
+    metricas.cassandra_filas.observar((consulta,), len(filas))
+
+    if rf_trazado is not None or (puede_retrazar(stmt, perfil) and registro_lentas.debe_retrazar(consulta, duracion)):
+        tarea = asyncio.create_task(guardar_traza(stmt, params, consulta, duracion, rf_trazado, paging_state))
+        tareas_trazas.add(tarea)
+        tarea.add_done_callback(tareas_trazas.discard)
+    return valor
+
+registro_lentas = RegistroLentas(
+    LENTAS_MAX_ENTRADAS, LENTAS_UMBRAL_SEGUNDOS, LENTAS_MUESTREO, LENTAS_INTERVALO_RETRAZA
+)
+tareas_trazas = set()
+
+async def guardar_traza(stmt, params, consulta: str, duracion: float, rf=None,
+                        paging_state: Optional[bytes] = None):
+    """
+    Lee la traza de system_traces (en un hilo: el driver la consulta de forma
+    bloqueante) y la guarda en el registro. Sin traza previa, la consulta lenta
+    (ya filtrada por puede_retrazar) se repite con trace=True, sobre la misma
+    página si venía paginada.
+    """
+    lenta = duracion >= LENTAS_UMBRAL_SEGUNDOS > 0
+    try:
+        if rf is None:
+            rf = session.execute_async(stmt, params, trace=True, paging_state=paging_state)
+            await asyncio.to_thread(rf.result)
+        trazas = await asyncio.to_thread(rf.get_all_query_traces, LENTAS_ESPERA_TRAZA)
+        registro_lentas.registrar(
+            consulta, metricas.cql_de(stmt), params, duracion,
+            "umbral" if lenta else "muestreo", resumir_traza(trazas)
+        )
+    except Exception as e:
+        logger.warning(f"No se pudo obtener la traza de {consulta}: {e}")
+
+async def ejecutar_pagina(stmt, params, fetch_size: int, paging_state: Optional[bytes] = None,
+                          perfil=EXEC_PROFILE_DEFAULT) -> tuple:
+    """
+    Una sola página de una consulta preparada: (filas, paging_state siguiente o None).
+    La memoria por petición queda acotada por fetch_size.
+    """
+    loop = asyncio.get_running_loop()
+    resultado = loop.create_future()
+    bound = stmt.bind(params)
+    bound.fetch_size = fetch_size
+    trazar = registro_lentas.muestrear()
+    t0 = time.perf_counter()
+    rf = session.execute_async(bound, paging_state=paging_state, trace=trazar, execution_profile=perfil)
+
+    def terminar(valor=None, error=None):
+        if resultado.done():
+            return
+        if error is not None:
+            resultado.set_exception(error)
+        else:
+            resultado.set_result(valor)
+
+    def on_pagina(_rows):
+        # El callback corre con el resultado ya fijado: result() no bloquea
+        pagina = rf.result()
+        siguiente = pagina.paging_state if pagina.has_more_pages else None
+        loop.call_soon_threadsafe(terminar, (pagina.current_rows, siguiente))
+
+    def on_error(exc):
+        loop.call_soon_threadsafe(terminar, None, exc)
+
+    rf.add_callbacks(on_pagina, on_error)
+    return await medir_consulta(bound, None, t0, resultado, rf if trazar else None, paging_state, perfil)
+
+def huella_consulta(**params) -> str:
+    """Huella corta de los parámetros de una consulta paginada."""
+    texto = "&".join(f"{k}={params[k]}" for k in sorted(params))
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()[:16]
+
+def codificar_cursor(datos: dict, **params) -> str:
+    """
+    Cursor opaco para el cliente (JSON en base64 url-safe). Lleva la huella de
+    los parámetros de la consulta para que no se pueda reusar con otros.
+    """
+    datos = {**datos, "h": huella_consulta(**params)}
+    return base64.urlsafe_b64encode(json.dumps(datos, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+def decodificar_cursor(cursor: str, **params) -> dict:
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(datos, dict):
+            raise ValueError(cursor)
+    except (ValueError, binascii.Error, UnicodeError):
+        raise HTTPException(400, "Cursor inválido")
+    if datos.get("h") != huella_consulta(**params):
+        raise HTTPException(400, "El cursor no corresponde a esta consulta")
+    return datos
+
+async def ejecutar_uno(stmt, params=None) -> Optional[dict]:
+    filas = await ejecutar(stmt, params)
+    return filas[0] if filas else None
+
+async def ejecutar_concurrente(stmt, lista_params, concurrencia: int = BATCH_CONCURRENCIA) -> list:
+    """
+    Equivalente async de execute_concurrent_with_args: ejecuta `stmt` con cada
+    juego de parámetros con a lo sumo `concurrencia` consultas en vuelo y
+    devuelve [(ok, filas | excepción)] en el mismo orden.
+    """
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def una(params):
+        async with semaforo:
+            try:
+                return True, await ejecutar(stmt, params)
+            except Exception as e:
+                return False, e
+
+    return await asyncio.gather(*(una(p) for p in lista_params))
+
+async def lecturas_de_medidores(meds: list, fh: datetime) -> dict:
+    """
+    codigo_medidor -> filas de la hora, con una lectura de una sola partición
+    por medidor lanzadas en paralelo (en lugar de `codigo_medidor IN ?`, que
+    carga a un solo coordinador con todas las particiones).
+    """
+    resultados = await ejecutar_concurrente(stmt_lect_medidor, [(md, fh) for md in meds])
+    for ok, filas in resultados:
+        if not ok:
+            raise filas
+    return {md: filas for md, (_, filas) in zip(meds, resultados) if filas}
+
+async def lecturas_de_hora(fh: datetime) -> list:
+    """
+    Todas las lecturas de una hora, leyendo los BUCKETS_HORA shards de
+    lecturas_por_hora en paralelo (una partición por bucket, sin ALLOW FILTERING).
+    """
+    partes = await asyncio.gather(*(ejecutar(stmt_lect_hora, (fh, b)) for b in range(BUCKETS_HORA)))
+    return [r for parte in partes for r in parte]
+
+def totales_resumen(r) -> dict:
+    r = r or {}
+    return {k: r.get(k) or 0 for k in ("consumo_total", "lecturas", "medidores", "medidores_con_errores")}
+
+async def resumen_de_hora(fh: datetime) -> dict:
+    """Totales de la hora precalculados en la carga (resumen_hora, una sola partición)."""
+    return totales_resumen(await ejecutar_uno(stmt_resumen_hora, (fh,)))
+
+async def resumen_por_dimension(fh: datetime, dimension: str) -> list:
+    """Filas (clave, cantidad, consumo) de resumen_hora_dimension para una hora y dimensión."""
+    return [
+        {"clave": r["clave"], "cantidad": r.get("cantidad") or 0, "consumo": r.get("consumo") or 0}
+        for r in await ejecutar(stmt_resumen_dim, (fh, dimension))
+    ]
+
+# --------------------------------------------
+# Índice medidor -> contrato (cargado al arrancar desde medidor_contrato)
+# --------------------------------------------
+MEDIDOR_A_CONTRATO = {}
+
+async def cargar_indice_medidores():
+    MEDIDOR_A_CONTRATO.clear()
+    for r in await ejecutar("SELECT codigo_medidor, contrato_id FROM medidor_contrato"):
+        MEDIDOR_A_CONTRATO[r["codigo_medidor"]] = r["contrato_id"]
+    logger.info(f"Índice medidor -> contrato cargado: {len(MEDIDOR_A_CONTRATO)} medidores")
+
+async def contrato_de_medidor(codigo: str) -> Optional[str]:
+    """
+    Contrato dueño de un medidor: acierto O(1) en el índice en memoria o, para
+    medidores cargados después del arranque, lectura de una sola partición.
+    """
+    cid = MEDIDOR_A_CONTRATO.get(codigo)
+    if cid is None:
+        r = await ejecutar_uno(stmt_contrato_by_medidor, (codigo,))
+        if r:
+            cid = MEDIDOR_A_CONTRATO[codigo] = r["contrato_id"]
+    return cid
+
+async def contratos_de_medidores(codigos: list) -> list:
+    """
+    contrato_de_medidor para una lista: los que no están en el índice se leen
+    con ejecutar_concurrente (BATCH_CONCURRENCIA en vuelo). Devuelve
+    [(ok, contrato_id | None | excepción)] en el mismo orden que `codigos`.
+    """
+    resultado = [(True, MEDIDOR_A_CONTRATO.get(c)) for c in codigos]
+    faltan = [k for k, (_, cid) in enumerate(resultado) if cid is None]
+    leidos = await ejecutar_concurrente(stmt_contrato_by_medidor, [(codigos[k],) for k in faltan])
+    for k, (ok, filas) in zip(faltan, leidos):
+        if not ok:
+            resultado[k] = (False, filas)
+        elif filas:
+            cid = MEDIDOR_A_CONTRATO[codigos[k]] = filas[0]["contrato_id"]
+            resultado[k] = (True, cid)
+    return resultado
+
+# --------------------------------------------
+# Índice espacial de contratos (celdas geohash en memoria)
+# --------------------------------------------
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_BITS = GEOHASH_PRECISION * 5
+GEOHASH_LON_BITS = (GEOHASH_BITS + 1) // 2
+GEOHASH_LAT_BITS = GEOHASH_BITS // 2
+MAX_CELDAS_CASSANDRA = 512   # tope de particiones por bbox cuando no hay índice en memoria
+
+def celda_de(lat: float, lon: float) -> tuple:
+    """Celda (ix, iy) de la rejilla geohash que contiene el punto."""
+    ix = int((lon + 180.0) / 360.0 * (1 << GEOHASH_LON_BITS))
+    iy = int((lat + 90.0) / 180.0 * (1 << GEOHASH_LAT_BITS))
+    return (min(max(ix, 0), (1 << GEOHASH_LON_BITS) - 1),
+            min(max(iy, 0), (1 << GEOHASH_LAT_BITS) - 1))
+
+def geohash_de_celda(ix: int, iy: int) -> str:
+    """Geohash de una celda, intercalando bits de longitud y latitud."""
+    codigo = 0
+    for k in range(GEOHASH_BITS):
+        if k % 2 == 0:
+            bit = (ix >> (GEOHASH_LON_BITS - 1 - k // 2)) & 1
+        else:
+            bit = (iy >> (GEOHASH_LAT_BITS - 1 - k // 2)) & 1
+        codigo = (codigo << 1) | bit
+    return "".join(
+        GEOHASH_BASE32[(codigo >> (5 * (GEOHASH_PRECISION - 1 - c))) & 31]
+        for c in range(GEOHASH_PRECISION)
+    )
+
+def rango_celdas(lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> tuple:
+    ix0, iy0 = celda_de(lat_min, lon_min)
+    ix1, iy1 = celda_de(lat_max, lon_max)
+    return ix0, ix1, iy0, iy1
+
+class IndiceEspacial:
+    """Rejilla en memoria: celda geohash -> contratos de esa celda ordenados por contrato_id."""
+
+    def __init__(self):
+        self.celdas = {}
+
+    def __len__(self):
+        return len(self.celdas)
+
+    def cargar(self, filas):
+        celdas = {}
+        for f in filas:
+            if f.get("latitud") is None or f.get("longitud") is None:
+                continue
+            celdas.setdefault(celda_de(f["latitud"], f["longitud"]), []).append(f)
+        for contratos in celdas.values():
+            contratos.sort(key=lambda f: f["contrato_id"])
+        self.celdas = celdas
+
+    def grupos_en(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> list:
+        """Listas de contratos de las celdas que se solapan con el bbox."""
+        ix0, ix1, iy0, iy1 = rango_celdas(lat_min, lat_max, lon_min, lon_max)
+        if (ix1 - ix0 + 1) * (iy1 - iy0 + 1) <= len(self.celdas):
+            claves = ((ix, iy) for ix in range(ix0, ix1 + 1) for iy in range(iy0, iy1 + 1))
+            return [self.celdas[c] for c in claves if c in self.celdas]
+        return [
+            contratos for (ix, iy), contratos in self.celdas.items()
+            if ix0 <= ix <= ix1 and iy0 <= iy <= iy1
+        ]
+
+indice_espacial = IndiceEspacial()
+
+# --------------------------------------------
+# Clusters de contratos por nivel de zoom (rejilla Web Mercator)
+# --------------------------------------------
+CLUSTER_ZOOM_MIN = 8
+CLUSTER_ZOOM_MAX = 16
+CLUSTER_SUBDIVISION = 2   # cada tile de mapa se divide en 2^2 x 2^2 celdas de cluster
+
+def tile_de(lat: float, lon: float, z: int) -> tuple:
+    """Tile (x, y) de la rejilla Web Mercator (esquema z/x/y) que contiene el punto."""
+    n = 1 << z
+    lat = min(max(lat, -85.0511), 85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+class IndiceClusters:
+    """
+    Celdas precalculadas por zoom a partir de las coordenadas de los contratos:
+    niveles[z][(x, y)] = [contratos, suma_lat, suma_lon], y para cada contrato
+    la celda que le toca en cada nivel (para repartir el consumo de una hora).
+    """
+
+    def __init__(self):
+        self.niveles = {}
+        self.celdas_de_contrato = {}
+
+    def cargar(self, filas):
+        zooms = range(CLUSTER_ZOOM_MIN, CLUSTER_ZOOM_MAX + 1)
+        niveles = {z: {} for z in zooms}
+        celdas_de_contrato = {}
+        for f in filas:
+            lat, lon = f.get("latitud"), f.get("longitud")
+            if lat is None or lon is None:
+                continue
+            celdas = []
+            for z in zooms:
+                celda = tile_de(lat, lon, z + CLUSTER_SUBDIVISION)
+                acc = niveles[z].setdefault(celda, [0, 0.0, 0.0])
+                acc[0] += 1
+                acc[1] += lat
+                acc[2] += lon
+                celdas.append(celda)
+            celdas_de_contrato[f["contrato_id"]] = celdas
+        self.niveles = niveles
+        self.celdas_de_contrato = celdas_de_contrato
+
+indice_clusters = IndiceClusters()
+
+async def consumo_clusters_de_hora(fecha_hora: str, fh: datetime) -> dict:
+    """
+    Consumo de la hora sumado por celda de cluster en cada zoom. Se calcula una
+    vez por hora (lecturas_por_hora + índice medidor -> contrato) y se guarda en
+    la caché de respuestas, así que se invalida junto con esa hora.
+    """
+    fecha_hora = fh.strftime("%Y-%m-%d %H:%M")
+    clave = ("consumo_clusters", (("fecha_hora", fecha_hora),))
+    niveles = cache_respuestas.get(clave)
+    if niveles is not None:
+        return niveles
+
+    por_contrato = defaultdict(int)
+    for r in await lecturas_de_hora(fh):
+        cid = MEDIDOR_A_CONTRATO.get(r["codigo_medidor"])
+        if cid:
+            por_contrato[cid] += r.get("consumo_periodo") or 0
+
+    zooms = range(CLUSTER_ZOOM_MIN, CLUSTER_ZOOM_MAX + 1)
+    niveles = {z: defaultdict(int) for z in zooms}
+    for cid, consumo in por_contrato.items():
+        for z, celda in zip(zooms, indice_clusters.celdas_de_contrato.get(cid, ())):
+            niveles[z][celda] += consumo
+
+    cache_respuestas.put(clave, niveles, fecha_hora)
+    return niveles
+
+class RejillaHeatmap:
+    """
+    Coordenadas de los contratos en arrays numpy y, para cada medidor, la
+    posición de su contrato en esos arrays. Con eso el consumo de una hora se
+    reparte en una rejilla lat/lon con un solo np.histogram2d.
+    """
+
+    def __init__(self):
+        self.lat = np.empty(0)
+        self.lon = np.empty(0)
+        self.posicion_de_medidor = {}
+
+    def __len__(self):
+        return len(self.lat)
+
+    def cargar(self, filas):
+        lat, lon, posicion_de_medidor = [], [], {}
+        for f in filas:
+            if f.get("latitud") is None or f.get("longitud") is None:
+                continue
+            for md in f.get("medidores") or ():
+                posicion_de_medidor[md] = len(lat)
+            lat.append(f["latitud"])
+            lon.append(f["longitud"])
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.posicion_de_medidor = posicion_de_medidor
+
+    def rejilla(self, metros: int) -> tuple:
+        """(lat_min, lon_min, paso_lat, paso_lon, filas, columnas) que cubre todos los contratos."""
+        lat_min, lat_max = float(self.lat.min()), float(self.lat.max())
+        lon_min, lon_max = float(self.lon.min()), float(self.lon.max())
+        paso_lat = metros / METROS_POR_GRADO
+        paso_lon = metros / (METROS_POR_GRADO * math.cos(math.radians((lat_min + lat_max) / 2)))
+        return (lat_min, lon_min, paso_lat, paso_lon,
+                int((lat_max - lat_min) // paso_lat) + 1, int((lon_max - lon_min) // paso_lon) + 1)
+
+    def histograma(self, filas_lecturas: list, metros: int) -> list:
+        """Consumo por celda de las lecturas dadas: [{id, lat, lng, consumo}] de celdas con consumo."""
+        lat_min, lon_min, paso_lat, paso_lon, n_filas, n_columnas = self.rejilla(metros)
+        if n_filas * n_columnas > HEATMAP_MAX_CELDAS:
+            raise HTTPException(400, "Resolución demasiado fina para el área de la ciudad")
+
+        posiciones = np.fromiter(
+            (self.posicion_de_medidor.get(r["codigo_medidor"], -1) for r in filas_lecturas),
+            dtype=np.int64, count=len(filas_lecturas)
+        )
+        consumos = np.fromiter(
+            ((r.get("consumo_periodo") or 0) for r in filas_lecturas),
+            dtype=np.float64, count=len(filas_lecturas)
+        )
+        conocidas = posiciones >= 0
+        posiciones, consumos = posiciones[conocidas], consumos[conocidas]
+
+        totales, _, _ = np.histogram2d(
+            self.lat[posiciones], self.lon[posiciones],
+            bins=(n_filas, n_columnas),
+            range=((lat_min, lat_min + n_filas * paso_lat), (lon_min, lon_min + n_columnas * paso_lon)),
+            weights=consumos,
+        )
+        iy, ix = np.nonzero(totales)
+        return [
+            {
+                "id": f"{y}-{x}",
+                "lat": round(lat_min + (y + 0.5) * paso_lat, 6),
+                "lng": round(lon_min + (x + 0.5) * paso_lon, 6),
+                "consumo": int(c),
+            }
+            for y, x, c in zip(iy.tolist(), ix.tolist(), totales[iy, ix].tolist())
+        ]
+
+rejilla_heatmap = RejillaHeatmap()
+
+# zona -> medidores, para filtrar por zona los tops de rangos ad hoc
+MEDIDORES_POR_ZONA = {}
+
+async def cargar_indice_espacial():
+    filas = await ejecutar(stmt_infra_all)
+    indice_espacial.cargar(filas)
+    indice_clusters.cargar(filas)
+    rejilla_heatmap.cargar(filas)
+    MEDIDORES_POR_ZONA.clear()
+    for f in filas:
+        MEDIDORES_POR_ZONA.setdefault(f.get("zona") or "SIN_ZONA", set()).update(f.get("medidores") or ())
+    indice_nombres.cargar(filas)
+
+    # Versión de los tiles: cambia solo si cambian los contratos publicados
+    huella = hashlib.sha1()
+    for f in sorted(filas, key=lambda f: f["contrato_id"]):
+        huella.update(json.dumps(contrato_publico(f), sort_keys=True, default=str).encode("utf-8"))
+    cache_tiles.nueva_version(huella.hexdigest()[:16])
+    logger.info(f"Índice espacial cargado: {len(indice_espacial)} celdas, tiles {cache_tiles.version}, "
+                f"{len(indice_nombres)} contratos en búsqueda")
+
+async def contratos_en_bbox(lat_min: float, lat_max: float, lon_min: float, lon_max: float,
+                            limite: int, desde: int = 0) -> list:
+    """
+    Contratos dentro del bbox tocando solo las celdas que se solapan con él.
+    Usa el índice en memoria y, si aún no está cargado, lee en paralelo las
+    particiones de infraestructura_geo de esas celdas. Con más contratos que
+    `limite` se toman por turnos de cada celda para repartirlos en el viewport;
+    `desde` salta los primeros de ese mismo orden (paginación).
+    """
+    if len(indice_espacial):
+        grupos = indice_espacial.grupos_en(lat_min, lat_max, lon_min, lon_max)
+    else:
+        ix0, ix1, iy0, iy1 = rango_celdas(lat_min, lat_max, lon_min, lon_max)
+        if (ix1 - ix0 + 1) * (iy1 - iy0 + 1) > MAX_CELDAS_CASSANDRA:
+            raise HTTPException(400, "El área solicitada es demasiado grande")
+        grupos = await asyncio.gather(*(
+            ejecutar(stmt_infra_geo, (geohash_de_celda(ix, iy),))
+            for ix in range(ix0, ix1 + 1) for iy in range(iy0, iy1 + 1)
+        ))
+
+    grupos = [
+        (f for f in g if lat_min <= f["latitud"] <= lat_max and lon_min <= f["longitud"] <= lon_max)
+        for g in grupos
+    ]
+    intercalados = (f for ronda in zip_longest(*grupos) for f in ronda if f is not None)
+    return list(islice(intercalados, max(desde, 0), max(desde, 0) + max(limite, 0)))
+
+# --------------------------------------------
+# Índice de búsqueda de contratos (nombre, razón social, CI/NIT)
+# --------------------------------------------
+BUSQUEDA_LIMITE = 10
+BUSQUEDA_MAX_LIMITE = 100
+BUSQUEDA_SIMILITUD_MIN = 0.4    # Dice de trigramas para aceptar un término con errores
+
+def normalizar_texto(texto) -> str:
+    """Minúsculas, sin tildes y solo letras/dígitos separados por espacio."""
+    texto = unicodedata.normalize("NFKD", str(texto or ""))
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    return " ".join("".join(c if c.isalnum() else " " for c in texto).split())
+
+def trigramas(termino: str) -> set:
+    t = f"  {termino} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+class IndiceNombres:
+    """
+    Índice invertido en memoria sobre nombre, razón social y CI/NIT:
+    término -> contratos, vocabulario ordenado para prefijos (bisect) y
+    trigrama -> términos para coincidencias aproximadas. Cada término de la
+    consulta debe coincidir (exacto > prefijo > aproximado) y los contratos se
+    ordenan por puntaje.
+    """
+
+    def __init__(self):
+        self.contratos = {}      # contrato_id -> fila de infraestructura
+        self.nombres = {}        # contrato_id -> nombre normalizado
+        self.por_nombre = {}     # nombre normalizado -> [contrato_id]
+        self.terminos = {}       # término -> set(contrato_id)
+        self.vocabulario = []    # términos ordenados
+        self.por_trigrama = {}   # trigrama -> set(término)
+        self.n_trigramas = {}    # término -> cantidad de trigramas distintos
+
+    def __len__(self):
+        return len(self.contratos)
+
+    def cargar(self, filas):
+        contratos, nombres, terminos, por_trigrama = {}, {}, defaultdict(set), defaultdict(set)
+        for f in filas:
+            cid = f["contrato_id"]
+            contratos[cid] = f
+            nombres[cid] = normalizar_texto(f.get("nombre"))
+            texto = " ".join(normalizar_texto(f.get(c)) for c in ("nombre", "razon_social", "ci_nit"))
+            for t in texto.split():
+                terminos[t].add(cid)
+        n_trigramas = {}
+        for t in terminos:
+            grams = trigramas(t)
+            n_trigramas[t] = len(grams)
+            for g in grams:
+                por_trigrama[g].add(t)
+        self.contratos = contratos
+        self.nombres = nombres
+        por_nombre = defaultdict(list)
+        for cid, nombre in nombres.items():
+            por_nombre[nombre].append(cid)
+        self.por_nombre = dict(por_nombre)
+        self.terminos = dict(terminos)
+        self.vocabulario = sorted(terminos)
+        self.por_trigrama = dict(por_trigrama)
+        self.n_trigramas = n_trigramas
+
+    def _candidatos(self, termino: str) -> dict:
+        """contrato_id -> puntaje del mejor término del índice que coincide con `termino`."""
+        puntajes = {}
+
+        def sumar(t, puntaje):
+            for cid in self.terminos[t]:
+                if puntaje > puntajes.get(cid, 0.0):
+                    puntajes[cid] = puntaje
+
+        # Prefijos (incluye la coincidencia exacta)
+        i = bisect.bisect_left(self.vocabulario, termino)
+        while i < len(self.vocabulario) and self.vocabulario[i].startswith(termino):
+            t = self.vocabulario[i]
+            sumar(t, 3.0 if t == termino else 2.0 + len(termino) / len(t) * 0.5)
+            i += 1
+        if puntajes or len(termino) < 3:
+            return puntajes
+
+        # Aproximado: términos que comparten suficientes trigramas
+        grams = trigramas(termino)
+        comunes = defaultdict(int)
+        for g in grams:
+            for t in self.por_trigrama.get(g, ()):
+                comunes[t] += 1
+        for t, n in comunes.items():
+            similitud = 2.0 * n / (len(grams) + self.n_trigramas[t])
+            if similitud >= BUSQUEDA_SIMILITUD_MIN:
+                sumar(t, similitud)
+        return puntajes
+
+    def buscar(self, q: str, limite: int = BUSQUEDA_LIMITE, desde: int = 0) -> list:
+        """[(fila, puntaje)] de los contratos que coinciden con `q`, mejor primero."""
+        consulta = normalizar_texto(q)
+        if not consulta or not self.contratos:
+            return []
+
+        total = None
+        for termino in consulta.split():
+            puntajes = self._candidatos(termino)
+            if total is None:
+                total = puntajes
+            else:
+                total = {cid: p + puntajes[cid] for cid, p in total.items() if cid in puntajes}
+            if not total:
+                return []
+
+        # Bonus si el nombre completo empieza por la consulta
+        for cid in total:
+            if self.nombres[cid].startswith(consulta):
+                total[cid] += 1.0
+
+        mejores = heapq.nsmallest(
+            max(desde, 0) + max(limite, 0), total.items(),
+            key=lambda kv: (-kv[1], len(self.nombres[kv[0]]), self.nombres[kv[0]], kv[0])
+        )
+        return [(self.contratos[cid], round(p, 3)) for cid, p in mejores[max(desde, 0):]]
+
+    def exactos(self, q: str) -> list:
+        """Filas cuyo nombre normalizado es igual al de `q` (sin prefijos ni aproximados)."""
+        return [self.contratos[cid] for cid in self.por_nombre.get(normalizar_texto(q), ())]
+
+indice_nombres = IndiceNombres()
+
+# --------------------------------------------
+# Caché de respuestas
+# --------------------------------------------
+class CacheRespuestas:
+    """
+    Caché LRU con expiración por TTL, indexada por (endpoint, parámetros).
+    Guarda además qué claves dependen de cada fecha_hora para poder
+    invalidarlas cuando los cargadores escriben esas horas.
+    """
+
+    def __init__(self, max_entradas: int, ttl: float):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()   # clave -> (expira_en, valor)
+        self._por_hora = {}           # fecha_hora -> set(claves)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, clave):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    self._quitar(clave)
+                self.misses += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.hits += 1
+            return item[1]
+
+    def put(self, clave, valor, fecha_hora: Optional[str] = None):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            self._por_hora.setdefault(fecha_hora, set()).add(clave)
+            while len(self._datos) > self.max_entradas:
+                self._quitar(next(iter(self._datos)))
+
+    def invalidar(self, fechas_hora: Optional[List[str]] = None) -> int:
+        """
+        Elimina las entradas de las horas indicadas y las que no dependen de una
+        hora concreta (p. ej. consumo_diario). Sin horas, vacía toda la caché.
+        """
+        with self._lock:
+            if fechas_hora is None:
+                n = len(self._datos)
+                self._datos.clear()
+                self._por_hora.clear()
+                return n
+            claves = set(self._por_hora.get(None, ()))
+            for fh in fechas_hora:
+                claves |= self._por_hora.get(fh, set())
+            for clave in claves:
+                self._quitar(clave)
+            return len(claves)
+
+    def invalidar_funciones(self, nombres) -> int:
+        """Elimina todas las entradas de las funciones cacheadas indicadas."""
+        with self._lock:
+            claves = [clave for clave in self._datos if clave[0] in nombres]
+            for clave in claves:
+                self._quitar(clave)
+            return len(claves)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "ttl_segundos": self.ttl,
+            }
+
+    def _quitar(self, clave):
+        self._datos.pop(clave, None)
+        fh = dict(clave[1]).get("fecha_hora")
+        claves = self._por_hora.get(fh)
+        if claves is not None:
+            claves.discard(clave)
+            if not claves:
+                del self._por_hora[fh]
+
+cache_respuestas = CacheRespuestas(CACHE_MAX_ENTRADAS, CACHE_TTL_SEGUNDOS)
+
+# Entradas que dependen de infraestructura o de los índices en memoria
+CACHE_DEPENDE_DE_INFRA = ("payload_buscar", "consumo_clusters", "payload_heatmap",
+                          "top_consumidores", "anomalias")
+
+class CacheTiles:
+    """
+    Payloads JSON de tiles z/x/y para la versión actual de la infraestructura.
+    Se guardan en memoria (LRU) y en disco bajo TILES_DIR/<version>/z/x/y.json,
+    así que sobreviven a reinicios y solo se regeneran cuando cambia la versión.
+    """
+
+    def __init__(self, directorio: str, max_entradas: int):
+        self.directorio = directorio
+        self.version = None
+        self.memoria = CacheRespuestas(max_entradas, float("inf"))
+
+    def nueva_version(self, version: str):
+        if version == self.version:
+            return
+        self.version = version
+        self.memoria.invalidar()
+        if os.path.isdir(self.directorio):
+            for nombre in os.listdir(self.directorio):
+                if nombre != version:
+                    shutil.rmtree(os.path.join(self.directorio, nombre), ignore_errors=True)
+
+    def _ruta(self, version: str, z: int, x: int, y: int) -> str:
+        return os.path.join(self.directorio, version, str(z), str(x), f"{y}.json")
+
+    async def obtener(self, z: int, x: int, y: int, construir) -> tuple:
+        """Devuelve (version, payload) del tile, generándolo con `construir` si hace falta."""
+        version = self.version
+        clave = ("tile", (("v", version), ("z", z), ("x", x), ("y", y)))
+        payload = self.memoria.get(clave)
+        if payload is None:
+            ruta = self._ruta(version, z, x, y)
+            payload = await asyncio.to_thread(self._leer, ruta)
+            if payload is None:
+                payload = await construir()
+                await asyncio.to_thread(self._escribir, ruta, payload)
+            self.memoria.put(clave, payload)
+        return version, payload
+
+    @staticmethod
+    def _leer(ruta: str) -> Optional[bytes]:
+        try:
+            with open(ruta, "rb") as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _escribir(ruta: str, payload: bytes):
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            tmp = f"{ruta}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as fp:
+                fp.write(payload)
+            os.replace(tmp, ruta)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el tile {ruta}: {e}")
+
+cache_tiles = CacheTiles(TILES_DIR, TILES_MAX_MEMORIA)
+
+def normalizar_fecha_hora(fecha_hora: Optional[str]) -> Optional[str]:
+    """
+    'YYYY-MM-DD HH:MM' canónico (como invalidan los cargadores) de una hora
+    escrita como '2025-04-24 8:00' o en ISO ('2025-04-24T08:00', con o sin
+    zona, que se pasa a UTC). Si no se entiende se deja tal cual y el endpoint
+    responde 400.
+    """
+    if fecha_hora is None:
+        return None
+    try:
+        fh = datetime.fromisoformat(fecha_hora.strip())
+    except ValueError:
+        try:
+            fh = datetime.strptime(fecha_hora.strip(), "%Y-%m-%d %H:%M")
+        except ValueError:
+            return fecha_hora
+    if fh.tzinfo is not None:
+        fh = fh.astimezone(timezone.utc)
+    return fh.strftime("%Y-%m-%d %H:%M")
+
+def cacheado(func):
+    """
+    Cachea la respuesta del endpoint según su nombre y sus parámetros de
+    consulta, con fecha_hora normalizada para que la invalidación de los
+    cargadores la encuentre.
+    """
+    @functools.wraps(func)
+    async def wrapper(**kwargs):
+        if "fecha_hora" in kwargs:
+            kwargs["fecha_hora"] = normalizar_fecha_hora(kwargs["fecha_hora"])
+        clave = (func.__name__, tuple(sorted(kwargs.items())))
+        valor = cache_respuestas.get(clave)
+        if valor is None:
+            valor = await func(**kwargs)
+            cache_respuestas.put(clave, valor, kwargs.get("fecha_hora"))
+        return valor
+    return wrapper
+
+# --------------------------------------------
+# Caché HTTP condicional (ETag / 304) para horas históricas
+# --------------------------------------------
+marca_carga = {"fecha_hora": None, "version": "", "leida": float("-inf")}
+
+async def cargar_marca_carga():
+    """Marca de agua y versión de datos escritas por el cargador de lecturas en estado_carga."""
+    try:
+        r = await ejecutar_uno(stmt_estado_carga, (MARCA_CLAVE,))
+    except Exception as e:
+        logger.warning(f"No se pudo leer estado_carga: {e}")
+        return
+    marca_carga["leida"] = time.monotonic()
+    if r and r.get("fecha_hora"):
+        marca_carga["fecha_hora"] = r["fecha_hora"].replace(tzinfo=timezone.utc)
+        marca_carga["version"] = r.get("version") or ""
+        logger.info(f"Marca de agua de la ingesta: {marca_carga['fecha_hora']:%Y-%m-%d %H:%M} "
+                    f"(versión {marca_carga['version']})")
+
+async def etag_historico(request: Request, fecha_hora: str) -> Optional[str]:
+    """
+    ETag fuerte para una petición de una hora ya cerrada (anterior a la marca de
+    agua), o None si la hora todavía puede cambiar. Se calcula solo con la URL,
+    la versión de datos y la versión de infraestructura: no toca Cassandra.
+    """
+    try:
+        fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    if time.monotonic() - marca_carga["leida"] > MARCA_TTL_SEGUNDOS:
+        await cargar_marca_carga()
+    if marca_carga["fecha_hora"] is None or fh >= marca_carga["fecha_hora"]:
+        return None
+    huella = "|".join([
+        marca_carga["version"], cache_tiles.version or "", request.url.path,
+        "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items())),
+    ])
+    return '"' + hashlib.sha1(huella.encode("utf-8")).hexdigest() + '"'
+
+@app.middleware("http")
+async def cache_condicional(request: Request, call_next):
+    fecha_hora = request.query_params.get("fecha_hora")
+    if request.method != "GET" or not fecha_hora:
+        return await call_next(request)
+
+    etag = await etag_historico(request, fecha_hora)
+    if etag is None:
+        response = await call_next(request)
+        response.headers.setdefault("Cache-Control", "no-cache")
+        return response
+
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={HISTORICO_MAX_AGE}"}
+    if etag_coincide(etag, request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=headers)
+
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers.update(headers)
+    return response
+
+# Se registra después de los demás middlewares para quedar por fuera de todos:
+# comprime la respuesta final y ve el ETag que puso cache_condicional.
+app.add_middleware(
+    CompresionMiddleware,
+    minimo=COMPRESION_MINIMO,
+    nivel_gzip=COMPRESION_NIVEL_GZIP,
+    calidad_br=COMPRESION_CALIDAD_BR,
+)
 
 # --------------------------------------------
 # /lecturas: Solo estructuras sin lecturas
 # --------------------------------------------
 @app.get("/lecturas", response_model=List[ContratoResponse])
-def lecturas(
+async def lecturas(
     lat_min: float = Query(...),
     lat_max: float = Query(...),
     lon_min: float = Query(...),
     lon_max: float = Query(...),
-    record_limit: int = Query(...)
+    record_limit: int = Query(..., ge=1),
+    cursor: Optional[str] = Query(None)
 ):
-    try:
-        infra_rows = session.execute(
-            stmt_infra_limit,
-            (lat_min, lat_max, lon_min, lon_max, record_limit)
-        ).all()
-
-        result = []
-        for inf in infra_rows:
-            result.append(ContratoResponse(
-                ContratoID=inf['contrato_id'],
-                Nombre=inf['nombre'],
-                CI_NIT=inf['ci_nit'],
-                Email=inf['email'],
-                Telefono=inf['telefono'],
-                Latitud=inf['latitud'],
-                Longitud=inf['longitud'],
-                Distrito=inf['distrito'],
-                Zona=inf['zona'],
-                Medidores=inf.get('medidores') or []
-            ))
-        return result
+    """
+    Contratos del bbox, de a `record_limit` por página (como mucho
+    MAX_FETCH_SIZE). Si quedan más, la cabecera X-Next-Cursor trae el cursor
+    para pedir la página siguiente.
+    """
+    record_limit = min(record_limit, MAX_FETCH_SIZE)
+    bbox = dict(lat_min=lat_min, lat_max=lat_max, lon_min=lon_min, lon_max=lon_max)
+    desde = 0
+    if cursor:
+        datos = decodificar_cursor(cursor, **bbox)
+        if datos.get("v") != cache_tiles.version or not isinstance(datos.get("o"), int):
+            raise HTTPException(400, "Cursor inválido o expirado")
+        desde = datos["o"]
 
+    try:
+        infra_rows = await contratos_en_bbox(lat_min, lat_max, lon_min, lon_max, record_limit + 1, desde)
+        headers = {}
+        if len(infra_rows) > record_limit:
+            infra_rows = infra_rows[:record_limit]
+            headers["X-Next-Cursor"] = codificar_cursor(
+                {"v": cache_tiles.version, "o": desde + record_limit}, **bbox
+            )
+
+        return respuesta_json([contrato_publico(inf) for inf in infra_rows], headers)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error en /lecturas: {e}", exc_info=True)
         raise HTTPException(500, "Error interno del servidor")
 
+# --------------------------------------------
+# /lecturas/clusters: contratos agrupados por celda para zooms bajos
+# --------------------------------------------
+@app.get("/lecturas/clusters", response_model=List[ClusterResponse])
+async def clusters(
+    fecha_hora: str = Query(...),
+    lat_min: float = Query(...),
+    lat_max: float = Query(...),
+    lon_min: float = Query(...),
+    lon_max: float = Query(...),
+    zoom: int = Query(...)
+):
+    """
+    Devuelve un cluster por celda con contratos dentro del bbox: cantidad de
+    contratos, centroide y consumo sumado en la hora. El tamaño de la respuesta
+    depende de las celdas visibles, no de la cantidad de contratos.
+    """
+    try:
+        fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(400, "Formato inválido de fecha_hora")
+
+    try:
+        z = min(max(zoom, CLUSTER_ZOOM_MIN), CLUSTER_ZOOM_MAX)
+        celdas = indice_clusters.niveles.get(z, {})
+        consumo = (await consumo_clusters_de_hora(fecha_hora, fh)).get(z, {})
+
+        x0, y0 = tile_de(lat_max, lon_min, z + CLUSTER_SUBDIVISION)
+        x1, y1 = tile_de(lat_min, lon_max, z + CLUSTER_SUBDIVISION)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(celdas):
+            visibles = ((x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+            visibles = [(c, celdas[c]) for c in visibles if c in celdas]
+        else:
+            visibles = [(c, acc) for c, acc in celdas.items()
+                        if x0 <= c[0] <= x1 and y0 <= c[1] <= y1]
+
+        return [
+            {
+                "Latitud": suma_lat / n,
+                "Longitud": suma_lon / n,
+                "Contratos": n,
+                "ConsumoPeriodo": consumo.get(celda, 0),
+            }
+            for celda, (n, suma_lat, suma_lon) in visibles
+        ]
+    except Exception as e:
+        logger.error(f"Error en /lecturas/clusters: {e}", exc_info=True)
+        raise HTTPException(500, "Error interno al agrupar contratos.")
+
+# --------------------------------------------
+# /tiles/{z}/{x}/{y}: puntos de contratos en tiles fijos cacheables
+# --------------------------------------------
+def limites_de_tile(z: int, x: int, y: int) -> tuple:
+    """(lat_min, lat_max, lon_min, lon_max) del tile Web Mercator z/x/y."""
+    n = 1 << z
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lat_min, lat_max, lon_min, lon_max
+
+@app.get("/tiles/{z}/{x}/{y}", response_model=List[ContratoResponse])
+async def tile(z: int, x: int, y: int, request: Request):
+    """
+    Contratos cuyo punto cae en el tile z/x/y. El payload se genera una vez por
+    versión de infraestructura y se sirve desde memoria o disco; el ETag y el
+    Cache-Control permiten que navegadores y proxies reutilicen el tile.
+    """
+    if not TILE_ZOOM_MIN <= z <= TILE_ZOOM_MAX:
+        raise HTTPException(400, f"Zoom fuera de rango ({TILE_ZOOM_MIN}-{TILE_ZOOM_MAX}); use /lecturas/clusters")
+    if not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(404, "Tile inexistente")
+
+    async def construir() -> bytes:
+        lat_min, lat_max, lon_min, lon_max = limites_de_tile(z, x, y)
+        filas = await contratos_en_bbox(lat_min, lat_max, lon_min, lon_max, 1 << 30)
+        # Los puntos en el borde se asignan a un único tile
+        puntos = sorted(
+            (contrato_publico(f) for f in filas if tile_de(f["latitud"], f["longitud"], z) == (x, y)),
+            key=lambda p: p["ContratoID"]
+        )
+        return dumps_json(puntos)
+
+    try:
+        version, payload = await cache_tiles.obtener(z, x, y, construir)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error en /tiles/{z}/{x}/{y}: {e}", exc_info=True)
+        raise HTTPException(500, "Error interno al generar el tile.")
+
+    etag = f'"{version}-{z}-{x}-{y}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={TILE_MAX_AGE}"}
+    if etag_coincide(etag, request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload, media_type="application/json", headers=headers)
+
+# --------------------------------------------
+# /contratos/search: typeahead sobre el índice de búsqueda
+# --------------------------------------------
+async def contrato_por_nombre(q: str) -> Optional[dict]:
+    """
+    Contrato cuyo nombre es exactamente `q` (ignorando mayúsculas, tildes y
+    puntuación en el índice; literal en Cassandra si aún no está cargado).
+    Varios contratos con el mismo nombre: 409. Las coincidencias por prefijo o
+    parecido son solo para /contratos/search.
+    """
+    if len(indice_nombres):
+        encontrados = indice_nombres.exactos(q)
+    else:
+        encontrados = await ejecutar(stmt_infra_by_name, (q,))
+    if len(encontrados) > 1:
+        raise HTTPException(409, f"Hay {len(encontrados)} contratos con el nombre '{q}'; use el contrato_id")
+    return encontrados[0] if encontrados else None
+
+@app.get("/contratos/search", response_model=List[ContratoBusquedaResponse])
+async def buscar_contratos(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(BUSQUEDA_LIMITE, ge=1, le=BUSQUEDA_MAX_LIMITE)
+):
+    """
+    Sugerencias de contratos por prefijo o parecido de nombre, razón social o
+    CI/NIT, ignorando mayúsculas y tildes. Solo lee el índice en memoria.
+    """
+    if not len(indice_nombres):
+        raise HTTPException(503, "El índice de búsqueda todavía no está cargado")
+    return respuesta_json([busqueda_publica(inf, p) for inf, p in indice_nombres.buscar(q, limit)])
+
 # --------------------------------------------
 # /lecturas/buscar: Detalle con lecturas (por contrato o nombre exacto)
 # --------------------------------------------
 @app.get("/lecturas/buscar", response_model=ContratoDetalleResponse)
-def buscar(
+async def buscar(
     fecha_hora: str = Query(...),
     q: str = Query(...)
 ):
+    return respuesta_json(await payload_buscar(fecha_hora=fecha_hora, q=q))
+
+@cacheado
+async def payload_buscar(fecha_hora: str, q: str) -> bytes:
+    """Detalle de /lecturas/buscar ya serializado (se cachea en bytes)."""
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
     except ValueError:
         raise HTTPException(400, "Formato inválido de fecha_hora")
 
-    infra = session.execute(stmt_infra_by_id, (q,)).one()
+    infra = await ejecutar_uno(stmt_infra_by_id, (q,))
     if not infra:
-        infra = session.execute(stmt_infra_by_name, (q,)).one()
+        infra = await contrato_por_nombre(q)
     if not infra:
         raise HTTPException(404, f"No se encontró infraestructura para '{q}'")
 
@@ -174,245 +1369,352 @@ def buscar(
     if not meds:
         raise HTTPException(404, f"No hay medidores asociados a '{q}'")
 
-    rows = session.execute(stmt_lect_by_codes, (fh, meds)).all()
-    if not rows:
+    lect_by_med = await lecturas_de_medidores(meds, fh)
+    if not lect_by_med:
         raise HTTPException(404, f"No hay lecturas en {fecha_hora} para '{q}'")
 
-    lect_by_med = {}
-    for r in rows:
-        lect_by_med.setdefault(r['codigo_medidor'], []).append(r)
-
-    lista_med = []
-    for md in meds:
-        if md in lect_by_med:
-            for r in lect_by_med[md]:
-                lista_med.append(MedidorResponse(
-                    CodigoMedidor=md,
-                    Modelo=r.get('modelo') or "Unknown",
-                    Estado=r.get('estado') or "Unknown",
-                    FechaHora=r['fecha_hora'].strftime("%Y-%m-%d %H:%M"),
-                    Lectura=r.get('lectura') or 0,
-                    ConsumoPeriodo=r.get('consumo_periodo') or 0,
-                    TarifaUSD=format_tarifa(r.get('tarifa_usd') or 0.0)
-                ))
-
-    return ContratoDetalleResponse(
-        ContratoID=infra['contrato_id'],
-        Nombre=infra['nombre'],
-        CI_NIT=infra['ci_nit'],
-        Email=infra['email'],
-        Telefono=infra['telefono'],
-        Latitud=infra['latitud'],
-        Longitud=infra['longitud'],
-        Distrito=infra['distrito'],
-        Zona=infra['zona'],
-        Medidores=lista_med
-    )
+    lista_med = [medidor_publico(md, r) for md in meds for r in lect_by_med.get(md, [])]
+    return dumps_json(detalle_publico(infra, lista_med))
 
 # --------------------------------------------
 # /lecturas/identificar: búsqueda por contrato, nombre o código medidor
 # --------------------------------------------
 @app.get("/lecturas/identificar", response_model=List[ContratoDetalleResponse])
-def identificar(
+async def identificar(
     fecha_hora: str = Query(...),
-    q: str = Query(...)
+    q: str = Query(...),
+    fetch_size: int = Query(IDENTIFICAR_FETCH_SIZE, ge=1, le=MAX_FETCH_SIZE),
+    cursor: Optional[str] = Query(None)
 ):
+    """
+    Contratos que coinciden con `q` (contrato, nombre, razón social, CI/NIT o código
+    de medidor) con sus lecturas de la hora. Las coincidencias por nombre salen del
+    índice de búsqueda ordenadas por puntaje, de a `fetch_size` contratos; la
+    cabecera X-Next-Cursor trae la página siguiente.
+    """
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
     except ValueError:
         raise HTTPException(400, "Formato inválido de fecha_hora")
 
-    resultados = []
-    contr_found = session.execute(stmt_infra_by_id, (q,)).one()
+    desde, paging_state = 0, None
+    headers = {}
+    if cursor:
+        datos = decodificar_cursor(cursor, q=q)
+        try:
+            if "o" in datos:
+                desde = int(datos["o"])
+            else:
+                paging_state = bytes.fromhex(datos["ps"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(400, "Cursor inválido")
+    continuacion = bool(cursor)
+
+    contr_found = None if continuacion else await ejecutar_uno(stmt_infra_by_id, (q,))
     if contr_found:
         contratos = [contr_found]
     else:
-        contratos = session.execute(stmt_infra_by_name, (q,)).all()
-        if not contratos:
-            contratos = session.execute(stmt_infra_all).all()
-            contratos = [c for c in contratos if q in (c.get("medidores") or [])]
-
-    for inf in contratos:
+        if len(indice_nombres):
+            encontrados = indice_nombres.buscar(q, fetch_size + 1, desde)
+            contratos = [inf for inf, _ in encontrados[:fetch_size]]
+            if len(encontrados) > fetch_size:
+                headers["X-Next-Cursor"] = codificar_cursor({"o": desde + fetch_size}, q=q)
+        else:
+            # Índice aún no cargado: coincidencia exacta en Cassandra
+            contratos, siguiente = await ejecutar_pagina(stmt_infra_by_name, (q,), fetch_size, paging_state)
+            if siguiente:
+                headers["X-Next-Cursor"] = codificar_cursor({"ps": siguiente.hex()}, q=q)
+        if not contratos and not continuacion:
+            cid = await contrato_de_medidor(q)
+            infra = await ejecutar_uno(stmt_infra_by_id, (cid,)) if cid else None
+            contratos = [infra] if infra else []
+
+    async def detalle(inf):
         meds = inf.get('medidores') or []
         if not meds:
-            continue
+            return None
 
-        rows = session.execute(stmt_lect_by_codes, (fh, meds)).all()
-        if not rows:
-            continue
+        lect_by_med = await lecturas_de_medidores(meds, fh)
+        if not lect_by_med:
+            return None
 
-        lect_by_med = {}
-        for r in rows:
-            lect_by_med.setdefault(r['codigo_medidor'], []).append(r)
-
-        lista_med = []
-        for md in meds:
-            if md in lect_by_med:
-                for r in lect_by_med[md]:
-                    lista_med.append(MedidorResponse(
-                        CodigoMedidor=md,
-                        Modelo=r.get('modelo') or "Unknown",
-                        Estado=r.get('estado') or "Unknown",
-                        FechaHora=r['fecha_hora'].strftime("%Y-%m-%d %H:%M"),
-                        Lectura=r.get('lectura') or 0,
-                        ConsumoPeriodo=r.get('consumo_periodo') or 0,
-                        TarifaUSD=format_tarifa(r.get('tarifa_usd') or 0.0)
-                    ))
-
-        resultados.append(ContratoDetalleResponse(
-            ContratoID=inf['contrato_id'],
-            Nombre=inf['nombre'],
-            CI_NIT=inf['ci_nit'],
-            Email=inf['email'],
-            Telefono=inf['telefono'],
-            Latitud=inf['latitud'],
-            Longitud=inf['longitud'],
-            Distrito=inf['distrito'],
-            Zona=inf['zona'],
-            Medidores=lista_med
-        ))
+        lista_med = [medidor_publico(md, r) for md in meds for r in lect_by_med.get(md, [])]
+        return detalle_publico(inf, lista_med)
+
+    # Lecturas de todos los contratos en paralelo
+    detalles = await asyncio.gather(*(detalle(inf) for inf in contratos))
+    resultados = [d for d in detalles if d is not None]
 
-    if not resultados:
+    # Una página sin lecturas no es un 404 si todavía quedan páginas por recorrer
+    if not resultados and "X-Next-Cursor" not in headers:
         raise HTTPException(404, f"No se encontró ningún contrato relacionado con '{q}'")
 
-    return resultados
+    return respuesta_json(resultados, headers)
+
+
+# --------------------------------------------
+# /lecturas/batch: muchos contratos o medidores en una sola petición
+# --------------------------------------------
+class BatchRequest(BaseModel):
+    fecha_hora: str
+    ids: List[str]
+
+@app.post("/lecturas/batch", response_model=BatchResponse)
+async def lecturas_batch(req: BatchRequest):
+    """
+    Detalle con lecturas de la hora para una lista de contratos o códigos de
+    medidor. Todas las consultas son de una sola partición y se lanzan en
+    paralelo (BATCH_CONCURRENCIA en vuelo); el resultado va indexado por id y
+    los ids que fallan aparecen en `errores` sin tumbar el resto.
+    """
+    try:
+        fh = datetime.strptime(req.fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(400, "Formato inválido de fecha_hora")
+    ids = list(dict.fromkeys(i.strip() for i in req.ids if i and i.strip()))
+    if len(ids) > BATCH_MAX_IDS:
+        raise HTTPException(400, f"Máximo {BATCH_MAX_IDS} ids por petición")
+
+    errores = {}
+
+    # 1) Resolver cada id a su contrato (id de contrato o código de medidor)
+    contratos = {}
+    medidor_de = {}     # id -> medidor pedido, si el id era un código de medidor
+    for i, (ok, filas) in zip(ids, await ejecutar_concurrente(stmt_infra_by_id, [(i,) for i in ids])):
+        if ok and filas:
+            contratos[i] = filas[0]
+        elif not ok:
+            logger.error(f"Error en /lecturas/batch ({i}): {filas}")
+            errores[i] = "Error interno al consultar el contrato"
+
+    pendientes = [i for i in ids if i not in contratos and i not in errores]
+    cids = {}
+    for i, (ok, cid) in zip(pendientes, await contratos_de_medidores(pendientes)):
+        if ok:
+            cids[i] = cid
+        else:
+            logger.error(f"Error en /lecturas/batch ({i}): {cid}")
+            errores[i] = "Error interno al consultar el medidor"
+    por_cid = {cid: None for cid in cids.values() if cid}
+    for cid, (ok, filas) in zip(list(por_cid), await ejecutar_concurrente(stmt_infra_by_id, [(c,) for c in por_cid])):
+        if ok:
+            por_cid[cid] = filas[0] if filas else None
+        else:
+            logger.error(f"Error en /lecturas/batch (contrato {cid}): {filas}")
+            por_cid[cid] = filas
+    for i, cid in cids.items():
+        inf = por_cid.get(cid) if cid else None
+        if isinstance(inf, Exception):
+            errores[i] = "Error interno al consultar el contrato"
+        elif inf:
+            contratos[i] = inf
+            medidor_de[i] = i
+        else:
+            errores[i] = f"No se encontró contrato ni medidor '{i}'"
+
+    # 2) Lecturas de la hora: una partición por medidor, sin repetir medidores
+    def medidores_de(i):
+        return [medidor_de[i]] if i in medidor_de else contratos[i].get('medidores') or []
+
+    meds = list(dict.fromkeys(md for i in contratos for md in medidores_de(i)))
+    lect_by_med = {}
+    for md, (ok, filas) in zip(meds, await ejecutar_concurrente(stmt_lect_medidor, [(md, fh) for md in meds])):
+        lect_by_med[md] = filas if ok else None
+
+    resultados = {}
+    for i, inf in contratos.items():
+        meds_id = medidores_de(i)
+        if any(lect_by_med[md] is None for md in meds_id):
+            errores[i] = "Error interno al consultar lecturas"
+            continue
+        lista_med = [medidor_publico(md, r) for md in meds_id for r in lect_by_med[md]]
+        if not lista_med:
+            errores[i] = f"No hay lecturas en {req.fecha_hora}"
+            continue
+        resultados[i] = detalle_publico(inf, lista_med)
+
+    return respuesta_json({"resultados": resultados, "errores": errores})
+
+
+# --------------------------------------------
+# /medidores/{codigo}/serie: rango de lecturas agregado por bucket
+# --------------------------------------------
+def segundos_de_bucket(bucket: str) -> int:
+    """'15m', '1h', '6h', '1d', '1w' -> segundos."""
+    b = bucket.strip().lower()
+    try:
+        n, unidad = int(b[:-1]), SERIE_UNIDADES[b[-1:]]
+    except (KeyError, ValueError):
+        raise HTTPException(400, "bucket inválido, use p.ej. '1h', '6h', '1d' o '1w'")
+    if n <= 0:
+        raise HTTPException(400, "bucket debe ser mayor que cero")
+    return n * unidad
+
+def agregar_serie(filas: list, inicio: float, bucket_seg: int) -> list:
+    """
+    Min, max, suma y última `lectura` (y consumo del periodo) por bucket en una
+    sola pasada vectorizada. Las filas vienen ordenadas por fecha_hora
+    (clustering ASC), así que cada bucket es un tramo contiguo.
+    """
+    if not filas:
+        return []
+    t = np.fromiter((f["fecha_hora"].replace(tzinfo=timezone.utc).timestamp() for f in filas),
+                    dtype=np.float64, count=len(filas))
+    lect = np.fromiter((f.get("lectura") or 0 for f in filas), dtype=np.int64, count=len(filas))
+    cons = np.fromiter((f.get("consumo_periodo") or 0 for f in filas), dtype=np.int64, count=len(filas))
+
+    idx = ((t - inicio) // bucket_seg).astype(np.int64)
+    inicios = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+    fines = np.r_[inicios[1:], len(idx)]
+
+    columnas = zip(
+        (inicio + idx[inicios] * bucket_seg).tolist(),
+        (fines - inicios).tolist(),
+        np.minimum.reduceat(lect, inicios).tolist(),
+        np.maximum.reduceat(lect, inicios).tolist(),
+        np.add.reduceat(lect, inicios).tolist(),
+        lect[fines - 1].tolist(),
+        np.add.reduceat(cons, inicios).tolist(),
+    )
+    return [
+        {
+            "FechaHora": datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M"),
+            "Lecturas": n, "Min": mn, "Max": mx, "Suma": suma, "Ultima": ultima, "Consumo": consumo,
+        }
+        for ts, n, mn, mx, suma, ultima, consumo in columnas
+    ]
+
+@app.get("/medidores/{codigo}/serie", response_model=SerieResponse)
+async def serie_medidor(
+    codigo: str,
+    desde: str = Query(..., description="YYYY-MM-DD HH:MM"),
+    hasta: str = Query(..., description="YYYY-MM-DD HH:MM (incluido)"),
+    bucket: Optional[str] = Query(None, description="Ancho de bucket: 15m, 1h, 6h, 1d, 1w")
+):
+    """
+    Lecturas de un medidor entre `desde` y `hasta` con un solo corte por rango
+    de la partición en lecturas_medidor, agregadas por bucket. Un bucket que
+    daría más de SERIE_MAX_PUNTOS puntos es un 400 que indica el mínimo; sin
+    bucket se usa 1h o ese mínimo (en minutos enteros), así que el tamaño de la
+    respuesta está acotado para cualquier rango.
+    """
+    try:
+        ini = datetime.strptime(desde, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+        fin = datetime.strptime(hasta, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(400, "Formato inválido de desde/hasta")
+    if fin < ini:
+        raise HTTPException(400, "hasta debe ser posterior a desde")
+
+    rango = (fin - ini).total_seconds() + 3600
+    minimo = math.ceil(rango / SERIE_MAX_PUNTOS / 60) * 60
+    if bucket:
+        bucket_seg = segundos_de_bucket(bucket)
+        if bucket_seg < minimo:
+            raise HTTPException(
+                400, f"bucket '{bucket}' daría más de {SERIE_MAX_PUNTOS} puntos; use al menos {minimo // 60}m"
+            )
+    else:
+        bucket_seg = max(3600, minimo)
+
+    try:
+        filas = await ejecutar(stmt_lect_rango, (codigo, ini, fin))
+    except Exception as e:
+        logger.error(f"Error en serie_medidor: {e}")
+        raise HTTPException(500, "Error interno al consultar la serie.")
+    if not filas:
+        raise HTTPException(404, f"No hay lecturas de '{codigo}' entre {desde} y {hasta}")
+
+    return respuesta_json({
+        "CodigoMedidor": codigo,
+        "Desde": desde,
+        "Hasta": hasta,
+        "BucketSegundos": bucket_seg,
+        "Puntos": agregar_serie(filas, ini.timestamp(), bucket_seg),
+    })
 
 
 from cassandra.query import SimpleStatement
 
 @app.get("/dashboard/consumo_total")
-def consumo_total(fecha_hora: str = Query(...)):
+@cacheado
+async def consumo_total(fecha_hora: str = Query(...)):
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
-        cql = SimpleStatement("""
-            SELECT consumo_periodo FROM lecturas_medidor WHERE fecha_hora = %s ALLOW FILTERING
-        """)
-        rows = session.execute(cql, (fh,))
-        total = sum(r['consumo_periodo'] or 0 for r in rows)
-        return {"consumo_total": total}
+        return {"consumo_total": (await resumen_de_hora(fh))["consumo_total"]}
     except Exception as e:
         logger.error(f"Error en /dashboard/consumo_total: {e}", exc_info=True)
         raise HTTPException(500, "Error interno al calcular consumo total.")
 
 @app.get("/dashboard/medidores_reportando")
-def medidores_reportando(fecha_hora: str = Query(...)):
+@cacheado
+async def medidores_reportando(fecha_hora: str = Query(...)):
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
-        cql = SimpleStatement("""
-            SELECT codigo_medidor FROM lecturas_medidor WHERE fecha_hora = %s ALLOW FILTERING
-        """)
-        rows = session.execute(cql, (fh,))
-        count = len(set(r['codigo_medidor'] for r in rows))
-        return {"medidores_reportando": count}
+        return {"medidores_reportando": (await resumen_de_hora(fh))["medidores"]}
     except Exception as e:
         logger.error(f"Error en /dashboard/medidores_reportando: {e}", exc_info=True)
         raise HTTPException(500, "Error interno al contar medidores reportando.")
 
 @app.get("/dashboard/medidores_con_errores")
-def medidores_con_errores(fecha_hora: str = Query(...)):
+@cacheado
+async def medidores_con_errores(fecha_hora: str = Query(...)):
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
-        cql = SimpleStatement("""
-            SELECT codigo_medidor FROM errores_iot WHERE fecha_hora = %s ALLOW FILTERING
-        """)
-        rows = session.execute(cql, (fh,))
-        count = len(set(r['codigo_medidor'] for r in rows))
-        return {"medidores_con_errores": count}
+        return {"medidores_con_errores": (await resumen_de_hora(fh))["medidores_con_errores"]}
     except Exception as e:
         logger.error(f"Error en /dashboard/medidores_con_errores: {e}", exc_info=True)
         raise HTTPException(500, "Error interno al contar medidores con errores.")
 
 @app.get("/dashboard/consumo_por_zona")
-def consumo_por_zona_opt(fecha_hora: str = Query(...)):
+@cacheado
+async def consumo_por_zona_opt(fecha_hora: str = Query(...)):
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
-
-        # 1. Todas las lecturas a esa hora
-        cql = SimpleStatement("""
-            SELECT codigo_medidor, consumo_periodo FROM lecturas_medidor WHERE fecha_hora = %s ALLOW FILTERING
-        """)
-        lecturas = session.execute(cql, (fh,))
-        consumo_por_medidor = {r['codigo_medidor']: r['consumo_periodo'] or 0 for r in lecturas}
-
-        # 2. Infraestructura con zonas
-        infra_all = session.execute(stmt_infra_all).all()
-        zona_totales = {}
-
-        for inf in infra_all:
-            zona = inf.get("zona", "SIN_ZONA")
-            for med in inf.get("medidores") or []:
-                if med in consumo_por_medidor:
-                    zona_totales[zona] = zona_totales.get(zona, 0) + consumo_por_medidor[med]
-
-        return zona_totales
-
+        return {r["clave"]: r["consumo"] for r in await resumen_por_dimension(fh, "zona")}
     except Exception as e:
         logger.error(f"Error en /dashboard/consumo_por_zona (opt): {e}", exc_info=True)
         raise HTTPException(500, "Error interno al calcular consumo por zona.")
 
 
 @app.get("/dashboard/consumo_promedio")
-def consumo_promedio(fecha_hora: str = Query(...)):
+@cacheado
+async def consumo_promedio(fecha_hora: str = Query(...)):
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
-        cql = SimpleStatement("""
-            SELECT consumo_periodo FROM lecturas_medidor WHERE fecha_hora = %s ALLOW FILTERING
-        """)
-        rows = session.execute(cql, (fh,))
-        consumos = [r['consumo_periodo'] or 0 for r in rows]
-        promedio = sum(consumos) / len(consumos) if consumos else 0
+        r = await resumen_de_hora(fh)
+        promedio = r["consumo_total"] / r["lecturas"] if r["lecturas"] else 0
         return {"consumo_promedio": round(promedio, 2)}
     except Exception as e:
         logger.error(f"Error en /dashboard/consumo_promedio: {e}", exc_info=True)
         raise HTTPException(500, "Error interno al calcular consumo promedio.")
-    
 
 from collections import defaultdict
 from cassandra.query import SimpleStatement
 
 @app.get("/dashboard/consumo_diario")
-def consumo_diario():
+@cacheado
+async def consumo_diario():
     """
     Devuelve el consumo total de los últimos 15 días agrupado por fecha (sin filtrar por zona).
+    Lee las 15 filas más recientes de resumen_dia (clustering por fecha DESC).
     """
     try:
-        cql = SimpleStatement("""
-            SELECT fecha_hora, consumo_periodo FROM lecturas_medidor ALLOW FILTERING
-        """)
-        rows = session.execute(cql)
-
-        consumo_por_fecha = defaultdict(int)
-        for r in rows:
-            fecha = r["fecha_hora"].date().isoformat()
-            consumo_por_fecha[fecha] += r.get("consumo_periodo", 0)
-
-        # Ordenar por fecha descendente y tomar los últimos 15 días
-        ultimos_15_dias = sorted(consumo_por_fecha.items(), key=lambda x: x[0], reverse=True)[:15]
+        rows = await ejecutar(stmt_resumen_dia, (SERIE_TOTAL, DIAS_CONSUMO_DIARIO))
 
         # Devolver ordenado de forma ascendente para la gráfica
-        return [{"fecha": fecha, "consumo": consumo} for fecha, consumo in reversed(ultimos_15_dias)]
+        return [{"fecha": str(r["fecha"]), "consumo": r.get("consumo_total") or 0} for r in reversed(rows)]
 
     except Exception as e:
         logger.error(f"Error en /dashboard/consumo_diario: {e}", exc_info=True)
         raise HTTPException(500, "Error interno al obtener el consumo diario.")
     
 @app.get("/dashboard/errores_por_zona")
-def errores_por_zona(fecha_hora: str = Query(...)):
+@cacheado
+async def errores_por_zona(fecha_hora: str = Query(...)):
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
-        rows = session.execute("SELECT codigo_medidor FROM errores_iot WHERE fecha_hora = %s ALLOW FILTERING", (fh,))
-        medidores_con_errores = set(r["codigo_medidor"] for r in rows)
-
-        infra_all = session.execute(stmt_infra_all).all()
-        zona_errores = {}
-
-        for inf in infra_all:
-            zona = inf.get("zona", "SIN_ZONA")
-            for med in inf.get("medidores") or []:
-                if med in medidores_con_errores:
-                    zona_errores[zona] = zona_errores.get(zona, 0) + 1
-
-        return [{"zona": z, "errores": c} for z, c in zona_errores.items()]
+        return [{"zona": r["clave"], "errores": r["cantidad"]} for r in await resumen_por_dimension(fh, "errores_zona")]
     except Exception as e:
         logger.error(f"Error en /dashboard/errores_por_zona: {e}", exc_info=True)
         raise HTTPException(500, "Error interno al contar errores por zona.")
@@ -420,36 +1722,29 @@ def errores_por_zona(fecha_hora: str = Query(...)):
 from collections import Counter
 
 @app.get("/dashboard/top_errores")
-def top_errores(fecha_hora: str = Query(...)):
+@cacheado
+async def top_errores(fecha_hora: str = Query(...)):
     """
     Devuelve los tipos de error más frecuentes para una hora dada (top 5).
     """
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
-        rows = session.execute("""
-            SELECT tipo_error FROM errores_iot WHERE fecha_hora = %s ALLOW FILTERING
-        """, (fh,))
-        tipos = [r["tipo_error"] for r in rows if r.get("tipo_error")]
-        top = Counter(tipos).most_common(5)
-        return [{"tipo_error": t, "cantidad": c} for t, c in top]
+        conteo = Counter({r["clave"]: r["cantidad"] for r in await resumen_por_dimension(fh, "tipo_error")})
+        return [{"tipo_error": t, "cantidad": c} for t, c in conteo.most_common(5)]
 
     except Exception as e:
         logger.error(f"Error en /dashboard/top_errores: {e}", exc_info=True)
         raise HTTPException(500, "Error al obtener los errores más frecuentes.")
 
 @app.get("/dashboard/modelos_uso")
-def modelos_uso(fecha_hora: str = Query(...)):
+@cacheado
+async def modelos_uso(fecha_hora: str = Query(...)):
     """
     Devuelve la cantidad de lecturas por modelo de medidor en una hora dada.
     """
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
-        rows = session.execute("""
-            SELECT modelo FROM lecturas_medidor WHERE fecha_hora = %s ALLOW FILTERING
-        """, (fh,))
-        modelos = [r["modelo"] or "DESCONOCIDO" for r in rows]
-        conteo = Counter(modelos)
-        return [{"modelo": m, "cantidad": c} for m, c in conteo.items()]
+        return [{"modelo": r["clave"], "cantidad": r["cantidad"]} for r in await resumen_por_dimension(fh, "modelo")]
     except Exception as e:
         logger.error(f"Error en /dashboard/modelos_uso: {e}", exc_info=True)
         raise HTTPException(500, "Error al obtener el uso de modelos.")
@@ -457,42 +1752,268 @@ def modelos_uso(fecha_hora: str = Query(...)):
 from collections import defaultdict
 
 @app.get("/dashboard/consumo_por_categoria")
-def consumo_por_categoria(fecha_hora: str = Query(...)):
+@cacheado
+async def consumo_por_categoria(fecha_hora: str = Query(...)):
     """
     Devuelve el consumo total agrupado por descripción de categoría (ej. Residencial, Comercial, etc.)
     para una hora específica.
     """
     try:
         fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+        return [{"categoria": r["clave"], "consumo": r["consumo"]} for r in await resumen_por_dimension(fh, "categoria")]
+    except Exception as e:
+        logger.error(f"Error en /dashboard/consumo_por_categoria: {e}", exc_info=True)
+        raise HTTPException(500, "Error interno al calcular consumo por categoría.")
 
-        # 1. Obtener todas las lecturas en esa hora
-        lecturas = session.execute("""
-            SELECT codigo_medidor, consumo_periodo FROM lecturas_medidor WHERE fecha_hora = %s ALLOW FILTERING
-        """, (fh,))
-        consumo_por_medidor = {
-            r["codigo_medidor"]: r["consumo_periodo"] or 0 for r in lecturas if r.get("codigo_medidor")
+
+@app.get("/dashboard/snapshot")
+@cacheado
+async def snapshot(fecha_hora: str = Query(...)):
+    """
+    Devuelve todos los KPIs del dashboard para una hora en una sola respuesta,
+    con las mismas formas que los endpoints individuales. Lee una vez la fila de
+    resumen_hora y una vez la partición completa de resumen_hora_dimension.
+    """
+    try:
+        fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+        fila_totales, filas_dims = await asyncio.gather(
+            ejecutar_uno(stmt_resumen_hora, (fh,)),
+            ejecutar(stmt_resumen_dims, (fh,))
+        )
+
+        tot = totales_resumen(fila_totales)
+        dims = defaultdict(list)
+        for r in filas_dims:
+            dims[r["dimension"]].append({
+                "clave": r["clave"], "cantidad": r.get("cantidad") or 0, "consumo": r.get("consumo") or 0
+            })
+
+        promedio = tot["consumo_total"] / tot["lecturas"] if tot["lecturas"] else 0
+        errores = Counter({r["clave"]: r["cantidad"] for r in dims["tipo_error"]})
+        return {
+            "consumo_total": tot["consumo_total"],
+            "medidores_reportando": tot["medidores"],
+            "medidores_con_errores": tot["medidores_con_errores"],
+            "consumo_promedio": round(promedio, 2),
+            "consumo_por_zona": {r["clave"]: r["consumo"] for r in dims["zona"]},
+            "errores_por_zona": [{"zona": r["clave"], "errores": r["cantidad"]} for r in dims["errores_zona"]],
+            "top_errores": [{"tipo_error": t, "cantidad": c} for t, c in errores.most_common(5)],
+            "modelos_uso": [{"modelo": r["clave"], "cantidad": r["cantidad"]} for r in dims["modelo"]],
+            "consumo_por_categoria": [{"categoria": r["clave"], "consumo": r["consumo"]} for r in dims["categoria"]],
         }
+    except Exception as e:
+        logger.error(f"Error en /dashboard/snapshot: {e}", exc_info=True)
+        raise HTTPException(500, "Error interno al obtener el resumen del dashboard.")
 
-        # 2. Obtener infraestructura y agrupar por descripcion_categoria
-        infra_all = session.execute(stmt_infra_all).all()
-        categoria_total = defaultdict(int)
 
-        for inf in infra_all:
-            desc = (inf.get("descripcion_categoria") or "Otros").strip().title()
-            for med in inf.get("medidores") or []:
-                if med in consumo_por_medidor:
-                    categoria_total[desc] += consumo_por_medidor[med]
+@app.get("/dashboard/heatmap")
+async def heatmap(
+    fecha_hora: str = Query(...),
+    resolution: int = Query(HEATMAP_RESOLUCION, ge=HEATMAP_RES_MIN, le=HEATMAP_RES_MAX)
+):
+    """
+    Consumo de la hora sumado en una rejilla lat/lon de `resolution` metros sobre
+    la ciudad: un punto {id, lat, lng, consumo} por celda con consumo, en el
+    centro de la celda. Reemplaza al heatmapData_distrito_v2.json estático.
+    """
+    if not len(rejilla_heatmap):
+        raise HTTPException(503, "El índice de contratos aún no está cargado")
+    return respuesta_json(await payload_heatmap(fecha_hora=fecha_hora, resolution=resolution))
 
-        return [{"categoria": cat, "consumo": consumo} for cat, consumo in categoria_total.items()]
+@cacheado
+async def payload_heatmap(fecha_hora: str, resolution: int) -> bytes:
+    """Heatmap ya serializado, cacheado por hora y resolución."""
+    try:
+        fh = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(400, "Formato inválido de fecha_hora")
+    try:
+        filas = await lecturas_de_hora(fh)
+        puntos = await asyncio.to_thread(rejilla_heatmap.histograma, filas, resolution)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error en /dashboard/consumo_por_categoria: {e}", exc_info=True)
-        raise HTTPException(500, "Error interno al calcular consumo por categoría.")
+        logger.error(f"Error en /dashboard/heatmap: {e}", exc_info=True)
+        raise HTTPException(500, "Error interno al calcular el heatmap.")
+    return dumps_json(puntos)
+
+
+@app.get("/dashboard/anomalias")
+@cacheado
+async def anomalias(
+    fecha: str = Query(..., description="Día 'YYYY-MM-DD'"),
+    tipo: Optional[str] = Query(None, description="pico | flujo_nocturno"),
+    limit: int = Query(ANOMALIAS_LIMITE, ge=1, le=ANOMALIAS_MAX_LIMITE)
+):
+    """
+    Medidores marcados por el job de anomalías para un día, de mayor a menor
+    puntaje (z-score). Lee una sola partición de anomalias_dia: nunca toca las
+    lecturas crudas.
+    """
+    try:
+        dia = datetime.strptime(fecha, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(400, "Formato inválido de fecha, use YYYY-MM-DD")
+    if tipo is not None and tipo not in ANOMALIA_TIPOS:
+        raise HTTPException(400, f"tipo debe ser uno de {', '.join(ANOMALIA_TIPOS)}")
+    try:
+        rows = await ejecutar(stmt_anomalias, (dia,))
+    except Exception as e:
+        logger.error(f"Error en /dashboard/anomalias: {e}", exc_info=True)
+        raise HTTPException(500, "Error interno al obtener las anomalías.")
+
+    return [
+        {
+            "codigo_medidor": r["codigo_medidor"],
+            "contrato_id": MEDIDOR_A_CONTRATO.get(r["codigo_medidor"]),
+            "tipo": r["tipo"],
+            "puntaje": r["puntaje"],
+            "consumo": r.get("consumo") or 0,
+            "esperado": r.get("esperado") or 0.0,
+            "fecha_hora": r["fecha_hora"].strftime("%Y-%m-%d %H:%M") if r.get("fecha_hora") else None,
+        }
+        for r in rows if tipo is None or r["tipo"] == tipo
+    ][:limit]
+
+
+TOKEN_MIN = -2**63
+TOKEN_MAX = 2**63 - 1
+
+def rangos_de_tokens(n: int) -> list:
+    """Divide el anillo de tokens en n rangos (inicio, fin] contiguos."""
+    paso = (TOKEN_MAX - TOKEN_MIN) // n
+    limites = [TOKEN_MIN + i * paso for i in range(n)] + [TOKEN_MAX]
+    return list(zip(limites[:-1], limites[1:]))
+
+def empujar_top(heap: list, item: tuple, n: int):
+    """Mantiene en `heap` (min-heap) los n mayores (consumo, id) vistos."""
+    if len(heap) < n:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+async def top_medidores_de_rango(rango: tuple, desde: datetime, hasta: datetime, n: int,
+                                 permitidos: Optional[set]) -> list:
+    """
+    Top n medidores de un rango de tokens por consumo en [desde, hasta). Las
+    filas de cada medidor llegan seguidas (es la partición), así que basta una
+    suma corriente y un heap de n elementos: la memoria no crece con los medidores.
+    Las páginas se piden con execute_async, sin ocupar hilos del threadpool.
+    """
+    heap, actual, suma = [], None, 0
+    paging_state = None
+    while True:
+        filas, paging_state = await ejecutar_pagina(
+            stmt_consumo_rango, (*rango, desde, hasta), TOP_RANGOS_FETCH_SIZE, paging_state, PERFIL_ESCANEO
+        )
+        for r in filas:
+            if r["codigo_medidor"] != actual:
+                if actual is not None and (permitidos is None or actual in permitidos):
+                    empujar_top(heap, (suma, actual), n)
+                actual, suma = r["codigo_medidor"], 0
+            suma += r.get("consumo_periodo") or 0
+        if paging_state is None:
+            break
+    if actual is not None and (permitidos is None or actual in permitidos):
+        empujar_top(heap, (suma, actual), n)
+    return heap
+
+async def top_medidores_en_rango(desde: datetime, hasta: datetime, n: int, zona: Optional[str]) -> list:
+    permitidos = MEDIDORES_POR_ZONA.get(zona, set()) if zona else None
+    semaforo = asyncio.Semaphore(TOP_RANGOS_CONCURRENCIA)
+
+    async def uno(rango):
+        async with semaforo:
+            return await top_medidores_de_rango(rango, desde, hasta, n, permitidos)
+
+    parciales = await asyncio.gather(*(uno(rango) for rango in rangos_de_tokens(TOP_RANGOS_TOKENS)))
+    return heapq.nlargest(n, (item for heap in parciales for item in heap))
+
+async def unir_infraestructura(ganadores: list, ambito: str) -> list:
+    """Completa con datos de infraestructura solo los n ganadores."""
+    if ambito == "medidor":
+        contratos = []
+        for (_, ident), (ok, cid) in zip(ganadores, await contratos_de_medidores([i for _, i in ganadores])):
+            if not ok:
+                logger.error(f"Error al buscar el contrato del medidor {ident}: {cid}")
+            contratos.append(cid if ok else None)
+    else:
+        contratos = [ident for _, ident in ganadores]
+    unicos = list(dict.fromkeys(c for c in contratos if c))
+    infra = {}
+    for cid, (ok, filas) in zip(unicos, await ejecutar_concurrente(stmt_infra_by_id, [(c,) for c in unicos])):
+        if ok and filas:
+            infra[cid] = filas[0]
+    resultado = []
+    for posicion, ((consumo, ident), cid) in enumerate(zip(ganadores, contratos), start=1):
+        inf = infra.get(cid) or {}
+        resultado.append({
+            "posicion": posicion,
+            "id": ident,
+            "consumo": consumo,
+            "contrato_id": cid,
+            "nombre": inf.get("nombre"),
+            "zona": inf.get("zona"),
+            "distrito": inf.get("distrito"),
+        })
+    return resultado
+
+@app.get("/dashboard/top_consumidores")
+@cacheado
+async def top_consumidores(
+    fecha_hora: Optional[str] = Query(None, description="Hora 'YYYY-MM-DD HH:MM'"),
+    fecha: Optional[str] = Query(None, description="Día 'YYYY-MM-DD'"),
+    desde: Optional[str] = Query(None, description="Inicio de un rango ad hoc 'YYYY-MM-DD HH:MM'"),
+    hasta: Optional[str] = Query(None, description="Fin (excluido) del rango ad hoc"),
+    ambito: str = Query("contrato", description="contrato | medidor"),
+    zona: Optional[str] = Query(None),
+    n: int = Query(TOP_LIMITE, ge=1, le=TOP_N_GUARDADO)
+):
+    """
+    Top n contratos o medidores por consumo de una hora, un día o (solo
+    medidores) un rango ad hoc, opcionalmente de una zona. Horas y días salen
+    de top_consumo, precalculado con heaps acotados en la carga; los rangos se
+    calculan escaneando lecturas_medidor con un heap de n por rango de tokens.
+    Solo los ganadores se unen con infraestructura.
+    """
+    if ambito not in TOP_AMBITOS:
+        raise HTTPException(400, f"ambito debe ser uno de {', '.join(TOP_AMBITOS)}")
+    if sum(x is not None for x in (fecha_hora, fecha, desde or hasta)) != 1:
+        raise HTTPException(400, "Indique solo uno de: fecha_hora, fecha o desde/hasta")
+
+    try:
+        if fecha_hora is not None:
+            periodo = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M").strftime("%Y-%m-%d %H:%M")
+        elif fecha is not None:
+            periodo = datetime.strptime(fecha, "%Y-%m-%d").strftime("%Y-%m-%d")
+        else:
+            ini = datetime.strptime(desde or "", "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+            fin = datetime.strptime(hasta or "", "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(400, "Formato inválido de fecha")
+
+    try:
+        if fecha_hora is not None or fecha is not None:
+            filas = await ejecutar(stmt_top, (periodo, ambito, zona or TOP_GRUPO_TOTAL, n))
+            ganadores = [(r["consumo"], r["id"]) for r in filas]
+        else:
+            if ambito != "medidor":
+                raise HTTPException(400, "Los rangos ad hoc solo admiten ambito=medidor; use fecha_hora o fecha")
+            if not ini < fin or (fin - ini).days > TOP_RANGO_MAX_DIAS:
+                raise HTTPException(400, f"El rango debe ser creciente y de como mucho {TOP_RANGO_MAX_DIAS} días")
+            ganadores = await top_medidores_en_rango(ini, fin, n, zona)
+        return await unir_infraestructura(ganadores, ambito)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error en /dashboard/top_consumidores: {e}", exc_info=True)
+        raise HTTPException(500, "Error interno al calcular el top de consumidores.")
 
 
 @app.get("/dashboard/debug_categorias")
-def debug_categorias():
+async def debug_categorias():
     try:
-        rows = session.execute("SELECT descripcion_categoria FROM infraestructura ALLOW FILTERING")
+        rows = await ejecutar("SELECT descripcion_categoria FROM infraestructura ALLOW FILTERING")
         unicos = set((r.get("descripcion_categoria") or "").strip().title() for r in rows)
         return {"categorias_encontradas": sorted(unicos)}
     except Exception as e:
@@ -501,6 +2022,74 @@ def debug_categorias():
 
 
 
+# --------------------------------------------
+# Administración de la caché (usado por los cargadores)
+# --------------------------------------------
+class InvalidacionRequest(BaseModel):
+    fechas_hora: Optional[List[str]] = None
+
+@app.post("/admin/cache/invalidar")
+async def invalidar_cache(req: InvalidacionRequest):
+    """
+    Invalida las respuestas cacheadas de las horas recién cargadas
+    ("YYYY-MM-DD HH:MM"). Sin fechas_hora vacía la caché completa.
+    """
+    eliminadas = cache_respuestas.invalidar(req.fechas_hora)
+    await cargar_marca_carga()
+    return {"eliminadas": eliminadas}
+
+@app.get("/admin/cache/stats")
+async def cache_stats():
+    return cache_respuestas.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Latencias por ruta, consultas a Cassandra y cluster.metrics en formato Prometheus."""
+    return Response(content=metricas.exponer(session.cluster), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/slow_queries")
+async def slow_queries(
+    limit: int = Query(50, ge=1, le=LENTAS_MAX_ENTRADAS),
+    consulta: Optional[str] = Query(None, description="Etiqueta de /metrics, p.ej. infraestructura_allow_filtering")
+):
+    """
+    Últimas consultas lentas o muestreadas con su traza: coordinador, réplicas,
+    sstables leídas, tombstones y eventos de system_traces.
+    """
+    return {
+        "umbral_ms": LENTAS_UMBRAL_SEGUNDOS * 1000,
+        "muestreo": LENTAS_MUESTREO,
+        "consultas": registro_lentas.listar(limit, consulta),
+    }
+
+@app.delete("/debug/slow_queries")
+async def limpiar_slow_queries():
+    return {"eliminadas": registro_lentas.limpiar()}
+
+@app.post("/admin/indices/recargar")
+async def recargar_indices():
+    """
+    Recarga los índices en memoria tras una carga de infraestructura y
+    descarta las respuestas cacheadas que dependen de ellos.
+    """
+    await asyncio.gather(cargar_indice_medidores(), cargar_indice_espacial())
+    eliminadas = cache_respuestas.invalidar_funciones(CACHE_DEPENDE_DE_INFRA)
+    return {
+        "cache_eliminadas": eliminadas,
+        "medidores": len(MEDIDOR_A_CONTRATO),
+        "celdas": len(indice_espacial),
+        "tiles_version": cache_tiles.version,
+        "contratos_busqueda": len(indice_nombres),
+    }
+
+
+# --------------------------------------------
+# Arranque: índices en memoria
+# --------------------------------------------
+@app.on_event("startup")
+async def startup_event():
+    await asyncio.gather(cargar_indice_medidores(), cargar_indice_espacial(), cargar_marca_carga())
+
 # --------------------------------------------
 # Apagado: cerrar sesión Cassandra
 # --------------------------------------------
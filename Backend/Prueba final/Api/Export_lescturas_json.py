@@ -2,58 +2,71 @@
 # export_lecturas.py
 
 import argparse
+import csv
+import gzip
+import io
 import json
+import os
+import sys
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
 from cassandra.query import dict_factory, SimpleStatement
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conexion_cassandra import PERFIL_ESCANEO, conectar, preparar_lectura
+
+FETCH_SIZE  = 500    # contratos por página de infraestructura
+CONCURRENCY = 200    # lecturas por medidor en vuelo por página
+
+CSV_COLUMNAS = [
+    "ContratoID", "Nombre", "CI/NIT", "Email", "Telefono", "Latitud", "Longitud",
+    "Distrito", "Zona", "CodigoMedidor", "Modelo", "Estado", "FechaHora",
+    "Lectura", "ConsumoPeriodo", "TarifaUSD"
+]
+
 def format_tarifa(v: float) -> str:
     return f"${v:.2f}"
 
 def get_session():
-    cluster = Cluster(['127.0.0.1'], protocol_version=4)
-    session = cluster.connect('semapa_v9')
-    session.row_factory = dict_factory
-    return session
-
-def export_lecturas(fecha_hora: str):
-    # 1) Parsear la fecha
-    naive = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M")
-    fh = naive.replace(tzinfo=timezone.utc)
+    return conectar(row_factory=dict_factory)
 
-    session = get_session()
-
-    # 2) Traer todas las lecturas para esa hora
-    cql_lect = """
+def iterar_contratos(session, fh, fetch_size=FETCH_SIZE):
+    """
+    Recorre infraestructura página a página y, para cada página, trae en
+    paralelo la lectura de la hora de cada medidor (una partición por medidor).
+    Va devolviendo los contratos con lecturas a medida que se arman, así que
+    la memoria depende del tamaño de página y no de la ciudad completa.
+    """
+    stmt_lect = preparar_lectura(session, """
         SELECT codigo_medidor, modelo, estado, lectura,
                consumo_periodo, tarifa_usd, fecha_hora
         FROM lecturas_medidor
-        WHERE fecha_hora = %s
-        ALLOW FILTERING
-    """
-    lect_rows = session.execute(SimpleStatement(cql_lect), (fh,)).all()
-
-    # 3) Agrupar lecturas por medidor
-    lect_by_med = {}
-    for r in lect_rows:
-        lect_by_med.setdefault(r['codigo_medidor'], []).append(r)
-
-    # 4) Cargar toda la infraestructura
-    infra_rows = session.execute("""
+        WHERE codigo_medidor = ? AND fecha_hora = ?
+    """)
+    infra = SimpleStatement("""
         SELECT contrato_id, nombre, ci_nit, email, telefono,
                latitud, longitud, distrito, zona, medidores
         FROM infraestructura
-    """).all()
-
-    # 5) Construir el JSON de salida
-    output = []
-    for inf in infra_rows:
-        cid = inf['contrato_id']
-        medidores = inf.get('medidores') or []
-        detalles = []
-        for md in medidores:
-            if md in lect_by_med:
-                for r in lect_by_med[md]:
+    """, fetch_size=fetch_size)
+
+    rs = session.execute(infra, execution_profile=PERFIL_ESCANEO)
+    while True:
+        pagina = rs.current_rows
+
+        # 1) Lecturas de todos los medidores de la página
+        params = [(md, fh) for inf in pagina for md in (inf.get('medidores') or [])]
+        lect_by_med = {}
+        resultados = execute_concurrent_with_args(session, stmt_lect, params, concurrency=CONCURRENCY)
+        for (md, _), (ok, filas) in zip(params, resultados):
+            if ok:
+                lect_by_med[md] = list(filas)
+
+        # 2) Unir cada contrato de la página con sus lecturas
+        for inf in pagina:
+            detalles = []
+            for md in inf.get('medidores') or []:
+                for r in lect_by_med.get(md, []):
                     detalles.append({
                         "CodigoMedidor":  md,
                         "Modelo":         r.get('modelo', "Unknown"),
@@ -64,26 +77,95 @@ def export_lecturas(fecha_hora: str):
                         "TarifaUSD":      format_tarifa(r.get('tarifa_usd', 0.0))
                     })
 
-        if detalles:
-            output.append({
-                "ContratoID": cid,
-                "Nombre":     inf.get('nombre', ""),
-                "CI/NIT":     inf.get('ci_nit', 0),
-                "Email":      inf.get('email', ""),
-                "Telefono":   inf.get('telefono', ""),
-                "Latitud":    inf.get('latitud', 0.0),
-                "Longitud":   inf.get('longitud', 0.0),
-                "Distrito":   inf.get('distrito', ""),
-                "Zona":       inf.get('zona', ""),
-                "Medidores":  detalles
-            })
-
-    # Cerrar sesión
-    session.cluster.shutdown()
-    return output
+            if detalles:
+                yield {
+                    "ContratoID": inf['contrato_id'],
+                    "Nombre":     inf.get('nombre', ""),
+                    "CI/NIT":     inf.get('ci_nit', 0),
+                    "Email":      inf.get('email', ""),
+                    "Telefono":   inf.get('telefono', ""),
+                    "Latitud":    inf.get('latitud', 0.0),
+                    "Longitud":   inf.get('longitud', 0.0),
+                    "Distrito":   inf.get('distrito', ""),
+                    "Zona":       inf.get('zona', ""),
+                    "Medidores":  detalles
+                }
+
+        if not rs.has_more_pages:
+            break
+        rs.fetch_next_page()
+
+def export_lecturas(fecha_hora: str):
+    """Devuelve la lista completa de contratos con lecturas (modo no streaming)."""
+    naive = datetime.strptime(fecha_hora, "%Y-%m-%d %H:%M")
+    fh = naive.replace(tzinfo=timezone.utc)
+
+    session = get_session()
+    try:
+        return list(iterar_contratos(session, fh))
+    finally:
+        session.cluster.shutdown()
+
+# —————— Escritores ——————
+def escribir_json(contratos, fp):
+    """Arreglo JSON con indent=2, escrito contrato por contrato."""
+    n = 0
+    fp.write("[")
+    for c in contratos:
+        fp.write(",\n" if n else "\n")
+        fp.write("  " + json.dumps(c, ensure_ascii=False, indent=2, default=str).replace("\n", "\n  "))
+        n += 1
+        fp.flush()
+    fp.write("\n]\n" if n else "]\n")
+    return n
+
+def escribir_ndjson(contratos, fp):
+    """Un contrato por línea."""
+    n = 0
+    for c in contratos:
+        fp.write(json.dumps(c, ensure_ascii=False, default=str))
+        fp.write("\n")
+        n += 1
+        fp.flush()
+    return n
+
+def escribir_csv(contratos, fp):
+    """Una fila por lectura de medidor, con los datos del contrato repetidos."""
+    writer = csv.DictWriter(fp, fieldnames=CSV_COLUMNAS)
+    writer.writeheader()
+    n = 0
+    for c in contratos:
+        base = {k: v for k, v in c.items() if k != "Medidores"}
+        for m in c["Medidores"]:
+            writer.writerow({**base, **m})
+        n += 1
+        fp.flush()
+    return n
+
+ESCRITORES = {"json": escribir_json, "ndjson": escribir_ndjson, "csv": escribir_csv}
+
+@contextmanager
+def abrir_salida(ruta: str, comprimir: bool):
+    """Abre la salida en texto ('-' es stdout), opcionalmente como stream gzip."""
+    if ruta == "-":
+        if comprimir:
+            gz = gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb")
+            fp = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+            try:
+                yield fp
+            finally:
+                fp.close()
+        else:
+            yield sys.stdout
+    elif comprimir:
+        with gzip.open(ruta, "wt", encoding="utf-8", newline="") as fp:
+            yield fp
+    else:
+        with open(ruta, "w", encoding="utf-8", newline="") as fp:
+            yield fp
 
 def main():
-    parser = argparse.ArgumentParser(description="Exporta lecturas a JSON.")
+    parser = argparse.ArgumentParser(description="Exporta lecturas a JSON, NDJSON o CSV.")
     parser.add_argument(
         "--fecha_hora", "-f",
         required=True,
@@ -92,19 +174,45 @@ def main():
     parser.add_argument(
         "--output", "-o",
         required=True,
-        help="Ruta del fichero JSON de salida"
+        help="Ruta del fichero de salida ('-' para stdout)"
+    )
+    parser.add_argument(
+        "--formato",
+        choices=sorted(ESCRITORES),
+        default="json",
+        help="json (arreglo), ndjson (un contrato por línea) o csv (una fila por lectura)"
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Comprime la salida con gzip mientras se escribe (implícito si la ruta termina en .gz)"
+    )
+    parser.add_argument(
+        "--fetch_size",
+        type=int,
+        default=FETCH_SIZE,
+        help="Contratos por página leída de Cassandra"
     )
     args = parser.parse_args()
+    log = sys.stderr if args.output == "-" else sys.stdout
+    comprimir = args.gzip or args.output.endswith(".gz")
 
+    session = None
     try:
-        data = export_lecturas(args.fecha_hora)
-        with open(args.output, "w", encoding="utf-8") as fp:
-            json.dump(data, fp, ensure_ascii=False, indent=2)
-        print(f"✅ Exportado {len(data)} contratos con lecturas a {args.output}")
+        naive = datetime.strptime(args.fecha_hora, "%Y-%m-%d %H:%M")
+        fh = naive.replace(tzinfo=timezone.utc)
+
+        session = get_session()
+        with abrir_salida(args.output, comprimir) as fp:
+            n = ESCRITORES[args.formato](iterar_contratos(session, fh, args.fetch_size), fp)
+        print(f"✅ Exportado {n} contratos con lecturas a {args.output}", file=log)
     except ValueError as ve:
-        print(f"❌ Fecha inválida: {ve}")
+        print(f"❌ Fecha inválida: {ve}", file=log)
     except Exception as e:
-        print(f"🚨 Error: {e}")
+        print(f"🚨 Error: {e}", file=log)
+    finally:
+        if session is not None:
+            session.cluster.shutdown()
 
 if __name__ == "__main__":
     main()
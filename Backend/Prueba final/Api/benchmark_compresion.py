@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# benchmark_compresion.py
+#
+# Tamaño y latencia de una respuesta /lecturas del tamaño de la ciudad sin
+# comprimir, con gzip y con Brotli a varios niveles:
+#   - offline: payload sintético (mismo JSON que el camino rápido de la API),
+#     tiempo de compresión y descompresión y transferencia estimada por enlace
+#   - con --url: peticiones reales a la API con cada Accept-Encoding, tiempo
+#     total hasta tener el JSON descomprimido en el cliente
+#
+#   python benchmark_compresion.py --contratos 120000
+#   python benchmark_compresion.py --url "http://localhost:8000/lecturas?lat_min=-17.6&lat_max=-17.2&lon_min=-66.4&lon_max=-66.0&record_limit=1000"
+
+import argparse
+import gzip
+import statistics
+import time
+import urllib.request
+
+try:
+    import brotli  # pip install brotli
+except ImportError:
+    brotli = None
+
+from benchmark_serializacion import filas_sinteticas
+from modelos import contrato_publico, dumps_json
+
+# Mbit/s aproximados de enlaces típicos de los clientes
+ENLACES = (("3G", 1.5), ("4G", 10.0), ("fibra", 100.0))
+
+def codificadores():
+    casos = [("identity", lambda b: b, lambda b: b)]
+    for nivel in (1, 6, 9):
+        casos.append((f"gzip-{nivel}", lambda b, n=nivel: gzip.compress(b, n), gzip.decompress))
+    if brotli is not None:
+        for calidad in (1, 4, 5, 11):
+            casos.append((f"br-{calidad}", lambda b, q=calidad: brotli.compress(b, quality=q), brotli.decompress))
+    return casos
+
+def medir(fn, repeticiones, *args):
+    """Mejor tiempo (ms) de `repeticiones` ejecuciones y el resultado."""
+    mejor, resultado = float("inf"), None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = fn(*args)
+        mejor = min(mejor, (time.perf_counter() - t0) * 1000)
+    return mejor, resultado
+
+def offline(contratos: int, repeticiones: int):
+    infra, _ = filas_sinteticas(contratos)
+    payload = dumps_json([contrato_publico(inf) for inf in infra])
+    print(f"→ /lecturas sintético: {contratos} contratos, {len(payload) / 1024:.0f} KiB sin comprimir"
+          f"{'' if brotli is not None else ' (brotli no instalado: solo gzip)'}")
+
+    cabecera = f"{'codificación':<10} {'KiB':>8} {'ratio':>6} {'comp ms':>8} {'desc ms':>8}"
+    cabecera += "".join(f" {nombre + ' ms':>9}" for nombre, _ in ENLACES)
+    print(cabecera)
+    for nombre, comprimir, descomprimir in codificadores():
+        t_comp, cuerpo = medir(comprimir, repeticiones, payload)
+        t_desc, original = medir(descomprimir, repeticiones, cuerpo)
+        assert original == payload
+        linea = f"{nombre:<10} {len(cuerpo) / 1024:8.0f} {len(payload) / len(cuerpo):6.1f} {t_comp:8.1f} {t_desc:8.1f}"
+        for _, mbps in ENLACES:
+            transferencia = len(cuerpo) * 8 / (mbps * 1_000_000) * 1000
+            linea += f" {t_comp + transferencia + t_desc:9.0f}"
+        print(linea)
+    print("(columnas por enlace: compresión + transferencia estimada + descompresión)")
+
+def en_vivo(url: str, repeticiones: int):
+    print(f"→ {url}\n   {repeticiones} peticiones por codificación")
+    print(f"{'Accept-Encoding':<16} {'recibida':<9} {'KiB':>8} {'p50 ms':>8} {'máx ms':>8}")
+    aceptadas = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    for ae in aceptadas:
+        tiempos, recibida, largo = [], "", 0
+        for _ in range(repeticiones):
+            peticion = urllib.request.Request(url, headers={"Accept-Encoding": ae})
+            t0 = time.perf_counter()
+            with urllib.request.urlopen(peticion) as resp:
+                cuerpo = resp.read()
+                recibida = resp.headers.get("Content-Encoding", "identity")
+            if recibida == "gzip":
+                gzip.decompress(cuerpo)
+            elif recibida == "br":
+                brotli.decompress(cuerpo)
+            tiempos.append((time.perf_counter() - t0) * 1000)
+            largo = len(cuerpo)
+        print(f"{ae:<16} {recibida:<9} {largo / 1024:8.0f} {statistics.median(tiempos):8.1f} {max(tiempos):8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de compresión gzip/Brotli de /lecturas.")
+    parser.add_argument("--contratos", "-n", type=int, default=120000)
+    parser.add_argument("--repeticiones", "-r", type=int, default=5)
+    parser.add_argument("--url", "-u", help="URL de la API para medir de punta a punta")
+    args = parser.parse_args()
+
+    if args.url:
+        en_vivo(args.url, args.repeticiones)
+    else:
+        offline(args.contratos, args.repeticiones)
+
+if __name__ == "__main__":
+    main()
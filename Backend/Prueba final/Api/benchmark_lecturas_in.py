@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# benchmark_lecturas_in.py
+#
+# Latencia de traer las lecturas de una hora para N medidores con
+#   a) una consulta `codigo_medidor IN ? AND fecha_hora = ? ALLOW FILTERING`
+#   b) N lecturas de una partición en paralelo (token-aware), unidas en cliente
+# para N = 1, 3 y 50 (o los que se pasen con --medidores).
+#
+#   python benchmark_lecturas_in.py --fecha_hora "2025-04-01 08:00" --repeticiones 200
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from cassandra.query import dict_factory
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conexion_cassandra import conectar, preparar_lectura
+
+def lecturas_in(session, stmt, meds, fh):
+    return list(session.execute(stmt, (fh, meds)))
+
+def lecturas_paralelas(session, stmt, meds, fh):
+    futuros = [session.execute_async(stmt, (md, fh)) for md in meds]
+    return [r for f in futuros for r in f.result()]
+
+def percentil(valores, p):
+    orden = sorted(valores)
+    return orden[min(len(orden) - 1, int(round(p / 100 * (len(orden) - 1))))]
+
+def medir(fn, repeticiones, *args):
+    tiempos, filas = [], 0
+    fn(*args)   # calentamiento
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        filas = len(fn(*args))
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    return tiempos, filas
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara IN ? contra lecturas paralelas de una partición.")
+    parser.add_argument("--fecha_hora", "-f", required=True, help="Fecha y hora exacta: 'YYYY-MM-DD HH:MM'")
+    parser.add_argument("--medidores", "-m", type=int, nargs="+", default=[1, 3, 50])
+    parser.add_argument("--repeticiones", "-r", type=int, default=100)
+    args = parser.parse_args()
+
+    fh = datetime.strptime(args.fecha_hora, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+    session = conectar(row_factory=dict_factory)
+    try:
+        stmt_in = preparar_lectura(session, """
+            SELECT codigo_medidor, modelo, estado, lectura, consumo_periodo, tarifa_usd, fecha_hora
+              FROM lecturas_medidor
+             WHERE fecha_hora = ?
+               AND codigo_medidor IN ?
+             ALLOW FILTERING
+        """)
+        stmt_uno = preparar_lectura(session, """
+            SELECT codigo_medidor, modelo, estado, lectura, consumo_periodo, tarifa_usd, fecha_hora
+              FROM lecturas_medidor
+             WHERE codigo_medidor = ?
+               AND fecha_hora = ?
+        """)
+        todos = [r["codigo_medidor"] for r in session.execute("SELECT codigo_medidor FROM medidor_contrato LIMIT 5000")]
+        if not todos:
+            print("❌ medidor_contrato está vacía; cargue primero la infraestructura")
+            return
+
+        print(f"→ {args.repeticiones} repeticiones por caso, hora {args.fecha_hora}")
+        print(f"{'N':>4} {'estrategia':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'filas':>6}")
+        for n in args.medidores:
+            meds = random.sample(todos, min(n, len(todos)))
+            for nombre, fn, stmt in (("IN ?", lecturas_in, stmt_in), ("paralelo", lecturas_paralelas, stmt_uno)):
+                tiempos, filas = medir(fn, args.repeticiones, session, stmt, meds, fh)
+                print(f"{len(meds):>4} {nombre:<12} {statistics.median(tiempos):9.2f} "
+                      f"{percentil(tiempos, 95):9.2f} {percentil(tiempos, 99):9.2f} {filas:>6}")
+    finally:
+        session.cluster.shutdown()
+
+if __name__ == "__main__":
+    main()
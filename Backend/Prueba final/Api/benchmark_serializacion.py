@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# benchmark_serializacion.py
+#
+# Compara, con filas sintéticas con la forma de dict_factory, el camino con
+# modelos Pydantic (construir un modelo por fila + jsonable_encoder + json.dumps,
+# como hace FastAPI al devolver modelos) contra el camino rápido de modelos.py
+# (dicts con la forma del modelo + dumps_json). No necesita Cassandra.
+#
+#   python benchmark_serializacion.py --contratos 20000 --repeticiones 5
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+
+from modelos import (
+    MedidorResponse, ContratoResponse, ContratoDetalleResponse,
+    contrato_publico, medidor_publico, detalle_publico, dumps_json, format_tarifa, orjson
+)
+
+def filas_sinteticas(n: int, medidores_por_contrato: int = 3):
+    """Filas de infraestructura y lecturas como las devuelve el driver con dict_factory."""
+    random.seed(42)
+    fh = datetime(2025, 4, 1, tzinfo=timezone.utc) + timedelta(hours=8)
+    infra, lecturas = [], {}
+    for i in range(n):
+        meds = [f"MD-{i:06d}-{j}" for j in range(medidores_por_contrato)]
+        infra.append({
+            "contrato_id": f"CT-{i:06d}",
+            "nombre": f"Contrato Ñandú {i}",
+            "ci_nit": 1_000_000 + i,
+            "email": f"c{i}@semapa.bo",
+            "telefono": f"7{i:07d}",
+            "latitud": -17.39 + random.uniform(-0.05, 0.05),
+            "longitud": -66.16 + random.uniform(-0.05, 0.05),
+            "distrito": f"D{i % 15}",
+            "zona": f"Zona {i % 40}",
+            "medidores": meds,
+        })
+        for md in meds:
+            lecturas[md] = {
+                "codigo_medidor": md,
+                "modelo": "Kamstrup flowIQ 2200",
+                "estado": "Automatico (Bien)",
+                "lectura": random.randint(0, 100_000),
+                "consumo_periodo": random.randint(0, 1300),
+                "tarifa_usd": Decimal(f"{random.uniform(16.74, 145.98):.2f}"),
+                "fecha_hora": fh,
+            }
+    return infra, lecturas
+
+# —————— Camino Pydantic ——————
+def contratos_pydantic(infra):
+    modelos = [
+        ContratoResponse(
+            ContratoID=inf['contrato_id'], Nombre=inf['nombre'], CI_NIT=inf['ci_nit'],
+            Email=inf['email'], Telefono=inf['telefono'], Latitud=inf['latitud'],
+            Longitud=inf['longitud'], Distrito=inf['distrito'], Zona=inf['zona'],
+            Medidores=inf.get('medidores') or []
+        )
+        for inf in infra
+    ]
+    return json.dumps(jsonable_encoder(modelos), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def detalles_pydantic(infra, lecturas):
+    modelos = []
+    for inf in infra:
+        meds = [
+            MedidorResponse(
+                CodigoMedidor=md,
+                Modelo=r.get('modelo') or "Unknown",
+                Estado=r.get('estado') or "Unknown",
+                FechaHora=r['fecha_hora'].strftime("%Y-%m-%d %H:%M"),
+                Lectura=r.get('lectura') or 0,
+                ConsumoPeriodo=r.get('consumo_periodo') or 0,
+                TarifaUSD=format_tarifa(r.get('tarifa_usd') or 0.0)
+            )
+            for md in inf['medidores'] for r in [lecturas[md]]
+        ]
+        modelos.append(ContratoDetalleResponse(
+            ContratoID=inf['contrato_id'], Nombre=inf['nombre'], CI_NIT=inf['ci_nit'],
+            Email=inf['email'], Telefono=inf['telefono'], Latitud=inf['latitud'],
+            Longitud=inf['longitud'], Distrito=inf['distrito'], Zona=inf['zona'],
+            Medidores=meds
+        ))
+    return json.dumps(jsonable_encoder(modelos), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# —————— Camino rápido ——————
+def contratos_rapido(infra):
+    return dumps_json([contrato_publico(inf) for inf in infra])
+
+def detalles_rapido(infra, lecturas):
+    return dumps_json([
+        detalle_publico(inf, [medidor_publico(md, lecturas[md]) for md in inf['medidores']])
+        for inf in infra
+    ])
+
+def medir(fn, repeticiones, *args):
+    """Mejor tiempo (ms) de `repeticiones` ejecuciones y el payload producido."""
+    mejor, payload = float("inf"), b""
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        payload = fn(*args)
+        mejor = min(mejor, (time.perf_counter() - t0) * 1000)
+    return mejor, payload
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de serialización Pydantic vs camino rápido.")
+    parser.add_argument("--contratos", "-n", type=int, default=20000)
+    parser.add_argument("--repeticiones", "-r", type=int, default=5)
+    args = parser.parse_args()
+
+    infra, lecturas = filas_sinteticas(args.contratos)
+    print(f"→ {args.contratos} contratos, mejor de {args.repeticiones} "
+          f"(encoder rápido: {'orjson' if orjson is not None else 'json'})")
+
+    casos = [
+        ("/lecturas (ContratoResponse)", contratos_pydantic, contratos_rapido, (infra,)),
+        ("/lecturas/identificar (ContratoDetalleResponse)", detalles_pydantic, detalles_rapido, (infra, lecturas)),
+    ]
+    for nombre, lento, rapido, fn_args in casos:
+        t_lento, p_lento = medir(lento, args.repeticiones, *fn_args)
+        t_rapido, p_rapido = medir(rapido, args.repeticiones, *fn_args)
+        iguales = json.loads(p_lento) == json.loads(p_rapido)
+        print(f"\n{nombre}")
+        print(f"   Pydantic : {t_lento:9.1f} ms  ({len(p_lento) / 1024:.0f} KiB)")
+        print(f"   Rápido   : {t_rapido:9.1f} ms  ({len(p_rapido) / 1024:.0f} KiB)")
+        print(f"   Aceleración x{t_lento / t_rapido:.1f} — mismo JSON: {'sí' if iguales else 'NO'}")
+
+if __name__ == "__main__":
+    main()
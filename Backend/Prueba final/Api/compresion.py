@@ -0,0 +1,185 @@
+import zlib
+
+try:
+    import brotli  # pip install brotli
+except ImportError:
+    brotli = None
+
+# --------------------------------------------
+# Compresión negociada (Accept-Encoding) de respuestas: br / gzip
+# --------------------------------------------
+TIPOS_COMPRIMIBLES = (b"application/json", b"application/x-ndjson", b"text/")
+
+def elegir_codificacion(accept_encoding: str) -> str:
+    """'br', 'gzip' o '' según Accept-Encoding (respeta q=0; a igual q prefiere br)."""
+    preferencias = {}
+    for parte in accept_encoding.lower().split(","):
+        nombre, _, params = parte.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        preferencias[nombre.strip()] = q
+    candidatas = [("br", 2)] if brotli is not None else []
+    candidatas.append(("gzip", 1))
+    mejor, mejor_clave = "", (0.0, 0)
+    for nombre, prioridad in candidatas:
+        q = preferencias.get(nombre, preferencias.get("*", 0.0))
+        if q > 0 and (q, prioridad) > mejor_clave:
+            mejor, mejor_clave = nombre, (q, prioridad)
+    return mejor
+
+def validadores(if_none_match: str) -> set:
+    """ETags de If-None-Match sin comillas ni prefijo W/ ('*' queda tal cual)."""
+    etags = set()
+    for t in if_none_match.split(","):
+        t = t.strip()
+        t = t[2:] if t.startswith("W/") else t
+        if t:
+            etags.add(t.strip('"'))
+    return etags
+
+def etag_coincide(etag: str, if_none_match: str) -> bool:
+    """
+    If-None-Match contra un ETag sin sufijo: acepta también las variantes
+    "<etag>-gzip" y "<etag>-br" que pone CompresionMiddleware.
+    """
+    base = etag.strip('"')
+    return bool(validadores(if_none_match) & {"*", base, f"{base}-gzip", f"{base}-br"})
+
+class _Compresor:
+    def __init__(self, codificacion: str, nivel_gzip: int, calidad_br: int):
+        if codificacion == "br":
+            self._c = brotli.Compressor(quality=calidad_br)
+            self.comprimir = self._c.process
+            self.vaciar = self._c.flush
+            self.terminar = self._c.finish
+        else:
+            self._c = zlib.compressobj(nivel_gzip, zlib.DEFLATED, 31)   # 31: cabecera gzip
+            self.comprimir = self._c.compress
+            self.vaciar = lambda: self._c.flush(zlib.Z_SYNC_FLUSH)
+            self.terminar = self._c.flush
+
+class CompresionMiddleware:
+    """
+    Middleware ASGI que comprime con br o gzip según Accept-Encoding las
+    respuestas JSON/NDJSON/texto de al menos `minimo` bytes. Las respuestas en
+    streaming se comprimen trozo a trozo (con flush por trozo, así el cliente
+    recibe datos sin esperar al final). Marca Vary: Accept-Encoding y añade
+    el sufijo de la codificación al ETag, que identifica a la representación.
+    Los 304 llevan el mismo validador que el 200 que revalidan: con sufijo si
+    el cliente mandó la variante comprimida en If-None-Match.
+    """
+
+    def __init__(self, app, minimo: int = 1024, nivel_gzip: int = 6, calidad_br: int = 4):
+        self.app = app
+        self.minimo = minimo
+        self.nivel_gzip = nivel_gzip
+        self.calidad_br = calidad_br
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        if_none_match = ""
+        for k, v in scope.get("headers") or ():
+            if k == b"accept-encoding":
+                accept = v.decode("latin-1")
+            elif k == b"if-none-match":
+                if_none_match = v.decode("latin-1")
+        codificacion = elegir_codificacion(accept)
+        if not codificacion:
+            await self.app(scope, receive, send)
+            return
+
+        inicio = None        # mensaje http.response.start retenido
+        compresor = None     # None: aún sin decidir / sin comprimir
+        pasar = False        # respuesta que se deja tal cual
+
+        async def enviar(mensaje):
+            nonlocal inicio, compresor, pasar
+            if pasar:
+                await send(mensaje)
+                return
+            if mensaje["type"] == "http.response.start":
+                if mensaje.get("status") == 304:
+                    pasar = True
+                    await send(self._inicio_304(mensaje, codificacion, if_none_match))
+                    return
+                inicio = mensaje
+                headers = {k.lower(): v for k, v in mensaje.get("headers") or ()}
+                tipo = headers.get(b"content-type", b"")
+                if b"content-encoding" in headers or not any(tipo.startswith(t) for t in TIPOS_COMPRIMIBLES):
+                    pasar = True
+                    await send(mensaje)
+                return
+            if mensaje["type"] != "http.response.body":
+                await send(mensaje)
+                return
+
+            cuerpo = mensaje.get("body", b"")
+            mas = mensaje.get("more_body", False)
+            if compresor is None:
+                if not mas and len(cuerpo) < self.minimo:
+                    pasar = True
+                    await send(inicio)
+                    await send(mensaje)
+                    return
+                compresor = _Compresor(codificacion, self.nivel_gzip, self.calidad_br)
+                if not mas:
+                    comprimido = compresor.comprimir(cuerpo) + compresor.terminar()
+                    await send(self._inicio_comprimido(inicio, codificacion, len(comprimido)))
+                    await send({"type": "http.response.body", "body": comprimido})
+                    return
+                await send(self._inicio_comprimido(inicio, codificacion, None))
+
+            if mas:
+                trozo = compresor.comprimir(cuerpo) + compresor.vaciar()
+                await send({"type": "http.response.body", "body": trozo, "more_body": True})
+            else:
+                trozo = compresor.comprimir(cuerpo) + compresor.terminar()
+                await send({"type": "http.response.body", "body": trozo})
+
+        await self.app(scope, receive, enviar)
+
+    @staticmethod
+    def _inicio_304(inicio: dict, codificacion: str, if_none_match: str) -> dict:
+        """304 con el ETag de la variante que el cliente tiene en caché y Vary."""
+        headers = []
+        vary = None
+        for k, v in inicio.get("headers") or ():
+            kl = k.lower()
+            if kl == b"etag" and v.endswith(b'"'):
+                sufijado = v[:-1] + f'-{codificacion}"'.encode("latin-1")
+                if sufijado.decode("latin-1").strip('"') in validadores(if_none_match):
+                    v = sufijado
+            if kl == b"vary":
+                vary = v
+                continue
+            headers.append((k, v))
+        headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+        return {**inicio, "headers": headers}
+
+    @staticmethod
+    def _inicio_comprimido(inicio: dict, codificacion: str, largo) -> dict:
+        headers = []
+        vary = None
+        for k, v in inicio.get("headers") or ():
+            kl = k.lower()
+            if kl == b"content-length":
+                continue
+            if kl == b"etag" and v.endswith(b'"'):
+                v = v[:-1] + f'-{codificacion}"'.encode("latin-1")
+            if kl == b"vary":
+                vary = v
+                continue
+            headers.append((k, v))
+        headers.append((b"content-encoding", codificacion.encode("latin-1")))
+        headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+        if largo is not None:
+            headers.append((b"content-length", str(largo).encode("latin-1")))
+        return {**inicio, "headers": headers}
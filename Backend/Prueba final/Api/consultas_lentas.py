@@ -0,0 +1,107 @@
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+# --------------------------------------------
+# Registro de consultas lentas con trazas de Cassandra
+# --------------------------------------------
+RE_SSTABLES = re.compile(r"Merged data from memtables and (\d+) sstables")
+RE_VIVAS_TOMBSTONES = re.compile(r"Read (\d+) live rows and (\d+) tombstone cells")
+RE_ESCANEADAS = re.compile(r"Scanned (\d+) rows and matched (\d+)")
+
+def resumir_traza(trazas) -> dict:
+    """
+    Resume las trazas (una por página) de una consulta: coordinador, réplicas
+    que participaron, sstables leídas, tombstones y filas vistas, a partir de
+    los eventos que Cassandra escribe en system_traces.
+    """
+    resumen = {
+        "coordinador": None, "replicas": [], "duracion_us": 0, "paginas": len(trazas),
+        "sstables": 0, "tombstones": 0, "filas_vivas": 0, "filas_escaneadas": 0, "eventos": [],
+    }
+    replicas = set()
+    for t in trazas:
+        resumen["coordinador"] = resumen["coordinador"] or (str(t.coordinator) if t.coordinator else None)
+        if t.duration is not None:
+            resumen["duracion_us"] += int(t.duration.total_seconds() * 1_000_000)
+        for e in t.events or ():
+            replicas.add(str(e.source))
+            d = e.description or ""
+            m = RE_SSTABLES.search(d)
+            if m:
+                resumen["sstables"] += int(m.group(1))
+            m = RE_VIVAS_TOMBSTONES.search(d)
+            if m:
+                resumen["filas_vivas"] += int(m.group(1))
+                resumen["tombstones"] += int(m.group(2))
+            m = RE_ESCANEADAS.search(d)
+            if m:
+                resumen["filas_escaneadas"] += int(m.group(1))
+            resumen["eventos"].append({
+                "origen": str(e.source),
+                "us": int(e.source_elapsed.total_seconds() * 1_000_000) if e.source_elapsed else None,
+                "descripcion": d,
+            })
+    resumen["replicas"] = sorted(replicas)
+    return resumen
+
+class RegistroLentas:
+    """
+    Buffer circular acotado de consultas lentas. Una consulta entra si supera
+    `umbral` segundos (si es una lectura idempotente que no escanea, se vuelve
+    a ejecutar con trace=True, como mucho una vez cada `intervalo_retraza`
+    segundos por consulta) o si la eligió el muestreo
+    (`muestreo` = fracción de consultas que se ejecutan ya con trace=True).
+    """
+
+    def __init__(self, max_entradas: int, umbral: float, muestreo: float, intervalo_retraza: float):
+        self.umbral = umbral
+        self.muestreo = muestreo
+        self.intervalo_retraza = intervalo_retraza
+        self._entradas = deque(maxlen=max_entradas)
+        self._ultima_retraza = {}   # etiqueta de consulta -> time.monotonic()
+        self._lock = threading.Lock()
+
+    def muestrear(self) -> bool:
+        return self.muestreo > 0 and random.random() < self.muestreo
+
+    def debe_retrazar(self, consulta: str, duracion: float) -> bool:
+        """True si la consulta fue lenta y no se re-trazó hace poco."""
+        if self.umbral <= 0 or duracion < self.umbral:
+            return False
+        ahora = time.monotonic()
+        with self._lock:
+            if ahora - self._ultima_retraza.get(consulta, float("-inf")) < self.intervalo_retraza:
+                return False
+            self._ultima_retraza[consulta] = ahora
+            return True
+
+    def registrar(self, consulta: str, cql: str, params, duracion: float, motivo: str, traza: dict):
+        with self._lock:
+            self._entradas.append({
+                "fecha": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                "consulta": consulta,
+                "cql": " ".join((cql or "").split())[:500],
+                "params": repr(params)[:200] if params is not None else None,
+                "duracion_ms": round(duracion * 1000, 2),
+                "motivo": motivo,
+                "traza": traza,
+            })
+
+    def listar(self, limite: int, consulta: str = None) -> list:
+        """Entradas más recientes primero, opcionalmente de una sola consulta."""
+        with self._lock:
+            entradas = list(self._entradas)
+        entradas.reverse()
+        if consulta:
+            entradas = [e for e in entradas if e["consulta"] == consulta]
+        return entradas[:limite]
+
+    def limpiar(self) -> int:
+        with self._lock:
+            n = len(self._entradas)
+            self._entradas.clear()
+            return n
@@ -0,0 +1,168 @@
+import bisect
+import functools
+import re
+import threading
+from collections import deque
+
+# --------------------------------------------
+# Métricas en memoria con salida en formato de texto de Prometheus
+# --------------------------------------------
+LATENCIA_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FILAS_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+CUANTILES = (0.5, 0.95, 0.99)
+MUESTRAS_CUANTILES = 1024   # ventana deslizante por serie para p50/p95/p99
+
+def _etiquetas(nombres, valores, extra=None) -> str:
+    pares = list(zip(nombres, valores)) + (extra or [])
+    if not pares:
+        return ""
+    escapar = lambda v: str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in pares) + "}"
+
+def _num(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Histograma:
+    """
+    Histograma con buckets acumulados por combinación de etiquetas. Con
+    `resumen` además guarda las últimas MUESTRAS_CUANTILES observaciones de
+    cada serie y publica p50/p95/p99 como un summary con ese nombre.
+    """
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple, buckets: tuple, resumen: str = None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = tuple(buckets)
+        self.resumen = resumen
+        self._series = {}   # valores de etiquetas -> [conteos por bucket, suma, total, muestras]
+        self._lock = threading.Lock()
+
+    def observar(self, valores: tuple, valor: float):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0, deque(maxlen=MUESTRAS_CUANTILES)
+                ]
+            serie[0][bisect.bisect_left(self.buckets, valor)] += 1
+            serie[1] += valor
+            serie[2] += 1
+            if self.resumen:
+                serie[3].append(valor)
+
+    def exponer(self) -> list:
+        with self._lock:
+            series = {k: (list(c), s, n, sorted(m)) for k, (c, s, n, m) in self._series.items()}
+
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for valores, (conteos, suma, total, _) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, [('le', _num(limite))])} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {_num(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {total}")
+
+        if self.resumen:
+            lineas += [f"# HELP {self.resumen} {self.ayuda} (últimas {MUESTRAS_CUANTILES} muestras)",
+                       f"# TYPE {self.resumen} summary"]
+            for valores, (_, suma, total, muestras) in sorted(series.items()):
+                for q in CUANTILES:
+                    v = muestras[min(len(muestras) - 1, int(q * len(muestras)))] if muestras else 0.0
+                    lineas.append(f"{self.resumen}{_etiquetas(self.etiquetas, valores, [('quantile', q)])} {_num(v)}")
+                lineas.append(f"{self.resumen}_sum{_etiquetas(self.etiquetas, valores)} {_num(suma)}")
+                lineas.append(f"{self.resumen}_count{_etiquetas(self.etiquetas, valores)} {total}")
+        return lineas
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, valores: tuple, n: float = 1):
+        with self._lock:
+            self._series[valores] = self._series.get(valores, 0) + n
+
+    def exponer(self) -> list:
+        with self._lock:
+            series = dict(self._series)
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        lineas += [f"{self.nombre}{_etiquetas(self.etiquetas, k)} {_num(v)}" for k, v in sorted(series.items())]
+        return lineas
+
+# —————— Métricas de la API ——————
+http_latencia = Histograma(
+    "semapa_http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta",
+    ("metodo", "ruta", "estado"), LATENCIA_BUCKETS, resumen="semapa_http_request_latency_seconds"
+)
+cassandra_latencia = Histograma(
+    "semapa_cassandra_query_duration_seconds", "Tiempo de las consultas a Cassandra (todas sus páginas)",
+    ("consulta",), LATENCIA_BUCKETS, resumen="semapa_cassandra_query_latency_seconds"
+)
+cassandra_filas = Histograma(
+    "semapa_cassandra_rows_per_query", "Filas devueltas por consulta a Cassandra",
+    ("consulta",), FILAS_BUCKETS
+)
+cassandra_errores = Contador(
+    "semapa_cassandra_query_errors_total", "Consultas a Cassandra que terminaron en error", ("consulta",)
+)
+
+METRICAS = (http_latencia, cassandra_latencia, cassandra_filas, cassandra_errores)
+
+@functools.lru_cache(maxsize=512)
+def _etiqueta_cql(cql: str) -> str:
+    tabla = re.search(r"\bFROM\s+([\w.]+)", cql, re.IGNORECASE)
+    etiqueta = tabla.group(1).split(".")[-1] if tabla else cql.split(None, 1)[0].lower()
+    if re.search(r"\bALLOW\s+FILTERING\b", cql, re.IGNORECASE):
+        etiqueta += "_allow_filtering"
+    return etiqueta
+
+def cql_de(stmt) -> str:
+    """Texto CQL de un string, SimpleStatement, PreparedStatement o BoundStatement."""
+    if isinstance(stmt, str):
+        return stmt
+    return getattr(stmt, "query_string", None) or \
+        getattr(getattr(stmt, "prepared_statement", None), "query_string", "") or ""
+
+def etiqueta_consulta(stmt) -> str:
+    """Etiqueta corta de una consulta: su tabla, marcando los scans con ALLOW FILTERING."""
+    cql = cql_de(stmt)
+    return _etiqueta_cql(cql) if cql else "desconocida"
+
+def metricas_driver(cluster) -> list:
+    """cluster.metrics del driver (requiere metrics_enabled) en formato Prometheus."""
+    metrics = getattr(cluster, "metrics", None)
+    if metrics is None:
+        return []
+    stats = metrics.get_stats()
+    timer = stats.get("request_timer") or {}
+    lineas = [
+        "# HELP semapa_cassandra_driver_request_seconds Timer de peticiones del driver (cluster.metrics)",
+        "# TYPE semapa_cassandra_driver_request_seconds summary",
+    ]
+    for q, clave in ((0.5, "median"), (0.75, "75percentile"), (0.95, "95percentile"),
+                     (0.99, "99percentile"), (0.999, "999percentile")):
+        lineas.append(f'semapa_cassandra_driver_request_seconds{{quantile="{q}"}} {_num(float(timer.get(clave) or 0.0))}')
+    lineas.append(f"semapa_cassandra_driver_request_seconds_count {int(timer.get('count') or 0)}")
+
+    for nombre, tipo in (("connection_errors", "counter"), ("write_timeouts", "counter"),
+                         ("read_timeouts", "counter"), ("unavailables", "counter"),
+                         ("other_errors", "counter"), ("retries", "counter"), ("ignores", "counter"),
+                         ("known_hosts", "gauge"), ("connected_to", "gauge"), ("open_connections", "gauge")):
+        metrica = f"semapa_cassandra_driver_{nombre}" + ("_total" if tipo == "counter" else "")
+        lineas += [f"# TYPE {metrica} {tipo}", f"{metrica} {int(stats.get(nombre) or 0)}"]
+    return lineas
+
+def exponer(cluster=None) -> str:
+    lineas = []
+    for m in METRICAS:
+        lineas += m.exponer()
+    if cluster is not None:
+        lineas += metricas_driver(cluster)
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,134 @@
+from pydantic import BaseModel
+from typing import Dict, List
+import json
+
+try:
+    import orjson  # pip install orjson
+except ImportError:
+    orjson = None
+
+# --------------------------------------------
+# Modelos Pydantic (esquema OpenAPI de la API)
+# --------------------------------------------
+class MedidorResponse(BaseModel):
+    CodigoMedidor: str
+    Modelo: str
+    Estado: str
+    FechaHora: str
+    Lectura: int
+    ConsumoPeriodo: int
+    TarifaUSD: str
+
+class ContratoResponse(BaseModel):
+    ContratoID: str
+    Nombre: str
+    CI_NIT: int
+    Email: str
+    Telefono: str
+    Latitud: float
+    Longitud: float
+    Distrito: str
+    Zona: str
+    Medidores: List[str]
+
+class ClusterResponse(BaseModel):
+    Latitud: float
+    Longitud: float
+    Contratos: int
+    ConsumoPeriodo: int
+
+class ContratoBusquedaResponse(BaseModel):
+    ContratoID: str
+    Nombre: str
+    RazonSocial: str
+    CI_NIT: int
+    Zona: str
+    Puntaje: float
+
+class PuntoSerie(BaseModel):
+    FechaHora: str
+    Lecturas: int
+    Min: int
+    Max: int
+    Suma: int
+    Ultima: int
+    Consumo: int
+
+class SerieResponse(BaseModel):
+    CodigoMedidor: str
+    Desde: str
+    Hasta: str
+    BucketSegundos: int
+    Puntos: List[PuntoSerie]
+
+class ContratoDetalleResponse(BaseModel):
+    ContratoID: str
+    Nombre: str
+    CI_NIT: int
+    Email: str
+    Telefono: str
+    Latitud: float
+    Longitud: float
+    Distrito: str
+    Zona: str
+    Medidores: List[MedidorResponse]
+
+class BatchResponse(BaseModel):
+    resultados: Dict[str, ContratoDetalleResponse]
+    errores: Dict[str, str]
+
+# --------------------------------------------
+# Camino rápido: filas de dict_factory -> dicts con la forma de los modelos -> bytes
+# --------------------------------------------
+def format_tarifa(v: float) -> str:
+    return f"${v:.2f}"
+
+def contrato_publico(inf: dict) -> dict:
+    """Fila de infraestructura con los campos de ContratoResponse."""
+    return {
+        "ContratoID": inf['contrato_id'],
+        "Nombre": inf['nombre'],
+        "CI_NIT": inf['ci_nit'],
+        "Email": inf['email'],
+        "Telefono": inf['telefono'],
+        "Latitud": inf['latitud'],
+        "Longitud": inf['longitud'],
+        "Distrito": inf['distrito'],
+        "Zona": inf['zona'],
+        "Medidores": inf.get('medidores') or [],
+    }
+
+def medidor_publico(md: str, r: dict) -> dict:
+    """Fila de lecturas con los campos de MedidorResponse."""
+    return {
+        "CodigoMedidor": md,
+        "Modelo": r.get('modelo') or "Unknown",
+        "Estado": r.get('estado') or "Unknown",
+        "FechaHora": r['fecha_hora'].strftime("%Y-%m-%d %H:%M"),
+        "Lectura": r.get('lectura') or 0,
+        "ConsumoPeriodo": r.get('consumo_periodo') or 0,
+        "TarifaUSD": format_tarifa(r.get('tarifa_usd') or 0.0),
+    }
+
+def detalle_publico(inf: dict, medidores: list) -> dict:
+    """Contrato con sus lecturas, con los campos de ContratoDetalleResponse."""
+    detalle = contrato_publico(inf)
+    detalle["Medidores"] = medidores
+    return detalle
+
+def busqueda_publica(inf: dict, puntaje: float) -> dict:
+    """Fila de infraestructura con los campos de ContratoBusquedaResponse."""
+    return {
+        "ContratoID": inf['contrato_id'],
+        "Nombre": inf['nombre'],
+        "RazonSocial": inf.get('razon_social') or "",
+        "CI_NIT": inf['ci_nit'],
+        "Zona": inf['zona'],
+        "Puntaje": puntaje,
+    }
+
+def dumps_json(datos) -> bytes:
+    """Serializa a bytes con orjson si está instalado, o con json compacto."""
+    if orjson is not None:
+        return orjson.dumps(datos, default=str)
+    return json.dumps(datos, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
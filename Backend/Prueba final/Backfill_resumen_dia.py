@@ -0,0 +1,100 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cassandra.concurrent import execute_concurrent_with_args
+
+from conexion_cassandra import CONFIG, PERFIL_ESCANEO, conectar
+
+# —————— Configuración ——————
+KEYSPACE     = CONFIG['keyspace']
+TABLE_READ   = 'lecturas_medidor'
+TABLE_RESUMEN_DIA = 'resumen_dia'
+SERIE_TOTAL  = 'total'   # debe coincidir con SERIE_TOTAL en Insercion_validacion_lecturas.py
+RANGOS       = 256       # subrangos del anillo de tokens (Murmur3)
+HILOS        = 16        # subrangos escaneados en paralelo
+FETCH_SIZE   = 5000
+CONCURRENCY  = 200
+
+TOKEN_MIN = -2**63
+TOKEN_MAX = 2**63 - 1
+
+# CQL
+SCAN_CQL = f"""
+SELECT fecha_hora, consumo_periodo FROM {KEYSPACE}.{TABLE_READ}
+ WHERE token(codigo_medidor) > ? AND token(codigo_medidor) <= ?
+"""
+SELECT_DIA_CQL = f"""
+SELECT fecha, consumo_total, lecturas FROM {KEYSPACE}.{TABLE_RESUMEN_DIA}
+ WHERE serie = ?
+"""
+# resumen_dia es una tabla counter: no se puede sobrescribir, así que se suma la
+# diferencia entre el total recalculado y el valor actual de cada día.
+UPDATE_DIA_CQL = f"""
+UPDATE {KEYSPACE}.{TABLE_RESUMEN_DIA}
+   SET consumo_total = consumo_total + ?,
+       lecturas = lecturas + ?
+ WHERE serie = ? AND fecha = ?
+"""
+
+def rangos_de_tokens(n):
+    """Divide el anillo de tokens en n rangos (inicio, fin] contiguos."""
+    paso = (TOKEN_MAX - TOKEN_MIN) // n
+    limites = [TOKEN_MIN + i * paso for i in range(n)] + [TOKEN_MAX]
+    return list(zip(limites[:-1], limites[1:]))
+
+def escanear_rango(session, scan_ps, rango):
+    """Suma consumo y lecturas por día de las lecturas de un rango de tokens."""
+    dias = defaultdict(lambda: [0, 0])
+    stmt = scan_ps.bind(rango)
+    stmt.fetch_size = FETCH_SIZE
+    for r in session.execute(stmt, execution_profile=PERFIL_ESCANEO):
+        acc = dias[r.fecha_hora.date()]
+        acc[0] += r.consumo_periodo or 0
+        acc[1] += 1
+    return dias
+
+def main():
+    t0 = time.time()
+    session = conectar()
+
+    # 1) Escaneo paralelo de lecturas_medidor por rangos de tokens
+    scan_ps = session.prepare(SCAN_CQL)
+    rangos = rangos_de_tokens(RANGOS)
+    totales = defaultdict(lambda: [0, 0])
+    hechos = 0
+    print(f"→ Escaneando {TABLE_READ} en {len(rangos)} rangos de tokens ({HILOS} en paralelo)...", flush=True)
+    with ThreadPoolExecutor(max_workers=HILOS) as pool:
+        futuros = [pool.submit(escanear_rango, session, scan_ps, r) for r in rangos]
+        for fut in as_completed(futuros):
+            for fecha, (consumo, lecturas) in fut.result().items():
+                totales[fecha][0] += consumo
+                totales[fecha][1] += lecturas
+            hechos += 1
+            print(f"\r   Rangos escaneados: {hechos}/{len(rangos)}", end='', flush=True)
+    print()  # salto de línea
+
+    # 2) Ajuste de los counters a los totales recalculados
+    select_dia_ps = session.prepare(SELECT_DIA_CQL)
+    actuales = {
+        r.fecha.date(): (r.consumo_total or 0, r.lecturas or 0)
+        for r in session.execute(select_dia_ps, (SERIE_TOTAL,))
+    }
+    params = []
+    for fecha in set(totales) | set(actuales):
+        consumo, lecturas = totales.get(fecha, (0, 0))
+        consumo_act, lecturas_act = actuales.get(fecha, (0, 0))
+        if consumo != consumo_act or lecturas != lecturas_act:
+            params.append((consumo - consumo_act, lecturas - lecturas_act, SERIE_TOTAL, fecha))
+
+    print(f"→ Ajustando {len(params)} de {len(totales)} días en {TABLE_RESUMEN_DIA}...", flush=True)
+    update_ps = session.prepare(UPDATE_DIA_CQL)
+    execute_concurrent_with_args(session, update_ps, params, concurrency=CONCURRENCY)
+
+    session.cluster.shutdown()
+    elapsed = time.time() - t0
+    m, s = divmod(int(elapsed), 60)
+    print(f"\n🎉 ¡Hecho en {m}m{s}s! {len(totales)} días reconstruidos.", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import argparse
+import json
+import time
+import urllib.request
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+from cassandra.concurrent import execute_concurrent_with_args
+
+from conexion_cassandra import CONFIG, PERFIL_ESCANEO, conectar
+
+# —————— Configuración ——————
+KEYSPACE     = CONFIG['keyspace']
+TABLE_READ   = 'lecturas_medidor'
+TABLE_ANOMALIAS = 'anomalias_dia'
+TABLE_ESTADO = 'estado_carga'
+TABLE_MEDIDOR = 'medidor_contrato'
+CLAVE_ESTADO = 'lecturas'   # debe coincidir con CLAVE_ESTADO en Insercion_validacion_lecturas.py
+RANGOS       = 256       # subrangos del anillo de tokens (Murmur3)
+HILOS        = 16        # subrangos escaneados en paralelo
+FETCH_SIZE   = 5000
+CONCURRENCY  = 200
+API_URL      = 'http://127.0.0.1:8000'   # para invalidar la caché de la API tras la detección
+
+# Picos: z-score de cada lectura contra las VENTANA_DIAS anteriores de la misma hora del día
+VENTANA_DIAS  = 28
+MIN_HISTORIA  = 7        # lecturas previas mínimas para puntuar
+Z_UMBRAL      = 4.0
+DESVIO_MINIMO = 100      # además del z, consumo por encima de la media en unidades absolutas
+STD_MINIMO    = 10.0     # piso de la desviación (medidores casi constantes)
+
+# Flujo nocturno (posibles fugas): Crear_lecturas_medidores.py modela el consumo
+# nocturno en la lectura de las 00:00. Se marca el medidor si las últimas
+# NOCHES_SEGUIDAS noches superan todas su línea base robusta (mediana/MAD).
+HORAS_NOCHE     = range(0, 5)
+NOCHES_SEGUIDAS = 3
+Z_NOCHE         = 3.0
+NOCHE_MINIMO    = 50
+
+TIPO_PICO  = 'pico'              # debe coincidir con ANOMALIA_TIPOS en Api/Api_v1.py
+TIPO_NOCHE = 'flujo_nocturno'
+
+TOKEN_MIN = -2**63
+TOKEN_MAX = 2**63 - 1
+
+# CQL
+SCAN_CQL = f"""
+SELECT codigo_medidor, fecha_hora, consumo_periodo FROM {KEYSPACE}.{TABLE_READ}
+ WHERE token(codigo_medidor) > ? AND token(codigo_medidor) <= ?
+   AND fecha_hora >= ? AND fecha_hora < ?
+ ALLOW FILTERING
+"""
+SELECT_MEDIDORES_CQL = f"""
+SELECT codigo_medidor FROM {KEYSPACE}.{TABLE_MEDIDOR}
+"""
+SELECT_ESTADO_CQL = f"""
+SELECT fecha_hora FROM {KEYSPACE}.{TABLE_ESTADO} WHERE clave = ?
+"""
+DELETE_ANOMALIAS_CQL = f"""
+DELETE FROM {KEYSPACE}.{TABLE_ANOMALIAS} WHERE fecha = ?
+"""
+INSERT_ANOMALIA_CQL = f"""
+INSERT INTO {KEYSPACE}.{TABLE_ANOMALIAS}
+  (fecha, puntaje, codigo_medidor, tipo, consumo, esperado, fecha_hora)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+def rangos_de_tokens(n):
+    """Divide el anillo de tokens en n rangos (inicio, fin] contiguos."""
+    paso = (TOKEN_MAX - TOKEN_MIN) // n
+    limites = [TOKEN_MIN + i * paso for i in range(n)] + [TOKEN_MAX]
+    return list(zip(limites[:-1], limites[1:]))
+
+def volcar_pagina(filas, posicion, inicio, valores):
+    """
+    Escribe una página de lecturas en el cubo valores[hora, medidor, dia] (día
+    0 = `inicio`). Devuelve cuántas filas eran de medidores fuera de `posicion`.
+    """
+    conocidas = [r for r in filas if r.codigo_medidor in posicion]
+    if conocidas:
+        i_medidor = np.fromiter((posicion[r.codigo_medidor] for r in conocidas),
+                                dtype=np.int64, count=len(conocidas))
+        ts = np.array([r.fecha_hora for r in conocidas], dtype='datetime64[s]')
+        consumos = np.fromiter((np.nan if r.consumo_periodo is None else r.consumo_periodo for r in conocidas),
+                               dtype=np.float64, count=len(conocidas))
+        dia_ts = ts.astype('datetime64[D]')
+        i_dia = (dia_ts - inicio).astype(np.int64)
+        hora = ((ts - dia_ts) // np.timedelta64(1, 'h')).astype(np.int64)
+        valores[hora, i_medidor, i_dia] = consumos
+    return len(filas) - len(conocidas)
+
+def escanear_rango(session, scan_ps, rango, desde, hasta, posicion, valores):
+    """Vuelca en `valores`, página a página, las lecturas de un rango de tokens en [desde, hasta)."""
+    inicio = np.datetime64(desde.date(), 'D')
+    stmt = scan_ps.bind((*rango, desde, hasta))
+    stmt.fetch_size = FETCH_SIZE
+    resultado = session.execute(stmt, execution_profile=PERFIL_ESCANEO)
+    desconocidas = volcar_pagina(resultado.current_rows, posicion, inicio, valores)
+    while resultado.has_more_pages:
+        resultado.fetch_next_page()
+        desconocidas += volcar_pagina(resultado.current_rows, posicion, inicio, valores)
+    return desconocidas
+
+def cargar_series(session, desde, hasta):
+    """
+    Lecturas de [desde, hasta) como cubo numpy valores[hora, medidor, dia]
+    (NaN donde no hay lectura), con la lista de medidores y las horas del día
+    presentes en los datos. El cubo se reserva de antemano con los medidores de
+    medidor_contrato y las 24 horas, y cada página del escaneo se escribe en él
+    directamente: la memoria no crece con las filas leídas.
+    """
+    codigos = np.array(sorted(r.codigo_medidor for r in session.execute(SELECT_MEDIDORES_CQL)), dtype=str)
+    posicion = {c: i for i, c in enumerate(codigos.tolist())}
+    n_dias = (hasta.date() - desde.date()).days
+    valores = np.full((24, len(codigos), n_dias), np.nan)
+
+    scan_ps = session.prepare(SCAN_CQL)
+    rangos = rangos_de_tokens(RANGOS)
+    hechos = desconocidas = 0
+    with ThreadPoolExecutor(max_workers=HILOS) as pool:
+        futuros = [pool.submit(escanear_rango, session, scan_ps, r, desde, hasta, posicion, valores) for r in rangos]
+        for fut in as_completed(futuros):
+            desconocidas += fut.result()
+            hechos += 1
+            print(f"\r   Rangos escaneados: {hechos}/{len(rangos)}", end='', flush=True)
+    print()  # salto de línea
+    if desconocidas:
+        print(f"⚠️  {desconocidas} lecturas de medidores que no están en {TABLE_MEDIDOR} (ignoradas)", flush=True)
+
+    horas = np.array([h for h in range(24) if not np.isnan(valores[h]).all()], dtype=np.int64)
+    return codigos, horas, valores[horas]
+
+def zscores_moviles(valores):
+    """
+    Media, desviación y z-score de cada lectura contra las VENTANA_DIAS
+    lecturas anteriores de la misma hora (sumas acumuladas sobre el eje de
+    días, sin bucles por medidor). z es NaN con menos de MIN_HISTORIA previas.
+    """
+    validos = ~np.isnan(valores)
+    x = np.where(validos, valores, 0.0)
+    ceros = np.zeros(valores.shape[:-1] + (1,))
+    suma = np.concatenate([ceros, np.cumsum(x, axis=-1)], axis=-1)
+    cuadrados = np.concatenate([ceros, np.cumsum(x * x, axis=-1)], axis=-1)
+    conteo = np.concatenate([ceros, np.cumsum(validos, axis=-1)], axis=-1)
+
+    fin = np.arange(valores.shape[-1])
+    ini = np.maximum(fin - VENTANA_DIAS, 0)
+    n = conteo[..., fin] - conteo[..., ini]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = (suma[..., fin] - suma[..., ini]) / n
+        varianza = (cuadrados[..., fin] - cuadrados[..., ini]) / n - media * media
+        std = np.maximum(np.sqrt(np.maximum(varianza, 0.0)), STD_MINIMO)
+        z = (valores - media) / std
+    z[(n < MIN_HISTORIA) | ~validos] = np.nan
+    return media, z
+
+def detectar_picos(horas, valores, dias):
+    """{dia: [(medidor_idx, z, consumo, esperado, hora)]} con la peor lectura de cada medidor."""
+    media, z = zscores_moviles(valores)
+    marcado = (z >= Z_UMBRAL) & (valores - media >= DESVIO_MINIMO)
+    z = np.where(marcado, z, -np.inf)
+    resultado = {}
+    for d in dias:
+        peor = np.argmax(z[:, :, d], axis=0)              # hora con mayor z por medidor
+        meds = np.nonzero(np.isfinite(z[peor, np.arange(z.shape[1]), d]))[0]
+        resultado[d] = [
+            (m, float(z[peor[m], m, d]), float(valores[peor[m], m, d]), float(media[peor[m], m, d]), int(horas[peor[m]]))
+            for m in meds.tolist()
+        ]
+    return resultado
+
+def detectar_flujo_nocturno(horas, valores, dias):
+    """
+    {dia: [(medidor_idx, z, minimo, mediana, hora)]}: medidores cuyo mínimo de
+    las NOCHES_SEGUIDAS noches hasta ese día supera su mediana de las
+    VENTANA_DIAS noches anteriores por Z_NOCHE desviaciones robustas (MAD).
+    Los días evaluados siempre tienen esas VENTANA_DIAS + NOCHES_SEGUIDAS detrás.
+    """
+    noche = np.isin(horas, list(HORAS_NOCHE))
+    if not noche.any():
+        return {d: [] for d in dias}
+    hora_noche = int(horas[noche][0])
+    resultado = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)   # nanmin/nanmedian de filas sin datos
+        por_noche = np.nanmin(valores[noche], axis=0)     # [medidor, dia]
+        for d in dias:
+            recientes = por_noche[:, d - NOCHES_SEGUIDAS + 1:d + 1]
+            historia = por_noche[:, d - NOCHES_SEGUIDAS - VENTANA_DIAS + 1:d - NOCHES_SEGUIDAS + 1]
+            minimo = recientes.min(axis=1)                # NaN si falta alguna noche
+            mediana = np.nanmedian(historia, axis=1)
+            mad = np.nanmedian(np.abs(historia - mediana[:, None]), axis=1)
+            z = (minimo - mediana) / np.maximum(1.4826 * mad, STD_MINIMO)
+            suficientes = (~np.isnan(historia)).sum(axis=1) >= MIN_HISTORIA
+            marcado = suficientes & (z >= Z_NOCHE) & (minimo >= NOCHE_MINIMO)
+            resultado[d] = [
+                (m, float(z[m]), float(minimo[m]), float(mediana[m]), hora_noche)
+                for m in np.nonzero(marcado)[0].tolist()
+            ]
+    return resultado
+
+def fecha_por_defecto(session):
+    """Día de la marca de agua de la ingesta (última hora cargada)."""
+    r = session.execute(session.prepare(SELECT_ESTADO_CQL), (CLAVE_ESTADO,)).one()
+    if r is None or r.fecha_hora is None:
+        raise SystemExit("❌ estado_carga no tiene marca de agua; indique --fecha")
+    return r.fecha_hora.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def invalidar_cache_api():
+    """Pide a la API que descarte las respuestas que no dependen de una hora (como /dashboard/anomalias)."""
+    req = urllib.request.Request(
+        f"{API_URL}/admin/cache/invalidar", data=json.dumps({"fechas_hora": []}).encode('utf-8'),
+        headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            eliminadas = json.load(resp).get("eliminadas", 0)
+        print(f"→ Caché de la API invalidada ({eliminadas} respuestas).", flush=True)
+    except Exception as e:
+        print(f"⚠️  No se pudo invalidar la caché de la API: {e}", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Detecta picos de consumo y flujo nocturno por medidor.")
+    parser.add_argument("--fecha", "-f", help="Último día a evaluar 'YYYY-MM-DD' (por defecto, el de la marca de agua)")
+    parser.add_argument("--dias", "-d", type=int, default=1, help="Días a evaluar hasta --fecha")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    session = conectar()
+    ultimo = datetime.strptime(args.fecha, "%Y-%m-%d") if args.fecha else fecha_por_defecto(session)
+    historia = VENTANA_DIAS + NOCHES_SEGUIDAS - 1   # días de historia antes del primero evaluado
+    desde = ultimo - timedelta(days=historia + args.dias - 1)
+    hasta = ultimo + timedelta(days=1)
+    dias = list(range(historia, historia + args.dias))
+
+    # 1) Series por medidor en arrays numpy
+    print(f"→ Cargando {TABLE_READ} de {desde:%Y-%m-%d} a {ultimo:%Y-%m-%d}...", flush=True)
+    codigos, horas, valores = cargar_series(session, desde, hasta)
+    if not len(horas):
+        print("❌ No hay lecturas en ese período", flush=True)
+        session.cluster.shutdown()
+        return
+    print(f"   {len(codigos)} medidores × {valores.shape[2]} días × horas {horas.tolist()}", flush=True)
+
+    # 2) Detección vectorizada sobre todos los medidores a la vez
+    picos = detectar_picos(horas, valores, dias)
+    nocturnos = detectar_flujo_nocturno(horas, valores, dias)
+
+    # 3) Reemplazo de las anomalías de cada día evaluado
+    delete_ps = session.prepare(DELETE_ANOMALIAS_CQL)
+    insert_ps = session.prepare(INSERT_ANOMALIA_CQL)
+    for d in dias:
+        fecha = (desde + timedelta(days=d)).date()
+        params = [
+            (fecha, round(z, 3), str(codigos[m]), tipo, int(consumo), round(esperado, 2),
+             datetime(fecha.year, fecha.month, fecha.day, hora))
+            for tipo, encontrados in ((TIPO_PICO, picos[d]), (TIPO_NOCHE, nocturnos[d]))
+            for m, z, consumo, esperado, hora in encontrados
+        ]
+        session.execute(delete_ps, (fecha,))
+        execute_concurrent_with_args(session, insert_ps, params, concurrency=CONCURRENCY)
+        print(f"→ {fecha}: {len(picos[d])} picos, {len(nocturnos[d])} con flujo nocturno", flush=True)
+
+    session.cluster.shutdown()
+    invalidar_cache_api()
+    elapsed = time.time() - t0
+    m, s = divmod(int(elapsed), 60)
+    print(f"\n🎉 ¡Hecho en {m}m{s}s!", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
 import json
 import time
-from cassandra.cluster import Cluster
-from cassandra.policies import RoundRobinPolicy
+import urllib.request
 from cassandra.concurrent import execute_concurrent_with_args
 
+from conexion_cassandra import CONFIG, conectar
+
 # —————— Configuración ——————
-CASSANDRA_CONTACT_POINTS = ['127.0.0.1']
-KEYSPACE      = 'semapa_v9'
+KEYSPACE      = CONFIG['keyspace']
 TABLE_INFRA   = 'infraestructura'
+TABLE_MEDIDOR = 'medidor_contrato'
+TABLE_GEO     = 'infraestructura_geo'
+GEOHASH_PRECISION = 6   # celdas de ~1.2 km x 0.6 km; debe coincidir con Api/Api_v1.py
+API_URL       = 'http://127.0.0.1:8000'   # para recargar los índices de la API tras la carga
 INPUT_FILE    = 'infraestructuras_generadas3.json'
 CONCURRENCY   = 200
 
@@ -19,6 +23,48 @@ INSERT INTO {TABLE_INFRA} (
 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
 """
 
+INSERT_MEDIDOR_CQL = f"""
+INSERT INTO {TABLE_MEDIDOR} (codigo_medidor, contrato_id) VALUES (?, ?);
+"""
+
+INSERT_GEO_CQL = f"""
+INSERT INTO {TABLE_GEO} (
+    geohash, contrato_id, nombre, ci_nit, email, telefono,
+    latitud, longitud, distrito, zona, medidores
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash(lat, lon, precision=GEOHASH_PRECISION):
+    """Geohash estándar (bisección alternando longitud/latitud)."""
+    lat_rng, lon_rng = [-90.0, 90.0], [-180.0, 180.0]
+    codigo, ch, bit, es_lon = [], 0, 0, True
+    while len(codigo) < precision:
+        rng, val = (lon_rng, lon) if es_lon else (lat_rng, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch <<= 1
+            rng[1] = mid
+        es_lon = not es_lon
+        bit += 1
+        if bit == 5:
+            codigo.append(GEOHASH_BASE32[ch])
+            ch, bit = 0, 0
+    return "".join(codigo)
+
+def recargar_indices_api():
+    """Pide a la API que recargue sus índices en memoria (medidores, espacial)."""
+    req = urllib.request.Request(f"{API_URL}/admin/indices/recargar", data=b"", method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            print(f"→ Índices de la API recargados: {json.load(resp)}", flush=True)
+    except Exception as e:
+        print(f"⚠️  No se pudieron recargar los índices de la API: {e}", flush=True)
+
 def safe_get(item, key, default=""):
     v = item.get(key)
     return v if v not in (None, "") else default
@@ -35,6 +81,8 @@ def main():
         raw = json.load(f)
 
     params = []
+    params_medidor = []
+    params_geo = []
     for item in raw:
         med = item.get("Medidores", [])
         if not isinstance(med, list):
@@ -43,31 +91,46 @@ def main():
         raw_distrito = item.get("Distrito", "")
         distrito_str = f"D{raw_distrito}" if raw_distrito != "" else ""
 
+        contrato_id = safe_get(item, "ContratoID")
+        nombre      = safe_get(item, "Nombre")
+        email       = safe_get(item, "Email")
+        telefono    = safe_get(item, "Telefono")
+        ci_nit      = int(safe_get(item, "CI/NIT", 0))
+        zona        = safe_get(item, "Zona")
+        latitud     = float(item.get("Latitud", 0.0))
+        longitud    = float(item.get("Longitud", 0.0))
+
         params.append((
-            safe_get(item, "ContratoID"),
+            contrato_id,
             safe_get(item, "Categoria"),
             safe_get(item, "DescripcionCategoria"),
-            safe_get(item, "Nombre"),
-            safe_get(item, "Email"),
-            safe_get(item, "Telefono"),
-            int(safe_get(item, "CI/NIT", 0)),
+            nombre,
+            email,
+            telefono,
+            ci_nit,
             safe_get(item, "Razon Social"),
             safe_get(item, "Tipo Infraestructura"),
             safe_get(item, "SubAlcaldia").replace("\n", " ").strip(),
             distrito_str,
-            safe_get(item, "Zona"),
-            float(item.get("Latitud", 0.0)),
-            float(item.get("Longitud", 0.0)),
+            zona,
+            latitud,
+            longitud,
             med
         ))
+        params_medidor.extend((m, contrato_id) for m in med)
+        params_geo.append((
+            geohash(latitud, longitud), contrato_id, nombre, ci_nit, email, telefono,
+            latitud, longitud, distrito_str, zona, med
+        ))
     total = len(params)
     print(f" hecho. {total} registros listos.")
 
     # 2) Conexión y preparación de la consulta
     print("→ Conectando a Cassandra...", flush=True)
-    cluster = Cluster(CASSANDRA_CONTACT_POINTS, load_balancing_policy=RoundRobinPolicy())
-    session = cluster.connect(KEYSPACE)
+    session = conectar()
     prepared = session.prepare(INSERT_CQL)
+    prepared_medidor = session.prepare(INSERT_MEDIDOR_CQL)
+    prepared_geo = session.prepare(INSERT_GEO_CQL)
 
     # 3) Inserción concurrente por lotes
     print(f"→ Inyectando {total} registros en {TABLE_INFRA}...", flush=True)
@@ -80,7 +143,19 @@ def main():
         print(f"\r   Registros insertados: {inserted}/{total}", end="", flush=True)
     print()  # salto de línea
 
-    # 4) Tiempo total
+    # 4) Índice inverso medidor -> contrato
+    print(f"→ Inyectando {len(params_medidor)} medidores en {TABLE_MEDIDOR}...", flush=True)
+    for batch in chunked(params_medidor, CONCURRENCY):
+        execute_concurrent_with_args(session, prepared_medidor, batch, concurrency=CONCURRENCY)
+
+    # 5) Puntos de contratos particionados por geohash (consultas por bbox)
+    print(f"→ Inyectando {len(params_geo)} puntos en {TABLE_GEO}...", flush=True)
+    for batch in chunked(params_geo, CONCURRENCY):
+        execute_concurrent_with_args(session, prepared_geo, batch, concurrency=CONCURRENCY)
+
+    recargar_indices_api()
+
+    # 6) Tiempo total
     elapsed = time.time() - start
     m, s = divmod(int(elapsed), 60)
     print(f"\n✅ Inserción completada en {m}m{s}s: {inserted} registros.")
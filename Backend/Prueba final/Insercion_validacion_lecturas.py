@@ -1,22 +1,38 @@
 import os
+import heapq
 import json
 import time
-from datetime import datetime
+import uuid
+import zlib
+import urllib.request
+from collections import Counter
+from datetime import datetime, timedelta
 from multiprocessing import Pool, cpu_count
 
-from cassandra.cluster import Cluster
-from cassandra.policies import RoundRobinPolicy
 from cassandra.concurrent import execute_concurrent_with_args
 from pybloom_live import BloomFilter  # pip install pybloom-live
 
+from conexion_cassandra import CONFIG, conectar
+
 # —————— Configuración ——————
-CASSANDRA_CONTACT_POINTS = ['127.0.0.1']
-KEYSPACE     = 'semapa_v9'
+KEYSPACE     = CONFIG['keyspace']
 TABLE_READ   = 'lecturas_medidor'
 TABLE_ERROR  = 'errores_iot'
+TABLE_HORA   = 'lecturas_por_hora'
+TABLE_RESUMEN     = 'resumen_hora'
+TABLE_RESUMEN_DIM = 'resumen_hora_dimension'
+TABLE_RESUMEN_DIA = 'resumen_dia'
+SERIE_TOTAL  = 'total'   # partición de resumen_dia con el total de la ciudad
+TABLE_ESTADO = 'estado_carga'
+TABLE_TOP    = 'top_consumo'
+TOP_N        = 100       # candidatos guardados por (periodo, ámbito, grupo); debe coincidir con TOP_N_GUARDADO en Api/Api_v1.py
+GRUPO_TOTAL  = 'total'   # grupo de top_consumo con toda la ciudad
+CLAVE_ESTADO = 'lecturas'   # debe coincidir con MARCA_CLAVE en Api/Api_v1.py
+BUCKETS_HORA = 16   # debe coincidir con BUCKETS_HORA en Api/Api_v1.py
 IN_DIR       = './lecturas'
 CONCURRENCY  = 200
 NUM_PROCESSES = max(1, cpu_count() - 1)
+API_URL      = 'http://127.0.0.1:8000'   # para invalidar la caché de la API tras la carga
 
 # CQL
 INSERT_READ_CQL = f"""
@@ -25,27 +41,244 @@ INSERT INTO {KEYSPACE}.{TABLE_READ} (
     lectura, consumo_periodo, tarifa_usd, fecha_instalacion
 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
 """
+INSERT_HORA_CQL = f"""
+INSERT INTO {KEYSPACE}.{TABLE_HORA} (
+    fecha_hora, bucket, codigo_medidor, modelo, estado,
+    lectura, consumo_periodo, tarifa_usd
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
 INSERT_ERR_CQL = f"""
 INSERT INTO {KEYSPACE}.{TABLE_ERROR} (
     codigo_medidor, fecha_hora, tipo_error
 ) VALUES (?, ?, ?)
 """
+# Rollups horarios (tablas counter: volver a cargar los mismos archivos duplica los totales)
+UPDATE_RESUMEN_CQL = f"""
+UPDATE {KEYSPACE}.{TABLE_RESUMEN}
+   SET consumo_total = consumo_total + ?,
+       lecturas = lecturas + ?,
+       medidores = medidores + ?,
+       medidores_con_errores = medidores_con_errores + ?
+ WHERE fecha_hora = ?
+"""
+UPDATE_RESUMEN_DIM_CQL = f"""
+UPDATE {KEYSPACE}.{TABLE_RESUMEN_DIM}
+   SET cantidad = cantidad + ?,
+       consumo = consumo + ?
+ WHERE fecha_hora = ? AND dimension = ? AND clave = ?
+"""
+UPDATE_RESUMEN_DIA_CQL = f"""
+UPDATE {KEYSPACE}.{TABLE_RESUMEN_DIA}
+   SET consumo_total = consumo_total + ?,
+       lecturas = lecturas + ?
+ WHERE serie = ? AND fecha = ?
+"""
+# Top de consumidores por hora y por día (toda la ciudad y por zona). Las cargas
+# se reparten por contratos: el top guardado de cada (periodo, ámbito, grupo) se
+# une con el de la carga (la carga manda para los ids que trae) y la partición
+# se borra y reescribe con los TOP_N mejores. Si resumen_hora ya tiene horas de
+# un día que esta carga no trae, el día está partido por horas entre cargas: los
+# totales diarios por id no se pueden unir y su top se descarta.
+SELECT_TOP_CQL = f"""
+SELECT consumo, id FROM {KEYSPACE}.{TABLE_TOP} WHERE periodo = ? AND ambito = ? AND grupo = ?
+"""
+DELETE_TOP_CQL = f"""
+DELETE FROM {KEYSPACE}.{TABLE_TOP} WHERE periodo = ? AND ambito = ? AND grupo = ?
+"""
+INSERT_TOP_CQL = f"""
+INSERT INTO {KEYSPACE}.{TABLE_TOP} (periodo, ambito, grupo, consumo, id)
+VALUES (?, ?, ?, ?, ?)
+"""
+SELECT_RESUMEN_CQL = f"""
+SELECT fecha_hora FROM {KEYSPACE}.{TABLE_RESUMEN} WHERE fecha_hora = ?
+"""
+# Marca de agua de la ingesta: la API trata como inmutables las horas anteriores
+SELECT_ESTADO_CQL = f"""
+SELECT fecha_hora FROM {KEYSPACE}.{TABLE_ESTADO} WHERE clave = ?
+"""
+UPDATE_ESTADO_CQL = f"""
+UPDATE {KEYSPACE}.{TABLE_ESTADO}
+   SET fecha_hora = ?, version = ?, actualizado = ?
+ WHERE clave = ?
+"""
+SELECT_INFRA_CQL = f"""
+SELECT contrato_id, medidores, zona, descripcion_categoria FROM {KEYSPACE}.infraestructura
+"""
+
+# medidor -> (zona, categoría, contrato); se rellena en cada worker desde init_worker
+MAPA_MEDIDORES = {}
+
+def bucket_hora(codigo_medidor):
+    """Shard estable (crc32) del medidor dentro de la partición de su hora."""
+    return zlib.crc32(codigo_medidor.encode('utf-8')) % BUCKETS_HORA
+
+def init_worker(mapa_medidores):
+    """Inicializa el mapa medidor -> (zona, categoría, contrato) en cada worker (no Cassandra)."""
+    global MAPA_MEDIDORES
+    MAPA_MEDIDORES = mapa_medidores
+
+def cargar_mapa_medidores():
+    """Lee infraestructura una sola vez y devuelve {medidor: (zona, categoría, contrato)}."""
+    session = conectar()
+    mapa = {}
+    for r in session.execute(SELECT_INFRA_CQL):
+        zona = r.zona or "SIN_ZONA"
+        categoria = (r.descripcion_categoria or "Otros").strip().title()
+        for med in r.medidores or []:
+            mapa[med] = (zona, categoria, r.contrato_id)
+    session.cluster.shutdown()
+    return mapa
+
+def resumir_por_hora(inserts_read, inserts_err):
+    """
+    Agrega las lecturas válidas y los errores de un archivo por hora:
+    {fecha_hora: {"consumo_total", "lecturas", "medidores", "medidores_con_errores",
+                  "dimensiones": {(dimension, clave): [cantidad, consumo]}}}
+    """
+    resumen = {}
+    medidores = {}
+    medidores_err = {}
+
+    def hora(fh):
+        if fh not in resumen:
+            resumen[fh] = {"consumo_total": 0, "lecturas": 0, "medidores": 0,
+                           "medidores_con_errores": 0, "dimensiones": {}}
+            medidores[fh] = set()
+            medidores_err[fh] = set()
+        return resumen[fh]
+
+    def sumar(r, dimension, clave, consumo):
+        acc = r["dimensiones"].setdefault((dimension, clave), [0, 0])
+        acc[0] += 1
+        acc[1] += consumo
+
+    for cod, fh, _antena, modelo, _estado, _lectura, consumo, _tarifa, _inst in inserts_read:
+        r = hora(fh)
+        r["consumo_total"] += consumo
+        r["lecturas"] += 1
+        medidores[fh].add(cod)
+        zona, categoria, _ = MAPA_MEDIDORES.get(cod, ("SIN_ZONA", "Otros", None))
+        sumar(r, "zona", zona, consumo)
+        sumar(r, "categoria", categoria, consumo)
+        sumar(r, "modelo", modelo or "DESCONOCIDO", consumo)
 
-def init_worker():
-    """Inicializa BloomFilter en cada worker (no Cassandra)."""
-    pass
+    for cod, fh, tipo_error in inserts_err:
+        if cod is None or not isinstance(fh, datetime):
+            continue
+        r = hora(fh)
+        sumar(r, "tipo_error", tipo_error, 0)
+        if cod not in medidores_err[fh]:
+            medidores_err[fh].add(cod)
+            zona, _, _ = MAPA_MEDIDORES.get(cod, ("SIN_ZONA", "Otros", None))
+            sumar(r, "errores_zona", zona, 0)
+
+    for fh, r in resumen.items():
+        r["medidores"] = len(medidores[fh])
+        r["medidores_con_errores"] = len(medidores_err[fh])
+    return resumen
+
+def combinar_resumen(total, parcial):
+    """Suma un resumen por hora de un archivo sobre el acumulado global."""
+    for fh, r in parcial.items():
+        if fh not in total:
+            total[fh] = r
+            continue
+        t = total[fh]
+        for campo in ("consumo_total", "lecturas", "medidores", "medidores_con_errores"):
+            t[campo] += r[campo]
+        for clave, (cantidad, consumo) in r["dimensiones"].items():
+            acc = t["dimensiones"].setdefault(clave, [0, 0])
+            acc[0] += cantidad
+            acc[1] += consumo
+
+def resumir_por_dia(resumen):
+    """Totales diarios {fecha: [consumo_total, lecturas]} a partir del resumen por hora."""
+    dias = {}
+    for fh, r in resumen.items():
+        acc = dias.setdefault(fh.date(), [0, 0])
+        acc[0] += r["consumo_total"]
+        acc[1] += r["lecturas"]
+    return dias
+
+def empujar_top(heap, item):
+    """Mantiene en `heap` (min-heap) los TOP_N mayores (consumo, id) vistos."""
+    if len(heap) < TOP_N:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+def resumir_top(inserts_read):
+    """
+    Consumo por medidor y por contrato de un archivo, por hora y por día, en
+    min-heaps acotados a TOP_N: {(periodo, ámbito, grupo): [(consumo, id)]}.
+    Cada archivo trae todas las lecturas de sus medidores, así que sus totales
+    por medidor/contrato ya son completos y solo compiten contra otros archivos.
+    """
+    totales = {}
+    for cod, fh, _antena, _modelo, _estado, _lectura, consumo, _tarifa, _inst in inserts_read:
+        zona, _, contrato = MAPA_MEDIDORES.get(cod, ("SIN_ZONA", "Otros", None))
+        for periodo in (fh.strftime("%Y-%m-%d %H:%M"), fh.strftime("%Y-%m-%d")):
+            for ambito, ident in (("medidor", cod), ("contrato", contrato)):
+                if ident is not None:
+                    clave = (periodo, ambito, ident, zona)
+                    totales[clave] = totales.get(clave, 0) + consumo
+
+    tops = {}
+    for (periodo, ambito, ident, zona), consumo in totales.items():
+        for grupo in (GRUPO_TOTAL, zona):
+            empujar_top(tops.setdefault((periodo, ambito, grupo), []), (consumo, ident))
+    return tops
+
+def combinar_top(total, parcial):
+    """Une los tops de un archivo al acumulado sin pasar de TOP_N por clave."""
+    for clave, heap in parcial.items():
+        acumulado = total.setdefault(clave, [])
+        for item in heap:
+            empujar_top(acumulado, item)
+
+def unir_top_guardado(session, select_top_ps, tops):
+    """
+    Suma a cada heap de `tops` las filas ya guardadas de su partición, salvo
+    los ids que trae esta carga (su total nuevo reemplaza al guardado).
+    """
+    claves = list(tops.keys())
+    guardados = execute_concurrent_with_args(session, select_top_ps, claves, concurrency=CONCURRENCY)
+    for clave, (_, filas) in zip(claves, guardados):
+        heap = tops[clave]
+        nuevos = {ident for _, ident in heap}
+        for r in filas:
+            if r.id not in nuevos:
+                empujar_top(heap, (r.consumo, r.id))
+
+def dias_parciales(session, select_resumen_ps, fechas_hora):
+    """
+    Días de la carga con horas ya guardadas en resumen_hora que esta carga no
+    trae (se consulta antes de actualizar los rollups). Su top diario saldría
+    solo con una parte del día.
+    """
+    cargadas = set(fechas_hora)
+    horas = [
+        datetime.combine(dia, datetime.min.time()) + timedelta(hours=h)
+        for dia in sorted({fh.date() for fh in cargadas})
+        for h in range(24)
+    ]
+    resultados = execute_concurrent_with_args(
+        session, select_resumen_ps, [(h,) for h in horas], concurrency=CONCURRENCY
+    )
+    return {h.date() for h, (_, filas) in zip(horas, resultados) if h not in cargadas and filas.one()}
 
 def procesar_archivo(archivo):
-    """Lee un JSON y genera listas de params para lecturas y errores."""
+    """Lee un JSON y genera params para lecturas, lecturas por hora, errores y su resumen horario."""
     bloom = BloomFilter(capacity=1_000_000, error_rate=0.001)
     inserts_read = []
+    inserts_hora = []
     inserts_err  = []
 
     path = os.path.join(IN_DIR, archivo)
     try:
         data = json.load(open(path, encoding='utf-8'))
     except:
-        return inserts_read, inserts_err
+        return inserts_read, inserts_hora, inserts_err, {}, {}
 
     for rec in data:
         try:
@@ -63,23 +296,62 @@ def procesar_archivo(archivo):
                 inserts_err.append((cod, fh, estado or "Sin estado"))
                 continue
 
+            modelo  = rec.get("Modelo","")
+            lectura = int(rec.get("Lectura",0))
+            consumo = int(rec.get("ConsumoPeriodo",0))
+            tarifa  = float(str(rec.get("TarifaUSD","$0")).replace("$",""))
             inserts_read.append((
                 cod, fh,
                 int(rec.get("Antena",0)),
-                rec.get("Modelo",""),
+                modelo,
                 estado,
-                int(rec.get("Lectura",0)),
-                int(rec.get("ConsumoPeriodo",0)),
-                float(str(rec.get("TarifaUSD","$0")).replace("$","")),
+                lectura,
+                consumo,
+                tarifa,
                 datetime.strptime(rec["FechaInstalacion"],"%Y-%m-%d").date()
             ))
+            inserts_hora.append((
+                fh, bucket_hora(cod), cod, modelo, estado, lectura, consumo, tarifa
+            ))
         except:
             try:
                 inserts_err.append((rec.get("CodigoMedidor"), fh, "PARSE_ERROR"))
             except:
                 pass
 
-    return inserts_read, inserts_err
+    return (inserts_read, inserts_hora, inserts_err,
+            resumir_por_hora(inserts_read, inserts_err), resumir_top(inserts_read))
+
+def actualizar_marca_carga(session, select_estado_ps, update_estado_ps, fechas_hora):
+    """
+    Sube la marca de agua a la hora más reciente cargada (nunca la baja) y
+    cambia la versión de datos, así los ETags de la API se renuevan.
+    """
+    if not fechas_hora:
+        return
+    actual = session.execute(select_estado_ps, (CLAVE_ESTADO,)).one()
+    marca = max(fechas_hora)
+    if actual and actual.fecha_hora and actual.fecha_hora > marca:
+        marca = actual.fecha_hora
+    version = uuid.uuid4().hex[:12]
+    session.execute(update_estado_ps, (marca, version, datetime.utcnow(), CLAVE_ESTADO))
+    print(f"→ Marca de agua de la ingesta: {marca:%Y-%m-%d %H:%M} (versión {version})", flush=True)
+
+def invalidar_cache_api(fechas_hora):
+    """Pide a la API que descarte las respuestas cacheadas de las horas cargadas."""
+    cuerpo = json.dumps({
+        "fechas_hora": sorted(fh.strftime("%Y-%m-%d %H:%M") for fh in fechas_hora)
+    }).encode('utf-8')
+    req = urllib.request.Request(
+        f"{API_URL}/admin/cache/invalidar", data=cuerpo,
+        headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            eliminadas = json.load(resp).get("eliminadas", 0)
+        print(f"→ Caché de la API invalidada ({eliminadas} respuestas).", flush=True)
+    except Exception as e:
+        print(f"⚠️  No se pudo invalidar la caché de la API: {e}", flush=True)
 
 def chunked(lst, n):
     """Divide la lista lst en sublistas de tamaño n."""
@@ -93,15 +365,24 @@ def main():
 
     t0 = time.time()
     all_reads = []
+    all_horas = []
     all_errs  = []
+    resumen   = {}
+    tops      = {}
     file_count = 0
 
-    # 1) Parseo y validación en paralelo
-    with Pool(NUM_PROCESSES, initializer=init_worker) as pool:
-        for reads, errs in pool.imap_unordered(procesar_archivo, archivos):
+    print("→ Cargando mapa medidor → zona/categoría...", flush=True)
+    mapa_medidores = cargar_mapa_medidores()
+
+    # 1) Parseo, validación y agregación horaria en paralelo
+    with Pool(NUM_PROCESSES, initializer=init_worker, initargs=(mapa_medidores,)) as pool:
+        for reads, horas, errs, parcial, top_parcial in pool.imap_unordered(procesar_archivo, archivos):
             file_count += 1
             all_reads.extend(reads)
+            all_horas.extend(horas)
             all_errs.extend(errs)
+            combinar_resumen(resumen, parcial)
+            combinar_top(tops, top_parcial)
             print(
                 f"\r✅ {len(all_reads)} lecturas válidas, "
                 f"{len(all_errs)} errores, "
@@ -110,10 +391,19 @@ def main():
             )
 
     print("\n→ Conectando a Cassandra para insertar...", flush=True)
-    cluster = Cluster(CASSANDRA_CONTACT_POINTS, load_balancing_policy=RoundRobinPolicy())
-    session = cluster.connect(KEYSPACE)
+    session = conectar()
     read_ps = session.prepare(INSERT_READ_CQL)
+    hora_ps = session.prepare(INSERT_HORA_CQL)
     err_ps  = session.prepare(INSERT_ERR_CQL)
+    resumen_ps     = session.prepare(UPDATE_RESUMEN_CQL)
+    resumen_dim_ps = session.prepare(UPDATE_RESUMEN_DIM_CQL)
+    resumen_dia_ps = session.prepare(UPDATE_RESUMEN_DIA_CQL)
+    top_ps         = session.prepare(INSERT_TOP_CQL)
+    delete_top_ps  = session.prepare(DELETE_TOP_CQL)
+    select_top_ps  = session.prepare(SELECT_TOP_CQL)
+    select_resumen_ps = session.prepare(SELECT_RESUMEN_CQL)
+    select_estado_ps = session.prepare(SELECT_ESTADO_CQL)
+    update_estado_ps = session.prepare(UPDATE_ESTADO_CQL)
 
     # 2) Inserción con contador de progreso
     total_reads = len(all_reads)
@@ -125,6 +415,14 @@ def main():
         print(f"\r   Lecturas insertadas: {inserted_reads}/{total_reads}", end='', flush=True)
     print()  # salto de línea
 
+    inserted_horas = 0
+    print(f"→ Inyectando {len(all_horas)} lecturas en {TABLE_HORA}...", flush=True)
+    for batch in chunked(all_horas, CONCURRENCY):
+        execute_concurrent_with_args(session, hora_ps, batch, concurrency=CONCURRENCY)
+        inserted_horas += len(batch)
+        print(f"\r   Lecturas por hora insertadas: {inserted_horas}/{len(all_horas)}", end='', flush=True)
+    print()  # salto de línea
+
     total_errs = len(all_errs)
     inserted_errs = 0
     print(f"→ Inyectando {total_errs} errores en Cassandra...", flush=True)
@@ -134,6 +432,51 @@ def main():
         print(f"\r   Errores insertados: {inserted_errs}/{total_errs}", end='', flush=True)
     print()  # salto de línea
 
+    # Antes de sumar esta carga a resumen_hora: días que ya tenían horas de otra carga
+    parciales = dias_parciales(session, select_resumen_ps, resumen.keys())
+
+    # 3) Rollups: una fila por hora, una por (hora, dimensión, clave) y una por día
+    resumen_params = [
+        (r["consumo_total"], r["lecturas"], r["medidores"], r["medidores_con_errores"], fh)
+        for fh, r in resumen.items()
+    ]
+    resumen_dim_params = [
+        (cantidad, consumo, fh, dimension, clave)
+        for fh, r in resumen.items()
+        for (dimension, clave), (cantidad, consumo) in r["dimensiones"].items()
+    ]
+    print(f"→ Actualizando rollups de {len(resumen_params)} horas...", flush=True)
+    for batch in chunked(resumen_params, CONCURRENCY):
+        execute_concurrent_with_args(session, resumen_ps, batch, concurrency=CONCURRENCY)
+    for batch in chunked(resumen_dim_params, CONCURRENCY):
+        execute_concurrent_with_args(session, resumen_dim_ps, batch, concurrency=CONCURRENCY)
+    resumen_dia_params = [
+        (consumo, lecturas, SERIE_TOTAL, fecha)
+        for fecha, (consumo, lecturas) in resumir_por_dia(resumen).items()
+    ]
+    execute_concurrent_with_args(session, resumen_dia_ps, resumen_dia_params, concurrency=CONCURRENCY)
+
+    # 4) Top de consumidores: como mucho TOP_N filas por (periodo, ámbito, grupo),
+    #    unidas con lo ya guardado y reescribiendo cada partición; los días
+    #    partidos por horas entre cargas solo se borran
+    for dia in sorted(parciales):
+        print(f"⚠️  {dia:%Y-%m-%d} ya tenía horas de otra carga: no se guarda su top diario "
+              f"(vuelva a cargar el día completo)", flush=True)
+    descartados = {dia.strftime("%Y-%m-%d") for dia in parciales}
+    unir_top_guardado(session, select_top_ps, {k: h for k, h in tops.items() if k[0] not in descartados})
+    execute_concurrent_with_args(session, delete_top_ps, list(tops.keys()), concurrency=CONCURRENCY)
+    top_params = [
+        (periodo, ambito, grupo, consumo, ident)
+        for (periodo, ambito, grupo), heap in tops.items() if periodo not in descartados
+        for consumo, ident in heap
+    ]
+    print(f"→ Guardando top de consumidores de {len(tops)} periodos/grupos...", flush=True)
+    for batch in chunked(top_params, CONCURRENCY):
+        execute_concurrent_with_args(session, top_ps, batch, concurrency=CONCURRENCY)
+
+    actualizar_marca_carga(session, select_estado_ps, update_estado_ps, list(resumen.keys()))
+    invalidar_cache_api(resumen.keys())
+
     elapsed = time.time() - t0
     m, s = divmod(int(elapsed), 60)
     print(f"\n🎉 ¡Hecho en {m}m{s}s! Insertadas {inserted_reads} lecturas y {inserted_errs} errores.", flush=True)
@@ -0,0 +1,125 @@
+# conexion_cassandra.py
+#
+# Conexión común a Cassandra para la API, los cargadores y los scripts de
+# exportación. La configuración sale, en este orden de prioridad, de:
+#   1) variables de entorno SEMAPA_CASSANDRA_* / SEMAPA_KEYSPACE
+#   2) un JSON (SEMAPA_CASSANDRA_CONFIG o cassandra.json junto a este archivo)
+#   3) CONFIG_POR_DEFECTO
+#
+# Ver cassandra.example.json para las claves disponibles.
+
+import json
+import os
+
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import (
+    ConstantSpeculativeExecutionPolicy, DCAwareRoundRobinPolicy, TokenAwarePolicy
+)
+from cassandra.query import named_tuple_factory
+
+try:
+    from greplin import scales  # pip install scales (cluster.metrics del driver)
+except ImportError:
+    scales = None
+
+CONFIG_POR_DEFECTO = {
+    "contact_points": ["127.0.0.1"],
+    "port": 9042,
+    "keyspace": "semapa_v10",       # el de Database/Semapa_simulacion.cql
+    "local_dc": None,               # None: el DC del primer contact point
+    "protocol_version": 4,
+    "connect_timeout": 5.0,         # segundos para abrir cada conexión
+    "request_timeout": 10.0,        # segundos por consulta (perfil por defecto)
+    "timeout_escaneo": 120.0,       # segundos por página en recorridos completos
+    "speculative_delay": 0.05,      # segundos antes de repetir una lectura idempotente (0 = sin especulación)
+    "speculative_max_intentos": 2,
+    "executor_threads": 2,          # hilos del driver para callbacks
+    "metrics_enabled": True,        # cluster.metrics (solo si scales está instalado)
+}
+
+# Variable de entorno -> (clave, conversión)
+VARIABLES_ENTORNO = {
+    "SEMAPA_CASSANDRA_HOSTS": ("contact_points", lambda v: [h.strip() for h in v.split(",") if h.strip()]),
+    "SEMAPA_CASSANDRA_PORT": ("port", int),
+    "SEMAPA_KEYSPACE": ("keyspace", str),
+    "SEMAPA_CASSANDRA_DC": ("local_dc", str),
+    "SEMAPA_CASSANDRA_TIMEOUT": ("request_timeout", float),
+    "SEMAPA_CASSANDRA_SPECULATIVE_DELAY": ("speculative_delay", float),
+    "SEMAPA_CASSANDRA_SPECULATIVE_INTENTOS": ("speculative_max_intentos", int),
+}
+
+# Perfil para recorridos largos (exportación, backfill): más tiempo por página, sin especulación
+PERFIL_ESCANEO = "escaneo"
+
+def cargar_config() -> dict:
+    """Configuración efectiva: valores por defecto, luego el JSON y luego el entorno."""
+    config = dict(CONFIG_POR_DEFECTO)
+
+    ruta = os.environ.get("SEMAPA_CASSANDRA_CONFIG") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "cassandra.json"
+    )
+    if os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as f:
+            for clave, valor in json.load(f).items():
+                if clave not in CONFIG_POR_DEFECTO:
+                    raise ValueError(f"Clave desconocida '{clave}' en {ruta}")
+                config[clave] = valor
+
+    for variable, (clave, convertir) in VARIABLES_ENTORNO.items():
+        valor = os.environ.get(variable)
+        if valor:
+            config[clave] = convertir(valor)
+    return config
+
+CONFIG = cargar_config()
+
+def crear_cluster(row_factory=named_tuple_factory, config: dict = None) -> Cluster:
+    """
+    Cluster con enrutamiento token-aware sobre DC local, timeouts de la
+    configuración y ejecución especulativa para las consultas marcadas como
+    idempotentes (ver preparar_lectura).
+    """
+    config = config or CONFIG
+    balanceo = TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=config["local_dc"]))
+    especulacion = None
+    if config["speculative_delay"] > 0 and config["speculative_max_intentos"] > 0:
+        especulacion = ConstantSpeculativeExecutionPolicy(
+            config["speculative_delay"], config["speculative_max_intentos"]
+        )
+
+    perfiles = {
+        EXEC_PROFILE_DEFAULT: ExecutionProfile(
+            load_balancing_policy=balanceo,
+            request_timeout=config["request_timeout"],
+            row_factory=row_factory,
+            speculative_execution_policy=especulacion,
+        ),
+        PERFIL_ESCANEO: ExecutionProfile(
+            load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=config["local_dc"])),
+            request_timeout=config["timeout_escaneo"],
+            row_factory=row_factory,
+        ),
+    }
+    return Cluster(
+        config["contact_points"],
+        port=config["port"],
+        protocol_version=config["protocol_version"],
+        connect_timeout=config["connect_timeout"],
+        executor_threads=config["executor_threads"],
+        metrics_enabled=bool(config["metrics_enabled"] and scales is not None),
+        execution_profiles=perfiles,
+    )
+
+def conectar(row_factory=named_tuple_factory, config: dict = None):
+    """Sesión sobre el keyspace configurado; cerrar con session.cluster.shutdown()."""
+    config = config or CONFIG
+    return crear_cluster(row_factory, config).connect(config["keyspace"])
+
+def preparar_lectura(session, cql: str):
+    """
+    Prepara un SELECT y lo marca idempotente: solo así el driver puede
+    repetirlo en otra réplica (ejecución especulativa) si la primera tarda.
+    """
+    stmt = session.prepare(cql)
+    stmt.is_idempotent = True
+    return stmt
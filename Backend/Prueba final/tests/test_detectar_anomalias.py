@@ -0,0 +1,81 @@
+import os
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Detectar_anomalias as A
+
+@pytest.fixture
+def ventanas_cortas(monkeypatch):
+    monkeypatch.setattr(A, "VENTANA_DIAS", 3)
+    monkeypatch.setattr(A, "MIN_HISTORIA", 2)
+    monkeypatch.setattr(A, "STD_MINIMO", 0.1)
+    monkeypatch.setattr(A, "NOCHES_SEGUIDAS", 2)
+    monkeypatch.setattr(A, "Z_NOCHE", 3.0)
+    monkeypatch.setattr(A, "NOCHE_MINIMO", 50)
+
+def test_zscores_moviles_usa_solo_la_ventana_anterior(ventanas_cortas):
+    serie = np.array([[[10.0, 20.0, 30.0, 40.0, np.nan, 100.0]]])   # [hora, medidor, dia]
+    media, z = A.zscores_moviles(serie)
+
+    # día 2: ventana = días 0 y 1 -> media 15, std 5
+    assert media[0, 0, 2] == pytest.approx(15.0)
+    assert z[0, 0, 2] == pytest.approx((30.0 - 15.0) / 5.0)
+    # día 3: ventana = días 0..2 (VENTANA_DIAS = 3), no incluye el propio día
+    assert media[0, 0, 3] == pytest.approx(20.0)
+    assert z[0, 0, 3] == pytest.approx((40.0 - 20.0) / np.std([10.0, 20.0, 30.0]))
+    # día 5: ventana = días 2..4, el NaN del día 4 no cuenta
+    assert media[0, 0, 5] == pytest.approx(35.0)
+    assert z[0, 0, 5] == pytest.approx((100.0 - 35.0) / 5.0)
+    # sin MIN_HISTORIA previas o sin lectura propia: z NaN
+    assert np.isnan(z[0, 0, :2]).all()
+    assert np.isnan(z[0, 0, 4])
+
+def test_zscores_moviles_piso_de_desviacion(ventanas_cortas):
+    serie = np.array([[[5.0, 5.0, 5.0, 6.0]]])
+    _, z = A.zscores_moviles(serie)
+    assert z[0, 0, 3] == pytest.approx((6.0 - 5.0) / 0.1)
+
+def test_detectar_flujo_nocturno(ventanas_cortas):
+    horas = np.array([0, 8])
+    dias = 5                                      # 3 de historia + 2 noches evaluadas
+    valores = np.full((2, 4, dias), 10.0)
+    valores[1] = 500.0                            # las 08:00 no son noche: no influyen
+    valores[0, 0, 3:] = 400.0                     # fuga: las 2 últimas noches altas
+    valores[0, 1, 4] = 400.0                      # solo la última noche alta
+    valores[0, 2, 3:] = 400.0
+    valores[0, 2, 3] = np.nan                     # falta una de las noches recientes
+    valores[0, 3, 3:] = 40.0                      # alto en z pero bajo NOCHE_MINIMO
+
+    resultado = A.detectar_flujo_nocturno(horas, valores, [dias - 1])
+    marcados = resultado[dias - 1]
+    assert [m for m, *_ in marcados] == [0]
+    m, z, minimo, mediana, hora = marcados[0]
+    assert (minimo, mediana, hora) == (400.0, 10.0, 0)
+    assert z == pytest.approx((400.0 - 10.0) / 0.1)
+
+def test_detectar_flujo_nocturno_sin_horas_de_noche(ventanas_cortas):
+    valores = np.full((1, 2, 5), 100.0)
+    assert A.detectar_flujo_nocturno(np.array([8]), valores, [4]) == {4: []}
+
+def test_volcar_pagina_escribe_en_el_cubo():
+    Fila = namedtuple("Fila", "codigo_medidor fecha_hora consumo_periodo")
+    posicion = {"M1": 0, "M2": 1}
+    valores = np.full((24, 2, 3), np.nan)
+    filas = [
+        Fila("M1", datetime(2025, 4, 1, 0, 0), 120),
+        Fila("M2", datetime(2025, 4, 3, 16, 0), 40),
+        Fila("M2", datetime(2025, 4, 2, 8, 0), None),
+        Fila("M9", datetime(2025, 4, 2, 8, 0), 10),     # medidor desconocido
+    ]
+    desconocidas = A.volcar_pagina(filas, posicion, np.datetime64("2025-04-01", "D"), valores)
+
+    assert desconocidas == 1
+    assert valores[0, 0, 0] == 120.0
+    assert valores[16, 1, 2] == 40.0
+    assert np.isnan(valores[8, 1, 1])
+    assert np.count_nonzero(~np.isnan(valores)) == 2
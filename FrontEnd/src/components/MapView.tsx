@@ -2,7 +2,8 @@ import React, { useEffect, useRef, useState, useCallback } from 'react';
 import { MapContainer, TileLayer, CircleMarker, Popup, Polygon, useMap } from 'react-leaflet';
 import { HeatmapLayer } from 'react-leaflet-heatmap-layer-v3';
 import 'leaflet/dist/leaflet.css';
-import { fetchVisiblePoints, fetchMedidorDetailByContratoID, fetchIdentificarPorBusqueda } from '../services/api';
+import { fetchVisiblePoints, fetchMedidorDetailByContratoID, fetchIdentificarPorBusqueda, fetchHeatmap, fetchTile, fetchClusters } from '../services/api';
+import type { HeatmapPoint, ClusterPoint } from '../services/api';
 import type { Zone } from '../types';
 import { LatLngBounds, Map } from 'leaflet';
 import booleanPointInPolygon from '@turf/boolean-point-in-polygon';
@@ -12,6 +13,31 @@ import './MapView.css';
 import { FaWhatsapp } from 'react-icons/fa';
 import { MdSms, MdEmail } from 'react-icons/md';
 
+// Desde este zoom se piden los contratos por tiles (/tiles/{z}/{x}/{y}) y se
+// dibujan uno a uno; por debajo se piden /lecturas/clusters.
+// Debe estar entre TILE_ZOOM_MIN y TILE_ZOOM_MAX de Api_v1.py.
+const ZOOM_PUNTOS = 14;
+const TILE_ZOOM_MAX = 20;   // debe coincidir con TILE_ZOOM_MAX de Api_v1.py
+
+function tileDe(lat: number, lon: number, z: number): [number, number] {
+  const n = 2 ** z;
+  const x = Math.floor(((lon + 180) / 360) * n);
+  const rad = (lat * Math.PI) / 180;
+  const y = Math.floor(((1 - Math.log(Math.tan(rad) + 1 / Math.cos(rad)) / Math.PI) / 2) * n);
+  return [Math.min(Math.max(x, 0), n - 1), Math.min(Math.max(y, 0), n - 1)];
+}
+
+async function puntosPorTiles(bounds: LatLngBounds, zoom: number): Promise<any[]> {
+  const z = Math.min(zoom, TILE_ZOOM_MAX);
+  const [x0, y0] = tileDe(bounds.getNorth(), bounds.getWest(), z);
+  const [x1, y1] = tileDe(bounds.getSouth(), bounds.getEast(), z);
+  const pedidos: Promise<any[]>[] = [];
+  for (let x = x0; x <= x1; x++) {
+    for (let y = y0; y <= y1; y++) pedidos.push(fetchTile(z, x, y));
+  }
+  return (await Promise.all(pedidos)).flat();
+}
+
 interface Props {
   search: string;
   zone: Zone;
@@ -29,6 +55,8 @@ const MapView: React.FC<Props> = ({ search, zone, date, onSelect, onSearchExecut
   const [districtShapes, setDistrictShapes] = useState<Record<string, [number, number][]>>({});
   const [limit, setLimit] = useState<number>(recordLimit ?? 500);
   const [selectedDetail, setSelectedDetail] = useState<any | null>(null);
+  const [heatPoints, setHeatPoints] = useState<HeatmapPoint[]>([]);
+  const [clusters, setClusters] = useState<ClusterPoint[]>([]);
   const mapRef = useRef<Map | null>(null);
   const markerRefs = useRef<Record<string, any>>({});
   const updateTimeoutRef = useRef<NodeJS.Timeout>();
@@ -48,6 +76,15 @@ const MapView: React.FC<Props> = ({ search, zone, date, onSelect, onSearchExecut
       });
   }, []);
 
+  useEffect(() => {
+    if (!date) return;
+    fetchHeatmap(date)
+      .then(setHeatPoints)
+      .catch(() => setHeatPoints([]));
+  }, [date]);
+
+  const heatMax = heatPoints.reduce((m, p) => Math.max(m, p.consumo), 1);
+
   const updateVisiblePoints = useCallback(() => {
     if (!mapRef.current) return;
     if (updateTimeoutRef.current) clearTimeout(updateTimeoutRef.current);
@@ -64,14 +101,36 @@ const MapView: React.FC<Props> = ({ search, zone, date, onSelect, onSearchExecut
       const lon_min = bounds.getSouthWest().lng;
       const lon_max = bounds.getNorthEast().lng;
 
-      const data = await fetchVisiblePoints({
-        fecha_hora: fechaHora,
-        lat_min,
-        lat_max,
-        lon_min,
-        lon_max,
-        record_limit: limit,
-      });
+      if (currentZoom < ZOOM_PUNTOS) {
+        const grupos = await fetchClusters({
+          fecha_hora: fechaHora,
+          lat_min,
+          lat_max,
+          lon_min,
+          lon_max,
+          zoom: currentZoom,
+        }).catch(() => []);
+        setClusters(grupos);
+        return;
+      }
+
+      // Tiles: el navegador los cachea (ETag/Cache-Control) y se reusan al
+      // volver a pasar por la zona; /lecturas queda como respaldo
+      let data: any[];
+      try {
+        data = (await puntosPorTiles(bounds, currentZoom)).filter(p =>
+          p.Latitud >= lat_min && p.Latitud <= lat_max && p.Longitud >= lon_min && p.Longitud <= lon_max
+        ).slice(0, limit);
+      } catch {
+        data = await fetchVisiblePoints({
+          fecha_hora: fechaHora,
+          lat_min,
+          lat_max,
+          lon_min,
+          lon_max,
+          record_limit: limit,
+        });
+      }
 
       const key = zone.distritoId?.toString();
       let filtered = data;
@@ -157,7 +216,6 @@ const MapView: React.FC<Props> = ({ search, zone, date, onSelect, onSearchExecut
           <option value={1000}>1000</option>
           <option value={5000}>5000</option>
           <option value={10000}>10000</option>
-          <option value={30000}>Todos (30 000)</option>
         </select>
       </div>
 
@@ -169,21 +227,36 @@ const MapView: React.FC<Props> = ({ search, zone, date, onSelect, onSearchExecut
           <Polygon positions={currentPolygon} pathOptions={{ color: 'green', fillOpacity: 0.2 }} />
         )}
 
-        {zoom >= 12 && visiblePoints.length > 0 && (
+        {zoom >= 12 && heatPoints.length > 0 && (
           <HeatmapLayer
             fitBoundsOnLoad={false}
             fitBoundsOnUpdate={false}
-            points={visiblePoints.map(c => ({ lat: c.Latitud, lng: c.Longitud, consumo: 1 }))}
+            points={heatPoints}
             longitudeExtractor={(m: any) => m.lng}
             latitudeExtractor={(m: any) => m.lat}
             intensityExtractor={(m: any) => m.consumo}
             radius={18}
             blur={15}
-            max={1000}
+            max={heatMax}
           />
         )}
 
-        {zoom >= 14 && visiblePoints.map((casa) => (
+        {zoom < ZOOM_PUNTOS && clusters.map((c) => (
+          <CircleMarker
+            key={`${c.Latitud},${c.Longitud}`}
+            center={[c.Latitud, c.Longitud]}
+            radius={Math.min(6 + Math.sqrt(c.Contratos), 30)}
+            fillOpacity={0.6}
+            pathOptions={{ color: 'purple' }}
+          >
+            <Popup>
+              <strong>Contratos:</strong> {c.Contratos}<br />
+              <strong>Consumo:</strong> {c.ConsumoPeriodo} m³
+            </Popup>
+          </CircleMarker>
+        ))}
+
+        {zoom >= ZOOM_PUNTOS && visiblePoints.map((casa) => (
           <CircleMarker
             key={casa.ContratoID}
             center={[casa.Latitud, casa.Longitud]}
@@ -1,12 +1,5 @@
 import React, { useEffect, useState } from 'react';
-import {
-  fetchConsumoTotal,
-  fetchMedidoresReportando,
-  fetchMedidoresConErrores,
-  fetchConsumoPromedio,
-  fetchConsumoPorZona,
-  fetchTopErrores
-} from '../services/api';
+import { fetchDashboardSnapshot } from '../services/api';
 
 import ZoneConsumptionChart from './ZoneConsumptionChart';
 import Gauge from './Gauge';
@@ -29,12 +22,14 @@ const StatsDashboard: React.FC<Props> = ({ zone, date }) => {
   const [topErrores, setTopErrores] = useState<Array<{ tipo_error: string; cantidad: number }> | null>(null);
 
   useEffect(() => {
-    fetchConsumoTotal(date).then(setConsumoTotal);
-    fetchMedidoresReportando(date).then(setReportando);
-    fetchMedidoresConErrores(date).then(setConErrores);
-    fetchConsumoPromedio(date).then(setPromedioOMS);
-    fetchConsumoPorZona(date).then(setPorZona);
-    fetchTopErrores(date).then(setTopErrores);
+    fetchDashboardSnapshot(date).then((snap) => {
+      setConsumoTotal(snap.consumo_total);
+      setReportando(snap.medidores_reportando);
+      setConErrores(snap.medidores_con_errores);
+      setPromedioOMS(snap.consumo_promedio);
+      setPorZona(Object.entries(snap.consumo_por_zona).map(([nombre, valor]) => ({ nombre, valor })));
+      setTopErrores(snap.top_errores);
+    });
   }, [date]);
 
   if (
@@ -1,5 +1,8 @@
 const BASE_URL = 'http://localhost:8000';
 
+// debe coincidir con MAX_FETCH_SIZE de Api_v1.py
+const MAX_FETCH_SIZE = 1000;
+
 export async function fetchVisiblePoints(params: {
   fecha_hora: string;
   lat_min: number;
@@ -8,12 +11,69 @@ export async function fetchVisiblePoints(params: {
   lon_max: number;
   record_limit: number;
 }): Promise<any[]> {
-  const url = new URL(`${BASE_URL}/lecturas`);
+  // La API devuelve como mucho MAX_FETCH_SIZE (1000) contratos por página;
+  // se siguen las páginas con X-Next-Cursor hasta juntar record_limit.
+  const puntos: any[] = [];
+  let cursor: string | null = null;
+  do {
+    const url = new URL(`${BASE_URL}/lecturas`);
+    Object.entries(params).forEach(([key, value]) => {
+      if (key === 'record_limit') {
+        value = Math.min(params.record_limit - puntos.length, MAX_FETCH_SIZE);
+      }
+      url.searchParams.append(key, String(value));
+    });
+    if (cursor) url.searchParams.append('cursor', cursor);
+    const res = await fetch(url.toString());
+    if (!res.ok) throw new Error('Error al obtener puntos visibles');
+    puntos.push(...(await res.json()));
+    cursor = res.headers.get('X-Next-Cursor');
+  } while (cursor && puntos.length < params.record_limit);
+  return puntos;
+}
+
+export interface ClusterPoint {
+  Latitud: number;
+  Longitud: number;
+  Contratos: number;
+  ConsumoPeriodo: number;
+}
+
+export async function fetchClusters(params: {
+  fecha_hora: string;
+  lat_min: number;
+  lat_max: number;
+  lon_min: number;
+  lon_max: number;
+  zoom: number;
+}): Promise<ClusterPoint[]> {
+  const url = new URL(`${BASE_URL}/lecturas/clusters`);
   Object.entries(params).forEach(([key, value]) => {
     url.searchParams.append(key, String(value));
   });
   const res = await fetch(url.toString());
-  if (!res.ok) throw new Error('Error al obtener puntos visibles');
+  if (!res.ok) throw new Error('Error al obtener clusters');
+  return await res.json();
+}
+
+export interface HeatmapPoint {
+  id: string;
+  lat: number;
+  lng: number;
+  consumo: number;
+}
+
+export async function fetchHeatmap(fechaHora: string, resolution = 250): Promise<HeatmapPoint[]> {
+  const res = await fetch(
+    `${BASE_URL}/dashboard/heatmap?fecha_hora=${encodeURIComponent(fechaHora)}&resolution=${resolution}`
+  );
+  if (!res.ok) throw new Error('Error al obtener el heatmap');
+  return await res.json();
+}
+
+export async function fetchTile(z: number, x: number, y: number): Promise<any[]> {
+  const res = await fetch(`${BASE_URL}/tiles/${z}/${x}/${y}`);
+  if (!res.ok) throw new Error('Error al obtener el tile');
   return await res.json();
 }
 
@@ -28,6 +88,38 @@ export async function fetchMedidorDetailByContratoID(
   return await res.json();
 }
 
+export interface LecturasBatch {
+  resultados: Record<string, any>;
+  errores: Record<string, string>;
+}
+
+export async function fetchLecturasBatch(ids: string[], fechaHora: string): Promise<LecturasBatch> {
+  const res = await fetch(`${BASE_URL}/lecturas/batch`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ fecha_hora: fechaHora, ids }),
+  });
+  if (!res.ok) throw new Error('Error al obtener lecturas en lote');
+  return await res.json();
+}
+
+export interface ContratoSugerencia {
+  ContratoID: string;
+  Nombre: string;
+  RazonSocial: string;
+  CI_NIT: number;
+  Zona: string;
+  Puntaje: number;
+}
+
+export async function searchContratos(q: string, limit = 10): Promise<ContratoSugerencia[]> {
+  const res = await fetch(
+    `${BASE_URL}/contratos/search?q=${encodeURIComponent(q)}&limit=${limit}`
+  );
+  if (!res.ok) return [];
+  return await res.json();
+}
+
 export async function fetchIdentificarPorBusqueda(
   search: string,
   fechaHora: string
@@ -83,6 +175,73 @@ export async function fetchTopErrores(fechaHora: string): Promise<Array<{ tipo_e
   return await res.json();
 }
 
+export interface Anomalia {
+  codigo_medidor: string;
+  contrato_id: string | null;
+  tipo: 'pico' | 'flujo_nocturno';
+  puntaje: number;
+  consumo: number;
+  esperado: number;
+  fecha_hora: string | null;
+}
+
+export async function fetchAnomalias(fecha: string, tipo?: Anomalia['tipo'], limit = 100): Promise<Anomalia[]> {
+  const url = new URL(`${BASE_URL}/dashboard/anomalias`);
+  url.searchParams.append('fecha', fecha.slice(0, 10));
+  if (tipo) url.searchParams.append('tipo', tipo);
+  url.searchParams.append('limit', String(limit));
+  const res = await fetch(url.toString());
+  if (!res.ok) throw new Error('Error al obtener las anomalías');
+  return await res.json();
+}
+
+export interface TopConsumidor {
+  posicion: number;
+  id: string;
+  consumo: number;
+  contrato_id: string | null;
+  nombre: string | null;
+  zona: string | null;
+  distrito: number | null;
+}
+
+export async function fetchTopConsumidores(params: {
+  fecha_hora?: string;
+  fecha?: string;
+  desde?: string;
+  hasta?: string;
+  ambito?: 'contrato' | 'medidor';
+  zona?: string;
+  n?: number;
+}): Promise<TopConsumidor[]> {
+  const url = new URL(`${BASE_URL}/dashboard/top_consumidores`);
+  Object.entries(params).forEach(([key, value]) => {
+    if (value !== undefined) url.searchParams.append(key, String(value));
+  });
+  const res = await fetch(url.toString());
+  if (!res.ok) throw new Error('Error al obtener el top de consumidores');
+  return await res.json();
+}
+
+
+export interface DashboardSnapshot {
+  consumo_total: number;
+  medidores_reportando: number;
+  medidores_con_errores: number;
+  consumo_promedio: number;
+  consumo_por_zona: Record<string, number>;
+  errores_por_zona: Array<{ zona: string; errores: number }>;
+  top_errores: Array<{ tipo_error: string; cantidad: number }>;
+  modelos_uso: Array<{ modelo: string; cantidad: number }>;
+  consumo_por_categoria: Array<{ categoria: string; consumo: number }>;
+}
+
+export async function fetchDashboardSnapshot(fechaHora: string): Promise<DashboardSnapshot> {
+  const res = await fetch(`${BASE_URL}/dashboard/snapshot?fecha_hora=${encodeURIComponent(fechaHora)}`);
+  if (!res.ok) throw new Error('Error al obtener el resumen del dashboard');
+  return await res.json();
+}
+
 
 
 